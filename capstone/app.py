@@ -1,12 +1,36 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 from streamlit_folium import st_folium
-from streamlit.components.v1 import html
-from modules.load_data import load_accident_data, load_boundary
-from modules.stats import load_data,compute_overview, dataset_inspection
-from modules.temporal_filters import apply_temporal_filters
-from modules.severity_filters import apply_severity_filters
-from modules.map_utils import df_to_gdf, create_map 
-from modules.plots import accident_plot_controls, accident_plot
+from modules.load_data import load_boundary
+from modules.accident_store import load_enriched_data
+from modules.ingest import has_store, load_store
+from modules.narrative import narrative_stats, month_name, ordinal, date_name, join_words
+from modules.validation import validate_accidents, dataset_quality
+from modules.temporal_filters import temporal_filter_spec
+from modules.severity_filters import severity_filter_spec
+from modules.filter_index import filter_frame, filter_state_key
+from modules.map_utils import (df_to_gdf, create_map, create_tile_map, create_hotspot_map,
+                               create_segment_map, create_selection_map, map_selection, boundary_key)
+from modules.query_index import query_frame
+from modules.hotspots import hotspot_labels, hotspot_summary
+from modules.routing import load_network
+from modules.segments import segment_risk
+from modules.tiles import TILE_PORT, start_tile_server, publish_layer, layer_name
+from modules.cube import get_cube
+from modules.plots import accident_plot_controls, accident_figure, show_figure
+from modules.instrumentation import (start_run, stage, timed, finish_run, stage_table, cache_stats,
+                                     metrics_enabled)
+
+# Figures of the narrative section: (breakdown, metric labels, metrics, plot type)
+NARRATIVE_PLOTS = {
+    "plot_month": ("month", ["Number of accidents"], [None], "Bar"),
+    "plot_injuries_month": ("month", ["Minor injuries", "Serious injuries", "Fatalities"],
+                            ["minor_injuries_30d", "serious_injuries_30d", "fatalities_30d"], "Line"),
+    "plot_weekday": ("weekday", ["Number of accidents"], [None], "Pie"),
+    "plot_hour": ("hour", ["Number of accidents"], [None], "Bar"),
+}
 
 
 
@@ -17,11 +41,24 @@ st.markdown(
     "👤 **Author:** [Luca Liebscht](https://www.linkedin.com/in/luca-liebscht-674987212/) | 🎓 Capstone Project – AIM4Mobility Training Programme",
     unsafe_allow_html=True
 )
+# Instrumentation: every stage of this rerun is timed (and memory-traced with the debug panel on)
+debug_panel = st.sidebar.toggle("Show performance panel", False)
+run = start_run(trace_memory=debug_panel)
+if metrics_enabled():
+    # Prometheus text on http://<tile server>/metrics; a taken port is logged and the exporter skipped
+    start_tile_server()
+
+# Independent work of this rerun (loading, aggregation, figure building) runs in worker threads;
+# the workers never call Streamlit, the page only waits on a result where it is displayed
+pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="dashboard")
+
 # Load data
 try:
-    df = load_accident_data()
-    clean_df = load_data(df)
-    boundary_gdf, boundary_lisbon = load_boundary()
+    # Enriched frame comes from the incremental store if one was built, else from the cached CSV
+    data_future = pool.submit(timed, run, "load_data", lambda: load_store() if has_store() else load_enriched_data())
+    boundary_future = pool.submit(timed, run, "load_boundary", load_boundary, display=True)
+    clean_df = data_future.result()
+    boundary_gdf, boundary_lisbon = boundary_future.result()
 
 except Exception as e:
     st.error(f"❌ An error occurred loading the data: {e}")
@@ -29,24 +66,60 @@ except Exception as e:
 
 # Show stats
 st.header("Accident Data Overview")
-overview = compute_overview(df)
-attributes = str(df.columns.to_list()).replace("'", "").replace("[", "").replace("]", "")
-inspec = dataset_inspection(df)
+# Validation: coordinates are checked against the city boundary in bulk (cached per dataset version)
+exclude_outside = st.checkbox("Exclude accidents located outside the Lisbon boundary", False)
+with stage(run, "validation") as record:
+    clean_df, validation = validate_accidents(clean_df, boundary_lisbon,
+                                              action="drop" if exclude_outside else "flag")
+    df = record["frame"] = clean_df[clean_df.attrs["source_columns"]]
+
+# Every number quoted in the text below, read from a per-dataset-version artifact
+with stage(run, "narrative"):
+    narrative = narrative_stats(clean_df)
+
+# Narrative figures are built in the background while the text above them is rendered;
+# they share one cube, built once before any figure slices it
+cube_future = pool.submit(timed, run, "cube", get_cube, clean_df)
+
+
+def narrative_figure(name):
+    cube_future.result()
+    return timed(run, name, accident_figure, clean_df, *NARRATIVE_PLOTS[name])
+
+
+figures = {name: pool.submit(narrative_figure, name) for name in NARRATIVE_PLOTS}
+
+
+def show_narrative_figure(name):
+    try:
+        show_figure(figures[name].result())
+    except Exception as e:
+        st.error(f"❌ An error occurred during plotting: {e}")
+
+with stage(run, "overview"):
+    overview = narrative["overview"]
+    attributes = str(df.columns.to_list()).replace("'", "").replace("[", "").replace("]", "")
+    inspec = dataset_quality(df)
 
 st.markdown(
-    "During the year 2023, a total of **{num_acc}** accidents were recorded in the city of Lisbon. "
+    "During {years}, a total of **{num_acc}** accidents were recorded in the city of Lisbon. "
     "These accidents resulted in **{num_fatal}** fatalities, **{num_serious}** serious injuries, "
     "and **{num_minor}** minor injuries. Of these accidents, we know various details such as {attrs}. "
     "Some other key characteristics of the dataset are that the number of missing values is "
-    "**{missing}** and the number of duplicate rows is **{duplicates}**. Below, the first few rows of the dataset are shown:"
+    "**{missing}** and the number of duplicate rows is **{duplicates}**; **{outside}** accidents are located outside the city "
+    "boundary{excluded}. Below, the first few rows of the dataset are shown:"
     .format(
-        num_acc=overview["Number accidents"],
-        num_fatal=overview["Number fatalities"],
-        num_serious=overview["Number serious injuries"],
-        num_minor=overview["Number minor injuries"],
+        years="the year " + join_words(overview["years"]) if len(overview["years"]) == 1
+        else "the years " + join_words(overview["years"]),
+        num_acc=overview["accidents"],
+        num_fatal=overview["fatalities"],
+        num_serious=overview["serious_injuries"],
+        num_minor=overview["minor_injuries"],
         attrs=attributes,
         missing=inspec["Missing values"],
-        duplicates=inspec["Duplicate rows"]
+        duplicates=inspec["Duplicate rows"],
+        outside=validation["outside_boundary"],
+        excluded=" and are excluded from the dashboard" if exclude_outside else ""
     )
 )
 
@@ -56,75 +129,240 @@ st.dataframe(df.head())
 st.header("Main takeaways from exploring the data temporally")
 
 # Monthly distribution
+months = narrative["month"]
+(top_month, top_count), *other_peaks = months["highest"]
+(low_month, low_count), *other_lows = months["lowest"]
+holiday_months = [month for month, _ in other_lows if month in ("Aug", "Dec")]
 st.markdown(
-    "Analyzing the distribution of accidents by month, we observe that totals range from **140 accidents in February** "
-    "to **208 in May**. Other notable peaks occur in March (**206 accidents**) and October (**202 accidents**), while "
-    "the lower months include December (**155 accidents**) and August (**158 accidents**). "
-    "The lower accident counts in August and December may be explained by the increased number of holidays, resulting "
-    "in fewer people commuting. February is also low, likely due to having fewer days; however, when adjusting for the "
-    "number of days (accidents per day), February performs similarly to December and August, suggesting that additional "
-    "factors may influence these variations."
+    f"Analyzing the distribution of accidents by month, we observe that totals range from **{low_count} accidents in {month_name(low_month)}** "
+    f"to **{top_count} in {month_name(top_month)}**. Other notable peaks occur in "
+    + join_words(f"{month_name(month)} (**{count} accidents**)" for month, count in other_peaks)
+    + ", while the lower months include "
+    + join_words(f"{month_name(month)} (**{count} accidents**)" for month, count in other_lows) + ". "
+    + (f"The lower accident counts in {join_words(month_name(m) for m in holiday_months)} may be explained by the increased "
+       "number of holidays, resulting in fewer people commuting. " if holiday_months else "")
+    + (f"February is also low, likely due to having fewer days; however, when adjusting for the number of days "
+       f"(**{months['per_day']['Feb']:.1f}** accidents per day), February performs similarly to "
+       + join_words(f"{month_name(m)} (**{months['per_day'][m]:.1f}**)" for m, _ in other_lows)
+       + ", suggesting that additional factors may influence these variations." if low_month == "Feb" else "")
 )
 with st.expander("Show monthly accidents plot"):
-    accident_plot(clean_df, "month", ["Number of accidents"], [None], "Bar")
+    show_narrative_figure("plot_month")
 
 # Minor, serious, and fatal injuries
+serious_month, serious_count = months["serious_highest"]
+fatal_month, fatal_count = months["fatal_highest"]
 st.markdown(
     "A similar trend is observed for minor injuries, which represent the majority of accidents and therefore follow a similar pattern. "
-    "Incidents with serious injuries display a different pattern: January shows a spike with **10 serious injuries**, while June only has **1 serious injury**."
-    "The January peak could initially suggest drunk driving or New Year's morning accidents, "
-    "but this hypothesis is not supported when looking at the daily distribution. Fatal accidents show yet another pattern, likely due to the low overall numbers: "
-    "July has a spike of **2 fatalities**, while no fatal accidents occur in April, October, November, and December, and the remaining months report only **1 fatality** each."
+    f"Incidents with serious injuries display a different pattern: {month_name(serious_month)} shows a spike with **{serious_count} serious injuries**, "
+    f"while {month_name(months['serious_lowest'][0])} only has **{months['serious_lowest'][1]} serious injur{'y' if months['serious_lowest'][1] == 1 else 'ies'}**. "
+    + ("The January peak could initially suggest drunk driving or New Year's morning accidents, "
+       "but this hypothesis is not supported when looking at the daily distribution. " if serious_month == "Jan" else "")
+    + "Fatal accidents show yet another pattern, likely due to the low overall numbers: "
+    f"{month_name(fatal_month)} has a spike of **{fatal_count} fatalities**"
+    + (f", while no fatal accidents occur in {join_words(month_name(m) for m in months['fatal_zero'])}" if months["fatal_zero"] else "")
+    + (f", and the remaining months report only **{months['fatal_other_values'][0]} "
+       f"fatalit{'y' if months['fatal_other_values'][0] == 1 else 'ies'}** each" if len(months["fatal_other_values"]) == 1 else "")
+    + "."
 )
 with st.expander("Show accidents by injury level per month"):
-    accident_plot(clean_df, "month", ["Minor injuries","Serious injuries","Fatalities"], ["minor_injuries_30d","serious_injuries_30d","fatalities_30d"], "Line")
+    show_narrative_figure("plot_injuries_month")
 
 # Weekday distribution
+weekdays = narrative["weekday"]
 st.markdown(
-    "Examining the distribution by weekday, accidents tend to be more frequent on Thursdays and Fridays, with lower numbers on Saturdays and Sundays. "
-    "This trend is consistent for minor injuries, while serious injuries show a peak on Mondays with **10 accidents**. Fatal accidents are more erratic, "
-    "with the maximum values occurring on Sundays and Tuesdays, and none recorded on Mondays, Fridays, or Saturdays."
+    "Examining the distribution by weekday, accidents tend to be more frequent on "
+    f"{join_words(day + 's' for day, _ in weekdays['highest'])}, with lower numbers on "
+    f"{join_words(day + 's' for day, _ in reversed(weekdays['lowest']))}. "
+    f"This trend is consistent for minor injuries, while serious injuries show a peak on {weekdays['serious_highest'][0]}s "
+    f"with **{weekdays['serious_highest'][1]} accidents**. Fatal accidents are more erratic, "
+    f"with the maximum values occurring on {join_words(day + 's' for day in reversed(weekdays['fatal_highest']))}"
+    + (f", and none recorded on {join_words((day + 's' for day in weekdays['fatal_zero']), 'or')}"
+       if weekdays["fatal_zero"] else "")
+    + "."
 )
 with st.expander("Show accidents per weekday"):
-    accident_plot(clean_df, "weekday", ["Number of accidents"], [None], "Pie")
+    show_narrative_figure("plot_weekday")
 
 # Hourly distribution
+hours = narrative["hour"]
+window_start, window_end, _ = hours["busiest_window"]
+school_peaks = [hour for hour, _ in hours["other_peaks"][:2]]
 st.markdown(
-    "Hourly distribution shows peaks during the evening between 16:00–19:00, as well as around 13:00 and 09:00, "
-    "the latter two potentially related to children entering or leaving school. Nighttime hours show a decreasing trend from 20:00 to 05:00, "
-    "after which the number of accidents starts to increase again."
+    f"Hourly distribution shows peaks between {window_start:02d}:00–{window_end:02d}:00"
+    + (f", as well as around {join_words(f'{hour:02d}:00' for hour in school_peaks)}" if school_peaks else "")
+    + (", the latter two potentially related to children entering or leaving school"
+       if sorted(school_peaks) == [9, 13] else "")
+    + f". After {window_end:02d}:00 the number of accidents decreases until {hours['quietest'][0]:02d}:00, "
+    "after which it starts to increase again."
 )
 with st.expander("Show a plot of accidents per hour"):
-    accident_plot(clean_df, "hour", ["Number of accidents"], [None], "Bar")
+    show_narrative_figure("plot_hour")
 
 # Day-of-month distribution
+(top_day, _), *next_days = narrative["day"]["highest"]
+busiest_date, busiest_count, busiest_minor = narrative["date"]["busiest"]
+multi_year = len(overview["years"]) > 1
+victims_date, victims_count = narrative["date"]["most_victims"]
 st.markdown(
-    "Looking at the distribution by day of the month, the 21st shows the highest number of accidents, followed by the 13th and 6th, "
-    "while the 31st shows the lowest count, likely because not all months have this day. "
-    "The single day with the most accidents is March 21st, with **14 accidents** and **15 minor injuries**, whereas the day with the most injured individuals is June 22nd, "
-    "with **18 victims**."
+    f"Looking at the distribution by day of the month, the {ordinal(top_day)} shows the highest number of accidents, "
+    f"followed by the {join_words(ordinal(day) for day, _ in next_days)}, "
+    f"while the {ordinal(narrative['day']['lowest'][0])} shows the lowest count"
+    + (", likely because not all months have this day" if narrative["day"]["lowest"][0] > 28 else "") + ". "
+    f"The single day with the most accidents is {date_name(busiest_date, multi_year)}, with **{busiest_count} accidents** and "
+    f"**{busiest_minor} minor injuries**, whereas the day with the most injured individuals is {date_name(victims_date, multi_year)}, "
+    f"with **{victims_count} victims**."
 )
 
 
-with st.expander("📊 Wanna explore more? Set your own filters!", expanded=True):
-     accident_plot_controls(clean_df)
+# Sections below are fragments: interacting with their widgets reruns only the fragment,
+# not the data loading and narrative above
+@st.fragment
+def plot_explorer(clean_df):
+    with st.expander("📊 Wanna explore more? Set your own filters!", expanded=True):
+        accident_plot_controls(clean_df)
 
 
-#------------------------------------------------------
-# MAP & FILTERS
-#------------------------------------------------------
+with stage(run, "plot_controls"):
+    plot_explorer(clean_df)
+
+
+@st.fragment
+def map_section(clean_df, boundary_gdf, debug_panel):
+    """Filters, map, hotspots and segment risk; a filter change reruns only this fragment."""
+    # Timed as its own run, since a fragment rerun does not go through the rest of the page
+    section_run = start_run(trace_memory=debug_panel)
+
+    #------------------------------------------------------
+    # MAP & FILTERS
+    #------------------------------------------------------
 
-col1, col2 = st.columns([3, 1])
+    col1, col2 = st.columns([3, 1])
 
-with col2:
-    st.header("Filters")
-    df_filtered = apply_temporal_filters(clean_df, container=st,expanded=True)
-    df_filtered = apply_severity_filters(df_filtered, container=st,expanded=True)
-with col1:
-    # Create map
-    gdf = df_to_gdf(df_filtered)
-    map_html = create_map(gdf, boundary_gdf)
-    # Display map
-    st.subheader("Accident Map")
-    st.components.v1.html(map_html, height=500, scrolling=False)
+    with col2:
+        st.header("Filters")
+        # Collect every active predicate, then select the rows in a single pass
+        with stage(section_run, "filters") as record:
+            filter_spec = temporal_filter_spec(clean_df, container=st,expanded=True)
+            filter_spec.update(severity_filter_spec(clean_df, container=st,expanded=True))
+            df_filtered = record["frame"] = filter_frame(clean_df, filter_spec)
+    with col1:
+        # Create map
+        filter_key = filter_state_key(clean_df, filter_spec)
+        tiled = st.toggle("Load points by tile (for very large datasets)", False)
+        if tiled and start_tile_server() is None:
+            st.info(f"The tile server port ({TILE_PORT}) is used by another process; showing the embedded map.")
+            tiled = False
+        if tiled:
+            # Only the tiles in the viewport are fetched from the local tile server
+            with stage(section_run, "create_map"):
+                session = st.session_state.setdefault("tile_session", uuid.uuid4().hex)
+                points_url = publish_layer(layer_name(filter_key), df_filtered, session=session)
+                boundary_url = publish_layer("boundary-" + boundary_key(boundary_gdf)[:12], boundary_gdf,
+                                             kind="boundary", session=session)
+                center = [boundary_gdf["lat"].mean(), boundary_gdf["lon"].mean()]
+                map_html = create_tile_map(points_url, boundary_url, center)
+        else:
+            heat = st.selectbox("Heatmap", ["Off", "accidents", "victims", "severity"],
+                                help="Weight of each accident: 1, its number of victims, or victims "
+                                     "weighted by severity (serious x5, fatal x20)")
+            with stage(section_run, "df_to_gdf") as record:
+                gdf = record["frame"] = df_to_gdf(df_filtered)
+            with stage(section_run, "create_map"):
+                map_html = create_map(gdf, boundary_gdf, cache_key=filter_key,
+                                      heat=None if heat == "Off" else heat)
+        # Display map
+        st.subheader("Accident Map")
+        st.components.v1.html(map_html, height=500, scrolling=False)
+
+
+
+    #------------------------------------------------------
+    # AREA SELECTION
+    #------------------------------------------------------
+
+    with st.expander("🔲 Select accidents in an area (rectangle or lasso)"):
+        st.markdown("Draw a rectangle or a polygon on the map to select the accidents inside it "
+                    "(with the filters above); without a drawing, the accidents in the current view are selected.")
+        selection_state = st_folium(create_selection_map(df_filtered, boundary_gdf, cache_key=filter_key),
+                                    key="selection_map", height=450, use_container_width=True,
+                                    returned_objects=["bounds", "last_active_drawing"])
+        bbox, polygon = map_selection(selection_state)
+        # Answered by the spatio-temporal index of the full dataset, without scanning the rows
+        with stage(section_run, "area_query") as record:
+            selected = record["frame"] = query_frame(clean_df, filter_spec, bbox=bbox, polygon=polygon)
+        st.markdown(
+            f"**{len(selected)}** accidents {'in the drawn area' if polygon is not None else 'in view'}: "
+            f"**{int(selected['minor_injuries_30d'].sum())}** minor injuries, "
+            f"**{int(selected['serious_injuries_30d'].sum())}** serious injuries and "
+            f"**{int(selected['fatalities_30d'].sum())}** fatalities."
+        )
+        st.dataframe(selected[clean_df.attrs["source_columns"]].head(100))
+
+
+    #------------------------------------------------------
+    # HOTSPOTS
+    #------------------------------------------------------
+
+    with st.expander("🔥 Accident hotspots (DBSCAN on the filtered accidents)"):
+        if st.checkbox("Show accident hotspots"):
+            hot_col1, hot_col2 = st.columns(2)
+            eps = hot_col1.slider("Neighbourhood radius (m)", 25, 200, 50, step=5)
+            min_samples = hot_col2.slider("Minimum accidents per hotspot core", 2, 20, 2)
+            with stage(section_run, "hotspots") as record:
+                labels = hotspot_labels(df_filtered, eps, min_samples)
+                summary = record["frame"] = hotspot_summary(df_filtered, labels)
+            st.markdown(
+                f"**{len(summary)}** hotspots group **{int(summary['accidents'].sum())}** of the "
+                f"**{len(df_filtered)}** selected accidents."
+            )
+            with stage(section_run, "hotspot_map"):
+                hotspot_html = create_hotspot_map(df_filtered, labels, summary, boundary_gdf,
+                                                  cache_key=(filter_key, eps, min_samples))
+            st.components.v1.html(hotspot_html, height=500, scrolling=False)
+            st.dataframe(summary.head(10))
+
+
+    #------------------------------------------------------
+    # ROAD SEGMENT RISK
+    #------------------------------------------------------
+
+    with st.expander("🛣️ Road segment risk (accidents snapped to the street network)"):
+        if st.checkbox("Show road segment risk (downloads the street network on first use)"):
+            try:
+                _, edges = load_network(network_type="drive")
+            except Exception as e:
+                st.warning(f"Street network not available: {e}")
+            else:
+                risk_weights = st.radio("Risk score", ["severity", "victims", "accidents"], horizontal=True)
+                with stage(section_run, "segment_risk") as record:
+                    risk = record["frame"] = segment_risk(df_filtered, edges, risk_weights)
+                with stage(section_run, "segment_map"):
+                    segment_html = create_segment_map(risk, boundary_gdf, cache_key=(filter_key, risk_weights))
+                st.components.v1.html(segment_html, height=500, scrolling=False)
+                st.dataframe(risk.drop(columns="geometry").head(10))
+
+    finish_run(section_run)
+    if debug_panel:
+        with st.expander("⏱️ Performance of the map section", expanded=False):
+            st.markdown(f"Run `{section_run['id']}` took **{section_run['seconds']:.3f} s** (wall time).")
+            st.dataframe(stage_table(section_run), hide_index=True)
+
+
+map_section(clean_df, boundary_gdf, debug_panel)
+
+
+#------------------------------------------------------
+# PERFORMANCE PANEL
+#------------------------------------------------------
 
+pool.shutdown(wait=False)
+finish_run(run)
+if debug_panel:
+    with st.expander("⏱️ Performance of this rerun", expanded=True):
+        st.markdown(f"Rerun `{run['id']}` took **{run['seconds']:.3f} s** (wall time; stages in the thread pool overlap).")
+        st.dataframe(stage_table(run), hide_index=True)
+        st.markdown("**Frames produced per stage**")
+        st.dataframe(run["frames"])
+        st.markdown("**Caches** (process-wide counters)")
+        st.dataframe(cache_stats())
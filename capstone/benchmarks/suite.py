@@ -0,0 +1,272 @@
+"""
+Benchmark suite for the dashboard hot paths.
+
+Synthetic accident datasets shaped like data/Road_Accidents_Lisbon.csv are generated at the
+requested sizes, then every stage of the dashboard pipeline is timed (best and median of
+`--repeat` cold runs, with all module caches cleared) and memory-profiled (tracemalloc peak of
+one extra run). Results are written as JSON tagged with the git commit, so runs of different
+commits can be compared. Usage (from the capstone folder):
+
+    python -m benchmarks.suite --sizes 1000 100000 1000000
+    python -m benchmarks.suite --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+
+from modules.cube import breakdown_table, build_cube, BREAKDOWNS
+from modules.filter_index import build_filter_index, filter_frame
+from modules.geometry import df_to_gdf
+from modules.load_data import load_accident_data
+from modules.map_utils import create_map, heat_pyramid
+from modules.memo import all_caches
+from modules.query_index import build_query_index, query_rows
+from modules.schema import MONTH_ORDER
+from modules.stats import SEVERITY_WEIGHTS, load_data
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+RESULTS_DIR = os.path.join("benchmarks", "results")
+MAX_MAP_ROWS = 10_000_000  # the map HTML ships per-zoom clusters; larger selections are skipped
+
+# Rough extent and a few dense areas of the Lisbon accidents
+LISBON_BOUNDS = (-9.23, 38.69, -9.09, 38.80)
+DENSE_AREAS = [(-9.142, 38.737, 0.012), (-9.165, 38.716, 0.008), (-9.136, 38.712, 0.006),
+               (-9.190, 38.752, 0.010), (-9.105, 38.748, 0.009)]
+
+# A typical selection from the dashboard filters
+FILTER_SPEC = {"month": ["Mar", "Apr", "May", "Jun"], "weekday": ["Monday", "Tuesday", "Wednesday"],
+               "hour": (7, 20), "minor_injuries_30d": (1, 10)}
+# A viewport around the city centre, for the spatio-temporal query
+QUERY_BBOX = (-9.16, 38.70, -9.12, 38.73)
+
+
+def synthetic_accidents(n, seed=0):
+    """`n` accidents with the columns, value ranges and rough spatial pattern of the Lisbon CSV."""
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D")
+
+    # Two thirds of the accidents around dense areas, the rest spread over the city
+    area = rng.integers(0, len(DENSE_AREAS), n)
+    centre = np.array(DENSE_AREAS)[area]
+    clustered = rng.random(n) < 2 / 3
+    lon = np.where(clustered, rng.normal(centre[:, 0], centre[:, 2]),
+                   rng.uniform(LISBON_BOUNDS[0], LISBON_BOUNDS[2], n))
+    lat = np.where(clustered, rng.normal(centre[:, 1], centre[:, 2] * 0.8),
+                   rng.uniform(LISBON_BOUNDS[1], LISBON_BOUNDS[3], n))
+
+    # More accidents in the daytime peaks
+    hour_weights = np.array([2, 1, 1, 1, 1, 2, 3, 5, 7, 6, 5, 5, 6, 7, 6, 6, 7, 8, 8, 7, 5, 4, 3, 2], dtype=float)
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "month": np.array(MONTH_ORDER)[dates.month - 1],
+        "day": dates.day,
+        "hour": rng.choice(24, n, p=hour_weights / hour_weights.sum()),
+        "weekday": dates.day_name(),
+        "fatalities_30d": (rng.random(n) < 0.005).astype(int),
+        "serious_injuries_30d": (rng.random(n) < 0.04).astype(int),
+        "minor_injuries_30d": rng.poisson(1.1, n),
+        "latitude": lat.round(6),
+        "longitude": lon.round(6),
+        "municipality": "Lisboa",
+    })
+
+
+def synthetic_csv(n, data_dir, seed=0):
+    """Path of a synthetic CSV with `n` rows, generated once per (n, seed) in `data_dir`."""
+    path = os.path.join(data_dir, f"accidents_{n}_{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        synthetic_accidents(n, seed).to_csv(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+def clear_caches():
+    """Empty every process-wide cache of the capstone modules, so each run is a cold run."""
+    for cache in all_caches().values():
+        cache.clear()
+    # Plain dict caches (boundaries, dataset geometry, ...)
+    for name, module in list(sys.modules.items()):
+        if name.startswith("modules."):
+            for attr, value in vars(module).items():
+                if isinstance(value, dict) and attr.startswith("_") and ("CACHE" in attr or "GEOMETRY" in attr):
+                    value.clear()
+
+
+def pipeline_stages(path, n):
+    """
+    The dashboard pipeline as (stage name, callable) pairs; each callable takes the output of the
+    previous stage it depends on through the shared `state` dict.
+    """
+    boundary = gpd.GeoDataFrame({"lat": [38.74], "lon": [-9.16]}, geometry=[box(*LISBON_BOUNDS)], crs="EPSG:4326")
+    state = {}
+
+    def load():
+        state["raw"] = load_accident_data(path)
+
+    def enrich():
+        df = load_data(state["raw"])
+        df.attrs["dataset_version"] = f"synthetic-{n}"
+        state["df"] = df
+
+    def filter_index():
+        state["index"] = build_filter_index(state["df"])
+
+    def filter_rows():
+        state["filtered"] = filter_frame(state["df"], FILTER_SPEC, index=state["index"])
+
+    def aggregate():
+        cube = build_cube(state["df"])
+        for breakdown in BREAKDOWNS:
+            breakdown_table(cube, breakdown)
+
+    def geometry():
+        state["gdf"] = df_to_gdf(state["filtered"])
+
+    def map_html():
+        if len(state["gdf"]) > MAX_MAP_ROWS:
+            return "skipped"
+        create_map(state["gdf"], boundary)
+
+    def heatmap():
+        heat_pyramid(state["filtered"], SEVERITY_WEIGHTS["severity"])
+
+    def query_index():
+        state["query_index"] = build_query_index(state["df"])
+
+    def query():
+        query_rows(state["query_index"], FILTER_SPEC, bbox=QUERY_BBOX)
+
+    return [("load", load), ("enrich", enrich), ("filter_index", filter_index), ("filter", filter_rows),
+            ("aggregate", aggregate), ("geometry", geometry), ("map_html", map_html), ("heatmap", heatmap),
+            ("query_index", query_index), ("query", query)]
+
+
+def run_size(path, n, repeat):
+    """Timings and peak memory of every stage for one dataset size."""
+    times = {}
+    for _ in range(repeat):
+        clear_caches()
+        for stage, run in pipeline_stages(path, n):
+            start = time.perf_counter()
+            skipped = run() == "skipped"
+            times.setdefault(stage, []).append(None if skipped else time.perf_counter() - start)
+
+    peaks = {}
+    clear_caches()
+    tracemalloc.start()
+    for stage, run in pipeline_stages(path, n):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        run()
+        peaks[stage] = (tracemalloc.get_traced_memory()[1] - before) / 2**20
+    tracemalloc.stop()
+
+    results = []
+    for stage, seconds in times.items():
+        measured = [s for s in seconds if s is not None]
+        results.append({
+            "rows": n,
+            "stage": stage,
+            "seconds": measured,
+            "best": min(measured) if measured else None,
+            "median": statistics.median(measured) if measured else None,
+            "peak_mb": round(peaks[stage], 2) if measured else None,
+        })
+    return results
+
+
+def git_revision():
+    """Current commit hash and whether the tree has uncommitted changes (None outside git)."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "geopandas": gpd.__version__,
+    }
+
+
+def compare(old_path, new_path):
+    """Print the median time ratio (new / old) for every (rows, stage) present in both result files."""
+    with open(old_path) as f:
+        old = {(r["rows"], r["stage"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'rows':>10} {'stage':<14} {'old (s)':>10} {'new (s)':>10} {'ratio':>7}")
+    for result in new:
+        before = old.get((result["rows"], result["stage"]))
+        if before is None or before["median"] is None or result["median"] is None:
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else float("inf")
+        print(f"{result['rows']:>10} {result['stage']:<14} {before['median']:>10.4f} "
+              f"{result['median']:>10.4f} {ratio:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard pipeline on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="dataset sizes (rows)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=None, help="where synthetic CSVs are kept (default: temp dir)")
+    parser.add_argument("--out", default=None, help="result JSON (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), "accident_benchmarks")
+    commit, dirty = git_revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": [],
+    }
+    for n in args.sizes:
+        path = synthetic_csv(n, data_dir, args.seed)
+        for result in run_size(path, n, args.repeat):
+            report["results"].append(result)
+            best = "skipped" if result["best"] is None else f"{result['best']:.4f} s"
+            peak = "" if result["peak_mb"] is None else f"{result['peak_mb']:.1f} MB"
+            print(f"{n:>10} {result['stage']:<14} {best:>12} {peak:>12}")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{(commit or 'nogit')[:12]}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from modules.load_data import load_accident_data
+from modules.schema import SCHEMA_VERSION
+from modules.shared_store import open_shared, publish_shared, shared_path
+from modules.stats import load_data
+
+CACHE_DIR = "cache"
+
+# Process-wide cache: survives Streamlit reruns because the module is only imported once
+_MEMORY_CACHE = {}
+
+
+def _file_sha1(path, block_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_fingerprint(path, cache_dir=CACHE_DIR):
+    """
+    Return the content hash of a source file.
+
+    The hash is remembered next to the cache together with the file mtime and size,
+    so an unchanged file is never read twice to fingerprint it.
+    """
+    stat = os.stat(path)
+    abs_path = os.path.abspath(path)
+    meta_path = os.path.join(cache_dir, f"fingerprint_{_path_key(path)}.json")
+
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["mtime"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+            return meta["sha1"]
+
+    sha1 = _file_sha1(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    _atomic_write_json(meta_path, {"path": abs_path, "mtime": stat.st_mtime_ns,
+                                   "size": stat.st_size, "sha1": sha1})
+    return sha1
+
+
+def _path_key(path):
+    return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+
+def _atomic_write_json(path, payload):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def load_enriched_data(path="data/Road_Accidents_Lisbon.csv", cache_dir=CACHE_DIR, shared=True):
+    """
+    Load the accident dataset already enriched by `stats.load_data`.
+
+    Lookup order:
+        1. in-memory cache, keyed by path, mtime and size (no disk access)
+        2. with `shared=True`, the host-wide Arrow copy mapped by every process (modules.shared_store)
+        3. Parquet copy of the enriched frame in `cache_dir`, keyed by the file hash
+        4. CSV parse + enrichment, which is then written to the Parquet cache
+
+    The returned frame is shared between reruns and sessions and must not be modified in place
+    (with `shared=True` its numeric columns are read-only views of the mapped file).
+    Its `attrs` carry the dataset version (the source hash) and the original CSV columns.
+    """
+    stat = os.stat(path)
+    memory_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if memory_key in _MEMORY_CACHE:
+        return _MEMORY_CACHE[memory_key]
+
+    version = file_fingerprint(path, cache_dir)
+    shared_name = f"accidents_{_path_key(path)}_{version}_v{SCHEMA_VERSION}"
+    if shared and os.path.exists(shared_path(shared_name)):
+        return _remember(memory_key, open_shared(shared_path(shared_name)))
+
+    parquet_path = os.path.join(cache_dir, f"accidents_{version}_v{SCHEMA_VERSION}.parquet")
+    columns_path = os.path.join(cache_dir, f"accidents_{version}_v{SCHEMA_VERSION}.json")
+
+    if os.path.exists(parquet_path) and os.path.exists(columns_path):
+        clean_df = pd.read_parquet(parquet_path)
+        with open(columns_path) as f:
+            source_columns = json.load(f)["source_columns"]
+    else:
+        df = load_accident_data(path)
+        source_columns = df.columns.to_list()
+        clean_df = load_data(df)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+        clean_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+        _atomic_write_json(columns_path, {"source_columns": source_columns})
+
+    clean_df.attrs["dataset_version"] = version
+    clean_df.attrs["source_columns"] = source_columns
+
+    if shared:
+        # Use the mapped copy in this process too, so its private frame can be released
+        shared_file = publish_shared(clean_df, shared_name, replaces=f"accidents_{_path_key(path)}_")
+        clean_df = open_shared(shared_file)
+    return _remember(memory_key, clean_df)
+
+
+def _remember(memory_key, clean_df):
+    # Drop stale versions of the same file before storing the new one
+    for key in [k for k in _MEMORY_CACHE if k[0] == memory_key[0]]:
+        del _MEMORY_CACHE[key]
+    _MEMORY_CACHE[memory_key] = clean_df
+    return clean_df
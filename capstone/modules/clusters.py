@@ -0,0 +1,105 @@
+"""
+Server-side hierarchical point clustering for the accident map.
+
+Replaces the browser-side MarkerCluster: the points are binned once on a grid of
+CLUSTER_RADIUS_PX screen pixels at the finest zoom, and every coarser zoom merges 2x2 cells of
+the level below (so clusters nest across zooms). Each level keeps only the cluster centroids
+with their accident count and injury sums; single accidents keep a reference to their row for
+the popup. The browser then draws the clusters of the current zoom inside the viewport.
+"""
+import numpy as np
+
+from modules.memo import LRUCache, frame_key
+from modules.tiles import lonlat_to_tile
+
+CLUSTER_ZOOMS = range(10, 19)
+CLUSTER_RADIUS_PX = 40
+MAX_CLUSTERS = 50_000  # finer levels are not shipped; the map keeps the finest level below the cap
+SUM_COLUMNS = ["minor_injuries_30d", "serious_injuries_30d", "fatalities_30d"]
+
+# Cluster pyramid per point selection
+_CLUSTER_CACHE = LRUCache(maxsize=16, max_bytes=128 * 1024 * 1024,
+                          sizeof=lambda pyramid: 60 * sum(len(level["clusters"]) + len(level["singles"])
+                                                          for level in pyramid["levels"].values())
+                          + 30 * len(pyramid["rows"]))
+
+
+def cluster_pyramid(df, zooms=CLUSTER_ZOOMS, radius_px=CLUSTER_RADIUS_PX, max_clusters=MAX_CLUSTERS):
+    """
+    Cluster the accidents at every zoom level in one pass over the points.
+
+    Returns {"levels": {zoom: {"clusters": [[lat, lon, count, minor, serious, fatal], ...],
+    "singles": [...]}}, "rows": [...]}: clusters of several accidents sit at the mean position
+    of their accidents, and the single accidents of a level are indices into `rows`, the row
+    positions in `df` of every accident shown alone at some level (shipped once, with their
+    popup data). Levels with more than `max_clusters` entries are skipped (the coarsest level
+    is always kept). The highest shipped level, which cannot be zoomed into, also has
+    "members": per cluster, the indices into `rows` of its accidents.
+    """
+    zooms = sorted(zooms, reverse=True)
+    lon = df["longitude"].to_numpy(np.float64)
+    lat = df["latitude"].to_numpy(np.float64)
+    valid = ~(np.isnan(lon) | np.isnan(lat))
+    rows = point_rows = np.flatnonzero(valid)
+    point_cells = np.arange(len(rows))
+    x, y = lonlat_to_tile(lon[valid], lat[valid], zooms[0])
+    cell_x = np.floor(x * 256 / radius_px).astype(np.int64)
+    cell_y = np.floor(y * 256 / radius_px).astype(np.int64)
+
+    sums = [np.ones(len(rows)), lat[valid], lon[valid]]
+    sums += [df[column].to_numpy(np.float64)[valid] for column in SUM_COLUMNS]
+
+    shipped = {}
+    previous = zooms[0]
+    for zoom in zooms:
+        shift = previous - zoom
+        previous = zoom
+        cell_x, cell_y = cell_x >> shift, cell_y >> shift
+        cells, inverse = np.unique((cell_x << 32) | cell_y, return_inverse=True)
+        point_cells = inverse[point_cells]
+        # Collapse to one entry per cell: the next level is built from these
+        cell_x, cell_y = cells >> 32, cells & 0xFFFFFFFF
+        sums = [np.bincount(inverse, values, minlength=len(cells)) for values in sums]
+        single = np.full(len(cells), -1, dtype=np.int64)
+        alone = sums[0][inverse] == 1
+        single[inverse[alone]] = rows[alone]
+        rows = single
+
+        if len(cells) > max_clusters and zoom != zooms[-1]:
+            continue
+        if not shipped:
+            # Accidents of every cluster of the highest level, grouped by cluster (in cell order)
+            several_cells = sums[0][point_cells] > 1
+            by_cell = np.argsort(point_cells[several_cells], kind="stable")
+            member_rows = point_rows[several_cells][by_cell]
+            member_starts = np.flatnonzero(np.diff(point_cells[several_cells][by_cell], prepend=-1))
+        shipped[zoom] = (sums, rows)
+
+    # Single accidents and cluster members are shipped once, as positions in one shared list of rows
+    refs = np.concatenate([rows for _, rows in shipped.values()])
+    n_singles = int((refs >= 0).sum())
+    shipped_rows, row_index = np.unique(np.concatenate([refs[refs >= 0], member_rows]), return_inverse=True)
+    refs[refs >= 0] = row_index[:n_singles]
+    members = [part.tolist() for part in np.split(row_index[n_singles:], member_starts[1:])] if len(member_rows) else []
+
+    pyramid = {"levels": {}, "rows": shipped_rows.tolist()}
+    start = 0
+    for zoom, (sums, rows) in shipped.items():
+        level_refs = refs[start:start + len(rows)]
+        start += len(rows)
+        several = level_refs < 0
+        count, lat_sum, lon_sum = (values[several] for values in sums[:3])
+        clusters = np.empty((len(count), 6), dtype=object)
+        clusters[:, 0] = np.round(lat_sum / count, 6)
+        clusters[:, 1] = np.round(lon_sum / count, 6)
+        for column, values in enumerate([count] + [values[several] for values in sums[3:]], start=2):
+            clusters[:, column] = values.astype(np.int64).tolist()
+        pyramid["levels"][zoom] = {"clusters": clusters.tolist(), "singles": level_refs[~several].tolist()}
+    pyramid["levels"][max(shipped)]["members"] = members
+    return pyramid
+
+
+def get_cluster_pyramid(df, cache_key=None):
+    """Cluster pyramid of a point selection, built once per `cache_key` (default: the row selection)."""
+    key = cache_key if cache_key is not None else frame_key(df)
+    return _CLUSTER_CACHE.get_or_create(key, lambda: cluster_pyramid(df))
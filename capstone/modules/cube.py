@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+from modules.memo import LRUCache, frame_key
+
+# Finest grain of the cube: date determines month, weekday and day, so a cell is one (date, hour)
+DIMENSIONS = ["date", "month", "weekday", "day", "hour"]
+BREAKDOWNS = ["month", "weekday", "hour", "day", "date"]
+METRICS = ["count", "minor_injuries_30d", "serious_injuries_30d", "fatalities_30d", "total_victims"]
+
+_CUBE_CACHE = LRUCache(maxsize=8)
+
+
+def build_cube(df):
+    """
+    Aggregate the accidents into one row per (date, hour) cell with every metric.
+
+    Returns a dict with:
+        cells: DataFrame of the cell dimensions and metric sums
+        row_cell: cell number of each input row, used to aggregate filtered subsets
+        tables: per-breakdown tables, filled lazily by `breakdown_table`
+    """
+    groups = df.groupby(DIMENSIONS, observed=True, dropna=False, sort=False)
+    row_cell = groups.ngroup().to_numpy()
+    # First row of every cell, in cell-number order
+    _, first_rows = np.unique(row_cell, return_index=True)
+    cells = df[DIMENSIONS].iloc[first_rows].reset_index(drop=True)
+
+    cells = pd.concat([cells, _cell_metrics(df, row_cell, len(cells))], axis=1)
+    return {"cells": cells, "row_cell": row_cell, "tables": {}}
+
+
+def _cell_metrics(df, row_cell, n_cells, positions=None):
+    if positions is not None:
+        row_cell = row_cell[positions]
+    metrics = {"count": np.bincount(row_cell, minlength=n_cells)}
+    for metric in METRICS[1:]:
+        values = df[metric].to_numpy()
+        if positions is not None:
+            values = values[positions]
+        metrics[metric] = np.bincount(row_cell, weights=values, minlength=n_cells).astype(np.int64)
+    return pd.DataFrame(metrics)
+
+
+def get_cube(df):
+    """Return the cube of `df`, built once per dataset version (or filtered row selection)."""
+    return _CUBE_CACHE.get_or_create(frame_key(df), lambda: build_cube(df))
+
+
+def subset_cube(cube, df, positions):
+    """
+    Cube of a filtered subset given by row positions of the frame the cube was built from.
+    Reuses the cell assignment of the full cube, so only the selected rows are summed.
+    """
+    cells = cube["cells"][DIMENSIONS].copy()
+    cells[METRICS] = _cell_metrics(df, cube["row_cell"], len(cells), positions)
+    return {"cells": cells[cells["count"] > 0].reset_index(drop=True), "row_cell": None, "tables": {}}
+
+
+def get_subset_cube(df, subset, positions):
+    """
+    Cube of `subset`, the rows `positions` of `df`, summed from the cell assignment of the
+    (cached) cube of `df`. Stored under `subset`, so `get_cube(subset)` then reuses it.
+    """
+    return _CUBE_CACHE.get_or_create(frame_key(subset), lambda: subset_cube(get_cube(df), df, positions))
+
+
+def append_cube(cube, df, start):
+    """
+    Cube of `df` given the cube of its first `start` rows: only the appended rows are aggregated.
+    Their cells are matched against the existing ones; unseen (date, hour) cells are added.
+    """
+    new_rows = df.iloc[start:]
+    cells = cube["cells"]
+    new_cell = pd.MultiIndex.from_frame(cells[DIMENSIONS]).get_indexer(
+        pd.MultiIndex.from_frame(new_rows[DIMENSIONS])
+    )
+
+    missing = new_cell < 0
+    if missing.any():
+        unseen = new_rows[missing]
+        local_cell = unseen.groupby(DIMENSIONS, observed=True, dropna=False, sort=False).ngroup().to_numpy()
+        _, first_rows = np.unique(local_cell, return_index=True)
+        added = unseen[DIMENSIONS].iloc[first_rows]
+        added[METRICS] = 0
+        new_cell[missing] = len(cells) + local_cell
+        cells = pd.concat([cells, added], ignore_index=True)
+    else:
+        cells = cells.copy()
+
+    cells[METRICS] += _cell_metrics(new_rows, new_cell, len(cells)).to_numpy()
+    return {"cells": cells, "row_cell": np.concatenate([cube["row_cell"], new_cell]), "tables": {}}
+
+
+def extend_cached_cube(old_df, new_df):
+    """If the cube of `old_df` is cached, derive the cube of `new_df` (old rows + appended rows) from it."""
+    cube = _CUBE_CACHE.get(frame_key(old_df))
+    if cube is not None and cube["row_cell"] is not None:
+        _CUBE_CACHE.put(frame_key(new_df), append_cube(cube, new_df, len(old_df)))
+
+
+def breakdown_table(cube, breakdown):
+    """All metrics by one breakdown, computed once per cube and then served as a slice."""
+    tables = cube["tables"]
+    if breakdown not in tables:
+        tables[breakdown] = (
+            cube["cells"].groupby(breakdown, observed=True)[METRICS].sum().sort_index()
+        )
+    return tables[breakdown]
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+from modules.memo import LRUCache, frame_key, stable_hash
+
+# Columns filtered by membership (multiselect) and by range (sliders / date interval)
+VALUE_COLUMNS = ["weekday", "month"]
+RANGE_COLUMNS = ["hour", "day", "date",
+                 "minor_injuries_30d", "serious_injuries_30d", "fatalities_30d"]
+
+_INDEX_CACHE = LRUCache(maxsize=4)
+
+
+def build_filter_index(df):
+    """
+    Precompute everything the filters need, once per dataset:
+        - value columns: one packed bitmap (1 bit per row) per distinct value
+        - range columns: values sorted once, plus the row positions in that order
+    """
+    index = {"n_rows": len(df), "values": {}, "ranges": {}}
+
+    for column in VALUE_COLUMNS:
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series)
+        index["values"][column] = {
+            value: np.packbits(codes == code)
+            for code, value in enumerate(uniques)
+            if (codes == code).any()
+        }
+
+    for column in RANGE_COLUMNS:
+        if column not in df.columns:
+            continue
+        values = df[column].to_numpy()
+        order = np.argsort(values, kind="stable")
+        index["ranges"][column] = (values[order], order)
+
+    return index
+
+
+def get_filter_index(df):
+    """Return the filter index of `df`, built on first use and cached per dataset version."""
+    return _INDEX_CACHE.get_or_create(frame_key(df), lambda: build_filter_index(df))
+
+
+def extend_filter_index(index, df, start):
+    """
+    Filter index of `df` given the index of its first `start` rows.
+    Only the appended rows are indexed; they are merged into the existing bitmaps and sorted arrays.
+    """
+    new_rows = df.iloc[start:]
+    part = build_filter_index(new_rows)
+    n_old, n_new = index["n_rows"], len(new_rows)
+    merged = {"n_rows": n_old + n_new, "values": {}, "ranges": {}}
+
+    for column, old_bitmaps in index["values"].items():
+        new_bitmaps = part["values"].get(column, {})
+        values = list(old_bitmaps) + [v for v in new_bitmaps if v not in old_bitmaps]
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            values = [v for v in df[column].cat.categories if v in values]
+        merged["values"][column] = {
+            value: np.packbits(np.concatenate([
+                np.unpackbits(old_bitmaps[value], count=n_old) if value in old_bitmaps
+                else np.zeros(n_old, dtype=np.uint8),
+                np.unpackbits(new_bitmaps[value], count=n_new) if value in new_bitmaps
+                else np.zeros(n_new, dtype=np.uint8),
+            ]))
+            for value in values
+        }
+
+    for column, (sorted_values, order) in index["ranges"].items():
+        new_values, new_order = part["ranges"][column]
+        # New rows go after equal old values, like the stable sort of a full rebuild
+        insert_at = np.searchsorted(sorted_values, new_values, side="right")
+        merged["ranges"][column] = (np.insert(sorted_values, insert_at, new_values),
+                                    np.insert(order, insert_at, new_order + start))
+    return merged
+
+
+def extend_cached_index(old_df, new_df):
+    """If the filter index of `old_df` is cached, derive the index of `new_df` (old rows + appended rows) from it."""
+    index = _INDEX_CACHE.get(frame_key(old_df))
+    if index is not None:
+        _INDEX_CACHE.put(frame_key(new_df), extend_filter_index(index, new_df, len(old_df)))
+
+
+def value_options(index, column):
+    """Distinct values present in a value column, in category order."""
+    return list(index["values"][column])
+
+
+def column_bounds(index, column):
+    """Min and max of a range column (missing values excluded), read from the sorted copy."""
+    sorted_values, _ = index["ranges"][column]
+    valid = sorted_values[~pd.isna(sorted_values)]
+    return valid[0], valid[-1]
+
+
+def _range_bound(sorted_values, value):
+    if np.issubdtype(sorted_values.dtype, np.datetime64):
+        return pd.Timestamp(value).to_datetime64()
+    return value
+
+
+def select_rows(index, spec):
+    """
+    Combine all predicates of `spec` into one array of row positions.
+
+    `spec` maps a column to either a list of accepted values or a (low, high) inclusive range.
+    A single boolean mask is updated in place, so no intermediate frames are created.
+    """
+    n_rows = index["n_rows"]
+    mask = None
+
+    for column, predicate in spec.items():
+        if isinstance(predicate, tuple):
+            sorted_values, order = index["ranges"][column]
+            low = np.searchsorted(sorted_values, _range_bound(sorted_values, predicate[0]), side="left")
+            high = np.searchsorted(sorted_values, _range_bound(sorted_values, predicate[1]), side="right")
+            # Predicates that keep every row are skipped
+            if low == 0 and high == n_rows:
+                continue
+            selected = np.zeros(n_rows, dtype=bool)
+            selected[order[low:high]] = True
+        else:
+            bitmaps = index["values"][column]
+            packed = np.zeros((n_rows + 7) // 8, dtype=np.uint8)
+            for value in predicate:
+                if value in bitmaps:
+                    packed |= bitmaps[value]
+            selected = np.unpackbits(packed, count=n_rows).astype(bool)
+
+        mask = selected if mask is None else np.logical_and(mask, selected, out=mask)
+
+    if mask is None:
+        return None
+    return np.flatnonzero(mask)
+
+
+def filter_frame(df, spec, index=None):
+    """Apply a filter spec to `df` with a single `take` (the frame itself if nothing is filtered)."""
+    if index is None:
+        index = get_filter_index(df)
+    positions = select_rows(index, spec)
+    if positions is None:
+        return df
+    return df.take(positions)
+
+
+def filter_state_key(df, spec):
+    """Stable key of a filter state: the dataset version plus the active predicates."""
+    return (df.attrs.get("dataset_version"), stable_hash(spec))
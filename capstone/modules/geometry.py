@@ -0,0 +1,56 @@
+import geopandas as gpd
+
+from modules.memo import LRUCache, frame_key
+
+CRS = "EPSG:4326"
+
+# Full point arrays per dataset version: {version: (row labels, GeometryArray)}
+_DATASET_GEOMETRY = {}
+# GeoDataFrames per filtered frame, so re-applying the same filters costs nothing
+_GDF_CACHE = LRUCache(maxsize=16)
+
+
+def coordinate_arrays(df, x="longitude", y="latitude"):
+    """Return the coordinate columns as NumPy arrays (no copy for numeric columns)."""
+    return df[x].to_numpy(), df[y].to_numpy()
+
+
+def points_from_frame(df, x="longitude", y="latitude", crs=CRS):
+    """Build all point geometries at once with the vectorized shapely 2 constructor."""
+    lon, lat = coordinate_arrays(df, x, y)
+    return gpd.points_from_xy(lon, lat, crs=crs)
+
+
+def dataset_geometry(df):
+    """
+    Return the points for `df`, reusing the geometry already built for its dataset version.
+
+    Filtered frames keep the row labels of the full dataset, so their points are taken
+    from the cached array instead of being constructed again.
+    """
+    version = df.attrs.get("dataset_version")
+    if version is None:
+        return points_from_frame(df)
+
+    cached = _DATASET_GEOMETRY.get(version)
+    if cached is not None:
+        labels, geometry = cached
+        positions = labels.get_indexer(df.index)
+        if len(positions) == 0 or positions.min() >= 0:
+            return geometry.take(positions)
+
+    geometry = points_from_frame(df)
+    # Keep the largest frame seen for this version: normally the unfiltered dataset
+    if cached is None or len(df) > len(cached[0]):
+        for old_version in [v for v in _DATASET_GEOMETRY if v != version]:
+            del _DATASET_GEOMETRY[old_version]
+        _DATASET_GEOMETRY[version] = (df.index, geometry)
+    return geometry
+
+
+def df_to_gdf(df):
+    """Convert an accident frame to a GeoDataFrame, cached on its row selection."""
+    return _GDF_CACHE.get_or_create(
+        frame_key(df),
+        lambda: gpd.GeoDataFrame(df, geometry=dataset_geometry(df), crs=CRS),
+    )
@@ -0,0 +1,191 @@
+"""
+Accident hotspot detection (DBSCAN) for the dashboard.
+
+Same clustering as the Module 6 notebook (`DBSCAN(eps=50)` on EPSG:3763 metres), but the
+neighbour search uses a uniform grid with cells of size `eps`: a point's neighbours can only
+be in its own or the 8 surrounding cells, so every step is a vectorized NumPy operation
+and no scikit-learn dependency is needed.
+"""
+import numpy as np
+from pyproj import Transformer
+
+from modules.memo import LRUCache, frame_key
+
+PROJECTED_EPSG = 3763  # ETRS89 / Portugal TM06, metres
+NOISE = -1
+
+_LABEL_CACHE = LRUCache(maxsize=32)
+_TRANSFORMERS = {}
+
+
+def project_lonlat(lon, lat, epsg=PROJECTED_EPSG):
+    """Projected x/y arrays (metres) from longitude/latitude arrays."""
+    if epsg not in _TRANSFORMERS:
+        _TRANSFORMERS[epsg] = Transformer.from_crs(4326, epsg, always_xy=True)
+    return _TRANSFORMERS[epsg].transform(np.asarray(lon, dtype=np.float64),
+                                         np.asarray(lat, dtype=np.float64))
+
+
+def project_coordinates(df, epsg=PROJECTED_EPSG):
+    """Projected x/y arrays (metres) from the longitude/latitude columns."""
+    return project_lonlat(df["longitude"].to_numpy(np.float64), df["latitude"].to_numpy(np.float64), epsg)
+
+
+def build_grid(x, y, cell_size):
+    """
+    Sort the points by grid cell. Returns the sort order and, per non-empty cell,
+    its key and the [start, start + count) run of its points in sorted order.
+    """
+    origin = (x.min(), y.min())
+    cx = np.floor((x - origin[0]) / cell_size).astype(np.int64) + 1
+    cy = np.floor((y - origin[1]) / cell_size).astype(np.int64) + 1
+    stride = int(cy.max()) + 2  # one empty row of padding on each side for the neighbour offsets
+    keys = cx * stride + cy
+    order = np.argsort(keys, kind="stable")
+    cell_keys, cell_start, cell_count = np.unique(keys[order], return_index=True, return_counts=True)
+    # 32-bit positions halve the memory traffic of the pair generation
+    index_type = np.int32 if len(x) < 2**31 else np.int64
+    return {"order": order, "stride": stride, "origin": origin, "cell_size": cell_size,
+            "max_cell": (int(cx.max()), int(cy.max())),
+            "cell_keys": cell_keys, "cell_start": cell_start.astype(index_type),
+            "cell_count": cell_count.astype(index_type)}
+
+
+def neighbour_pairs(xs, ys, eps, grid, max_pairs=4_000_000):
+    """
+    Yield (p, q) arrays of the point pairs within `eps` of each other, as positions in
+    grid order (`xs`/`ys` must be sorted by `grid["order"]`). Each pair is produced once
+    (p < q within a cell, and only the 4 "forward" neighbour cells), in batches of
+    at most about `max_pairs` candidates so that memory stays bounded.
+    """
+    stride = grid["stride"]
+    cell_keys, cell_start, cell_count = grid["cell_keys"], grid["cell_start"], grid["cell_count"]
+
+    for offset in (0, 1, stride - 1, stride, stride + 1):
+        target = np.searchsorted(cell_keys, cell_keys + offset)
+        target = np.minimum(target, len(cell_keys) - 1)
+        valid = cell_keys[target] == cell_keys + offset
+        src, tgt = np.flatnonzero(valid), target[valid]
+        sizes = cell_count[src].astype(np.int64) * cell_count[tgt]
+
+        # Split the cell pairs into batches of bounded candidate count
+        bounds = np.searchsorted(np.cumsum(sizes), np.arange(max_pairs, sizes.sum() + max_pairs, max_pairs))
+        for lo, hi in zip(np.r_[0, bounds[:-1]], bounds):
+            hi = max(hi, lo + 1)
+            s, t = src[lo:hi], tgt[lo:hi]
+            if sizes[lo:hi].sum() == 0:
+                continue
+            p, q = _cross_pairs(cell_start[s], cell_count[s], cell_start[t], cell_count[t])
+            keep = (xs[p] - xs[q]) ** 2 + (ys[p] - ys[q]) ** 2 <= eps ** 2
+            if offset == 0:
+                keep &= p < q
+            yield p[keep], q[keep]
+
+
+def _runs(start, count):
+    # Concatenation of arange(start[i], start[i] + count[i]), without a Python loop
+    offsets = np.repeat((start - (np.cumsum(count) - count)).astype(start.dtype), count)
+    return np.arange(count.sum(), dtype=offsets.dtype) + offsets
+
+
+def _cross_pairs(a_start, a_count, b_start, b_count):
+    # Every (p, q) with p in run a[i] and q in run b[i], for all i
+    cell = np.repeat(np.arange(len(a_count), dtype=np.int32), a_count)
+    p_points = _runs(a_start, a_count)
+    width = b_count[cell]
+    return np.repeat(p_points, width), _runs(b_start[cell], width)
+
+
+def _find(parent):
+    # Full path compression by pointer jumping
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent = grand
+
+
+def _union(parent, a, b):
+    # Vectorized union-find: link the larger root to the smaller until every pair shares a root
+    while len(a):
+        parent = _find(parent)
+        ra, rb = parent[a], parent[b]
+        differ = ra != rb
+        a, b, ra, rb = a[differ], b[differ], ra[differ], rb[differ]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+    return parent
+
+
+def dbscan(x, y, eps=50, min_samples=2):
+    """
+    DBSCAN labels for projected coordinates (NOISE for noise points).
+
+    Core points are those with at least `min_samples` points (themselves included) within
+    `eps`. Connected core points form clusters via a vectorized union-find; border points
+    join the cluster of one of their core neighbours.
+    """
+    n = len(x)
+    if n == 0:
+        return np.array([], dtype=np.int64)
+    grid = build_grid(x, y, eps)
+    # Work in grid order: the points of a cell are contiguous, which keeps lookups cache friendly
+    xs, ys = x[grid["order"]], y[grid["order"]]
+
+    counts = np.ones(n, dtype=np.int64)
+    for p, q in neighbour_pairs(xs, ys, eps, grid):
+        counts += np.bincount(p, minlength=n) + np.bincount(q, minlength=n)
+    core = counts >= min_samples
+
+    parent = np.arange(n)
+    border_owner = np.full(n, n, dtype=np.int64)
+    for p, q in neighbour_pairs(xs, ys, eps, grid):
+        both_core = core[p] & core[q]
+        parent = _union(parent, p[both_core], q[both_core])
+        for border, owner in ((p, q), (q, p)):
+            attach = ~core[border] & core[owner]
+            np.minimum.at(border_owner, border[attach], owner[attach])
+    parent = _find(parent)
+
+    sorted_labels = np.full(n, NOISE, dtype=np.int64)
+    sorted_labels[core] = parent[core]
+    has_owner = ~core & (border_owner < n)
+    sorted_labels[has_owner] = parent[border_owner[has_owner]]
+
+    labels = np.empty(n, dtype=np.int64)
+    labels[grid["order"]] = sorted_labels
+
+    # Number clusters 0..k-1 in order of their first core point, like scikit-learn
+    core_labels = np.empty(n, dtype=np.int64)
+    core_labels[grid["order"]] = np.where(core, parent, n)
+    roots, first = np.unique(core_labels, return_index=True)
+    is_root = roots < n  # drop the non-core marker n
+    roots, first = roots[is_root], first[is_root]
+    rank = np.empty(len(roots), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(roots))
+    clustered = labels != NOISE
+    labels[clustered] = rank[np.searchsorted(roots, labels[clustered])]
+    return labels
+
+
+def hotspot_labels(df, eps=50, min_samples=2):
+    """Cluster labels for the rows of `df`, cached per (row selection, eps, min_samples)."""
+    def compute():
+        x, y = project_coordinates(df)
+        return dbscan(x, y, eps, min_samples)
+    return _LABEL_CACHE.get_or_create((frame_key(df), eps, min_samples), compute)
+
+
+def hotspot_summary(df, labels):
+    """One row per hotspot: accident count, centroid and victims, largest first."""
+    clustered = df[["latitude", "longitude", "minor_injuries_30d", "serious_injuries_30d",
+                    "fatalities_30d"]].assign(hotspot=labels)
+    clustered = clustered[clustered["hotspot"] != NOISE]
+    summary = clustered.groupby("hotspot").agg(
+        accidents=("latitude", "size"),
+        latitude=("latitude", "mean"),
+        longitude=("longitude", "mean"),
+        minor_injuries=("minor_injuries_30d", "sum"),
+        serious_injuries=("serious_injuries_30d", "sum"),
+        fatalities=("fatalities_30d", "sum"),
+    )
+    return summary.sort_values("accidents", ascending=False)
@@ -0,0 +1,150 @@
+"""
+Incremental ingestion of accident records into a partitioned Parquet store.
+
+Each delta CSV becomes one enriched partition; rows whose `id` is already stored are skipped,
+so re-ingesting a file is a no-op. The first ingestion seeds the store with the base extract
+(BASE_PATH, records of stats.DEFAULT_YEAR), since the dashboard then reads only the store.
+Usage (from the capstone folder):
+
+    python -m modules.ingest data/new_accidents.csv --year 2024
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from modules.accident_store import _atomic_write_json, _file_sha1
+from modules.cube import extend_cached_cube
+from modules.filter_index import extend_cached_index
+from modules.load_data import load_accident_data
+from modules.schema import concat_frames
+from modules.stats import DEFAULT_YEAR, load_data
+
+STORE_DIR = "data/store"
+BASE_PATH = "data/Road_Accidents_Lisbon.csv"
+
+# Frame currently assembled from the store: {store_dir: (partition names, frame)}
+_STORE_CACHE = {}
+
+
+def _manifest_path(store_dir):
+    return os.path.join(store_dir, "manifest.json")
+
+
+def has_store(store_dir=STORE_DIR):
+    return os.path.exists(_manifest_path(store_dir))
+
+
+def read_manifest(store_dir=STORE_DIR):
+    if not has_store(store_dir):
+        return {"partitions": [], "source_columns": None}
+    with open(_manifest_path(store_dir)) as f:
+        return json.load(f)
+
+
+def stored_ids(store_dir=STORE_DIR):
+    """All accident ids in the store (only the `id` column of each partition is read)."""
+    manifest = read_manifest(store_dir)
+    if not manifest["partitions"]:
+        return pd.Index([])
+    ids = [pd.read_parquet(os.path.join(store_dir, p["name"]), columns=["id"])["id"]
+           for p in manifest["partitions"]]
+    return pd.Index(pd.concat(ids, ignore_index=True))
+
+
+def ingest_delta(path, store_dir=STORE_DIR, year=None, base=BASE_PATH):
+    """
+    Append the new records of a CSV file to the store as a new partition.
+
+    Dates use the file's `year` column, or `year` when the file has none.
+    Only the new rows are enriched. Returns the number of rows added (not counting the
+    base extract, which becomes the first partition of an empty store unless `base` is None).
+    Assumes a single writer per store.
+    """
+    manifest = read_manifest(store_dir)
+    if not manifest["partitions"] and base is not None and os.path.exists(base):
+        ingest_delta(base, store_dir, year=DEFAULT_YEAR, base=None)
+        manifest = read_manifest(store_dir)
+    source = _file_sha1(path)
+    if any(p["source"] == source for p in manifest["partitions"]):
+        return 0
+
+    delta = load_accident_data(path)
+    if "year" not in delta.columns and year is None:
+        raise ValueError(f"'{path}' has no year column; pass the year of its records")
+
+    delta = delta.drop_duplicates(subset="id")
+    delta = delta[~delta["id"].isin(stored_ids(store_dir))]
+    if len(delta) == 0:
+        return 0
+
+    source_columns = manifest["source_columns"] or delta.columns.to_list()
+    enriched = load_data(delta, year=year).reset_index(drop=True)
+
+    name = f"part-{len(manifest['partitions']):05d}.parquet"
+    os.makedirs(store_dir, exist_ok=True)
+    part_path = os.path.join(store_dir, name)
+    enriched.to_parquet(f"{part_path}.tmp", index=False)
+    os.replace(f"{part_path}.tmp", part_path)
+
+    manifest["partitions"].append({"name": name, "rows": len(enriched), "source": source})
+    manifest["source_columns"] = source_columns
+    _atomic_write_json(_manifest_path(store_dir), manifest)
+    return len(enriched)
+
+
+def load_store(store_dir=STORE_DIR):
+    """
+    Return the enriched frame of all partitions in the store.
+
+    Within a process, partitions already loaded are kept: after an ingestion only the new
+    partitions are read, and the cached cube and filter index are extended with the new rows.
+    """
+    manifest = read_manifest(store_dir)
+    names = [p["name"] for p in manifest["partitions"]]
+    loaded_names, df = _STORE_CACHE.get(store_dir, ([], None))
+    if names == loaded_names:
+        return df
+
+    if df is not None and names[:len(loaded_names)] == loaded_names:
+        new_names = names[len(loaded_names):]
+    else:
+        df, new_names = None, names
+
+    parts = [pd.read_parquet(os.path.join(store_dir, name)) for name in new_names]
+    new_df = concat_frames([df] + parts)
+    new_df.attrs["dataset_version"] = hashlib.sha1(
+        "".join(p["source"] for p in manifest["partitions"]).encode()
+    ).hexdigest()
+    new_df.attrs["source_columns"] = manifest["source_columns"]
+
+    if df is not None:
+        extend_cached_cube(df, new_df)
+        extend_cached_index(df, new_df)
+
+    _STORE_CACHE[store_dir] = (names, new_df)
+    return new_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append accident records to the partitioned store.")
+    parser.add_argument("paths", nargs="+", help="CSV files with new accident records")
+    parser.add_argument("--store", default=STORE_DIR, help="store directory")
+    parser.add_argument("--year", type=int, default=None, help="year of records without a year column")
+    parser.add_argument("--base", default=BASE_PATH,
+                        help="extract that seeds an empty store (its records have no year column)")
+    parser.add_argument("--no-base", action="store_true", help="do not seed an empty store with the base extract")
+    args = parser.parse_args()
+
+    base = None if args.no_base else args.base
+    if base is not None and not has_store(args.store):
+        print(f"seeding {args.store} with {base}")
+    for path in args.paths:
+        added = ingest_delta(path, args.store, year=args.year, base=base)
+        print(f"{path}: {added} new records")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Per-rerun timing and memory instrumentation of the dashboard stages.
+
+Each Streamlit rerun records one `run`: its wall time, the time of every stage, optionally
+the peak Python memory of each stage, and the size of the frames it produced. Memory is traced
+with tracemalloc only while a traced stage runs (debug panel on); tracing is process-wide, so
+stages that overlap another stage, in a worker thread or another session, get no peak.
+Finished runs are kept in process-wide totals that are exported as structured JSON log lines
+and as Prometheus text on the tile server's /metrics endpoint (modules.tiles).
+Set ACCIDENTS_METRICS=1 to log every run and start the endpoint with the app.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+from modules.memo import all_caches
+
+logger = logging.getLogger("accidents.metrics")
+
+# Totals over all finished runs of the process: {stage: {"count", "seconds", "last_seconds", "last_peak_mb"}}
+_TOTALS = {}
+_TOTALS_LOCK = threading.Lock()
+_RUNS = {"count": 0}
+
+# Traced stages in progress over all threads and sessions, and the number started so far
+_TRACING = {"owned": False, "active": 0, "starts": 0}
+_TRACING_LOCK = threading.Lock()
+
+
+def metrics_enabled():
+    """Metrics export is switched on with the ACCIDENTS_METRICS environment variable."""
+    return os.environ.get("ACCIDENTS_METRICS", "").lower() in ("1", "true", "yes")
+
+
+def start_run(trace_memory=False):
+    """Start recording one rerun. With `trace_memory`, peak memory is traced per stage."""
+    return {"id": uuid.uuid4().hex[:12], "started": time.time(), "clock": time.perf_counter(),
+            "trace_memory": trace_memory, "stages": [], "frames": {}}
+
+
+def frame_size(df):
+    """Rows and shallow memory (MB) of a frame."""
+    return {"rows": len(df), "mb": round(df.memory_usage(index=True, deep=False).sum() / 2**20, 3)}
+
+
+@contextmanager
+def stage(run, name):
+    """
+    Time the enclosed block as stage `name` of `run`. The yielded dict can take frames produced
+    by the stage (`record["frame"] = df`), whose size is then recorded.
+    """
+    record = {"stage": name}
+    if run["trace_memory"]:
+        with _TRACING_LOCK:
+            # Tracing is on while any traced stage runs (unless it was started outside this module),
+            # and the peak is only this stage's if no other traced stage runs at the same time
+            alone = _TRACING["active"] == 0
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _TRACING["owned"] = True
+            if alone:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            _TRACING["active"] += 1
+            _TRACING["starts"] += 1
+            starts = _TRACING["starts"]
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        entry = {"stage": name, "seconds": seconds, "peak_mb": None}
+        if run["trace_memory"]:
+            with _TRACING_LOCK:
+                _TRACING["active"] -= 1
+                if alone and _TRACING["starts"] == starts:
+                    entry["peak_mb"] = round((tracemalloc.get_traced_memory()[1] - before) / 2**20, 3)
+                if _TRACING["active"] == 0 and _TRACING["owned"]:
+                    tracemalloc.stop()
+                    _TRACING["owned"] = False
+        frame = record.get("frame")
+        if isinstance(frame, pd.DataFrame):
+            run["frames"][name] = frame_size(frame)
+        run["stages"].append(entry)
+
+
+def timed(run, name, func, *args, **kwargs):
+    """
+    Call `func` as stage `name` of `run` (e.g. in a worker thread); frames it returns are sized.
+    Stages running concurrently are timed but get no peak memory.
+    """
+    with stage(run, name) as record:
+        result = record["frame"] = func(*args, **kwargs)
+    return result
+
+
+def cache_stats():
+    """Hit/miss counters and sizes of every module-level LRU cache."""
+    return {
+        name: {"entries": len(cache), "hits": cache.hits, "misses": cache.misses,
+               "mb": round(cache.nbytes / 2**20, 3)}
+        for name, cache in sorted(all_caches().items())
+    }
+
+
+def finish_run(run):
+    """Add a finished run to the process totals and, with metrics enabled, log it as one JSON line."""
+    # Wall time: stages in the thread pool overlap, so their sum overstates the run
+    run["seconds"] = time.perf_counter() - run["clock"]
+    with _TOTALS_LOCK:
+        _RUNS["count"] += 1
+        for entry in run["stages"]:
+            totals = _TOTALS.setdefault(entry["stage"], {"count": 0, "seconds": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += entry["seconds"]
+            totals["last_seconds"] = entry["seconds"]
+            totals["last_peak_mb"] = entry["peak_mb"]
+
+    if metrics_enabled():
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+        logger.info(json.dumps({"event": "rerun", "run": run["id"], "started": run["started"],
+                                "seconds": round(run["seconds"], 6), "stages": run["stages"],
+                                "frames": run["frames"], "caches": cache_stats()}))
+    return run
+
+
+def stage_table(run):
+    """Stages of a run as a frame, slowest first; `share` is relative to the run's wall time."""
+    table = pd.DataFrame(run["stages"], columns=["stage", "seconds", "peak_mb"])
+    wall = run.get("seconds", time.perf_counter() - run["clock"])
+    table["share"] = (table["seconds"] / max(wall, 1e-12)).round(3)
+    return table.sort_values("seconds", ascending=False).reset_index(drop=True)
+
+
+def prometheus_text():
+    """Process totals and cache counters in the Prometheus text exposition format."""
+    lines = [
+        "# HELP accidents_reruns_total Dashboard reruns recorded.",
+        "# TYPE accidents_reruns_total counter",
+        f"accidents_reruns_total {_RUNS['count']}",
+        "# HELP accidents_stage_seconds Time spent per dashboard stage.",
+        "# TYPE accidents_stage_seconds summary",
+    ]
+    with _TOTALS_LOCK:
+        totals = {name: dict(values) for name, values in _TOTALS.items()}
+    for name, values in sorted(totals.items()):
+        lines.append(f'accidents_stage_seconds_sum{{stage="{name}"}} {values["seconds"]:.6f}')
+        lines.append(f'accidents_stage_seconds_count{{stage="{name}"}} {values["count"]}')
+    lines += ["# HELP accidents_stage_last_seconds Duration of the stage in the latest rerun.",
+              "# TYPE accidents_stage_last_seconds gauge"]
+    lines += [f'accidents_stage_last_seconds{{stage="{name}"}} {values["last_seconds"]:.6f}'
+              for name, values in sorted(totals.items())]
+
+    caches = cache_stats()
+    for metric, field, kind in (("cache_hits_total", "hits", "counter"), ("cache_misses_total", "misses", "counter"),
+                                ("cache_entries", "entries", "gauge"), ("cache_megabytes", "mb", "gauge")):
+        lines += [f"# TYPE accidents_{metric} {kind}"]
+        lines += [f'accidents_{metric}{{cache="{name}"}} {values[field]}' for name, values in caches.items()]
+    return "\n".join(lines) + "\n"
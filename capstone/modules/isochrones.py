@@ -0,0 +1,190 @@
+"""
+Walking isochrones for many origins at once.
+
+One Dijkstra pass per origin, limited to the largest threshold, gives the travel time to every
+reachable node; each threshold is then just a mask over those times. Polygons are built for
+all (origin, threshold) pairs with one vectorized Shapely call. Large jobs are split across a
+process pool whose workers load the cached street network (modules.routing) once. Results are
+stored per origin node next to the cached network, so later runs only compute new origins.
+
+Usage (from the capstone folder), e.g. isochrones around every accident hotspot:
+
+    python -m modules.isochrones --hotspots --minutes 5 10 15 --workers 4
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from modules.hotspots import PROJECTED_EPSG
+from modules.memo import LRUCache, stable_hash
+from modules.routing import NETWORK_CACHE_DIR, load_network, nearest_nodes, shortest_path_tree
+
+WALKING_SPEED = 1.11  # m/s, about 4 km/h
+ISO_MINUTES = (5, 10, 15)
+CONCAVE_RATIO = 0.3  # 0 = tightest concave hull, 1 = convex hull
+BUFFER_METRES = 40
+
+# Polygons (WKB per threshold) per ((network, minutes, speed, method), origin node)
+_ISOCHRONE_CACHE = LRUCache(maxsize=20_000)
+
+# Network of a worker process, loaded once by `_init_worker`
+_WORKER = {}
+
+
+def travel_times(network, origins, max_seconds, speed=WALKING_SPEED):
+    """Walking time in seconds from each origin node to every node (inf beyond `max_seconds`)."""
+    dist, _ = shortest_path_tree(network, origins, cost=network["length"] / speed, limit=max_seconds)
+    return dist
+
+
+def isochrone_shapes(network, origins, minutes=ISO_MINUTES, speed=WALKING_SPEED, method="concave"):
+    """
+    Isochrone polygons (projected, EPSG:3763) for each origin node and threshold.
+
+    Returns an array of shape (len(origins), len(minutes)). `method="concave"` takes the concave
+    hull of the reachable nodes; `method="buffer"` the union of BUFFER_METRES buffers around them,
+    which follows the street layout more closely. Origins reaching fewer than three nodes (whose
+    hull is a point or a line) get the buffer polygon as well.
+    """
+    seconds = np.asarray(minutes, dtype=np.float64) * 60
+    times = travel_times(network, origins, seconds.max(), speed)
+
+    # Reachable nodes of every (origin, threshold) as one flat list of MultiPoint parts
+    reached = times[:, None, :] <= seconds[None, :, None]
+    shape_index, node = np.nonzero(reached.reshape(-1, times.shape[1]))
+    shapes = shapely.multipoints(np.column_stack([network["x"][node], network["y"][node]]),
+                                 indices=shape_index)
+
+    if method == "buffer":
+        polygons = shapely.buffer(shapes, BUFFER_METRES)
+    else:
+        polygons = shapely.concave_hull(shapes, ratio=CONCAVE_RATIO)
+        degenerate = ~np.isin(shapely.get_type_id(polygons), [3, 6])  # not a (multi)polygon
+        polygons[degenerate] = shapely.buffer(shapes[degenerate], BUFFER_METRES)
+    return polygons.reshape(len(origins), len(minutes))
+
+
+def _network_key(network):
+    return (len(network["node_id"]), int(network["node_id"][0]), float(network["length"].sum()))
+
+
+def _store_path(cache_dir, key):
+    return os.path.join(cache_dir, f"isochrones_{stable_hash(key)[:16]}.parquet")
+
+
+def _read_store(path, n_minutes):
+    """{origin node: WKB per threshold} stored in `path`."""
+    if not os.path.exists(path):
+        return {}
+    table = pd.read_parquet(path)
+    wkb = table["wkb"].to_numpy(dtype=object).reshape(-1, n_minutes)
+    return dict(zip(table["node"].to_numpy()[::n_minutes].tolist(), wkb))
+
+
+def _write_store(path, shapes, n_minutes):
+    # One row per (node, threshold); the file is replaced atomically (last writer wins)
+    nodes = sorted(shapes)
+    table = pd.DataFrame({
+        "node": np.repeat(np.array(nodes, dtype=np.int64), n_minutes),
+        "wkb": np.concatenate([shapes[node] for node in nodes]) if nodes else [],
+    })
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    table.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(city, network_type, cache_dir):
+    _WORKER["network"] = load_network(city, network_type, cache_dir, offline=True)[0]
+
+
+def _worker_shapes(origins, minutes, speed, method):
+    return shapely.to_wkb(isochrone_shapes(_WORKER["network"], origins, minutes, speed, method))
+
+
+def batch_isochrones(lon, lat, minutes=ISO_MINUTES, speed=WALKING_SPEED, method="concave",
+                     city="Lisbon, Portugal", network_type="walk", cache_dir=NETWORK_CACHE_DIR,
+                     workers=None, chunk_size=32):
+    """
+    Isochrones around every (lon, lat) as a GeoDataFrame (EPSG:4326) with one row per
+    origin and threshold: origin (input position), node, minutes and geometry.
+
+    Origins are snapped to the nearest network node; origins sharing a node are computed once.
+    Results are cached per node in memory and in a Parquet file in `cache_dir` (one per network,
+    minutes, speed and method), so repeated runs only compute nodes not seen before.
+    With `workers` > 1 the remaining nodes are split in chunks of `chunk_size` over a process pool.
+    """
+    network, _ = load_network(city, network_type, cache_dir)
+    nodes, _ = nearest_nodes(network, lon, lat)
+    minutes = tuple(minutes)
+    store_key = (city, network_type, _network_key(network), minutes, speed, method)
+    shapes = {node: _ISOCHRONE_CACHE.get((store_key, node)) for node in np.unique(nodes).tolist()}
+    store_path = _store_path(cache_dir, store_key)
+    stored = _read_store(store_path, len(minutes)) if any(wkb is None for wkb in shapes.values()) else {}
+    for node in [node for node, wkb in shapes.items() if wkb is None and node in stored]:
+        shapes[node] = stored[node]
+        _ISOCHRONE_CACHE.put((store_key, node), stored[node])
+    todo = [node for node, wkb in shapes.items() if wkb is None]
+
+    chunks = [np.array(todo[i:i + chunk_size]) for i in range(0, len(todo), chunk_size)]
+    compute = partial(_worker_shapes, minutes=minutes, speed=speed, method=method)
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(chunks))
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(city, network_type, cache_dir)) as pool:
+            results = list(pool.map(compute, chunks))
+    else:
+        _WORKER["network"] = network
+        results = [compute(chunk) for chunk in chunks]
+    for chunk, wkb in zip(chunks, results):
+        for node, row in zip(chunk.tolist(), wkb):
+            shapes[node] = stored[node] = row
+            _ISOCHRONE_CACHE.put((store_key, node), row)
+    if todo:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_store(store_path, stored, len(minutes))
+
+    wkb = np.concatenate([shapes[node] for node in nodes.tolist()]) if len(nodes) else []
+    frame = pd.DataFrame({
+        "origin": np.repeat(np.arange(len(nodes)), len(minutes)),
+        "node": np.repeat(network["node_id"][nodes], len(minutes)),
+        "minutes": np.tile(minutes, len(nodes)),
+    })
+    gdf = gpd.GeoDataFrame(frame, geometry=shapely.from_wkb(wkb), crs=f"EPSG:{PROJECTED_EPSG}")
+    return gdf.to_crs(epsg=4326)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walking isochrones for many origins.")
+    parser.add_argument("--points", help="CSV with latitude/longitude columns to use as origins")
+    parser.add_argument("--hotspots", action="store_true", help="use the accident hotspot centroids as origins")
+    parser.add_argument("--minutes", nargs="+", type=float, default=list(ISO_MINUTES))
+    parser.add_argument("--method", choices=["concave", "buffer"], default="concave")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="cache/isochrones.parquet", help="output GeoParquet")
+    args = parser.parse_args()
+
+    if args.hotspots:
+        from modules.accident_store import load_enriched_data
+        from modules.hotspots import hotspot_labels, hotspot_summary
+        df = load_enriched_data()
+        origins = hotspot_summary(df, hotspot_labels(df))
+    elif args.points:
+        origins = pd.read_csv(args.points)
+    else:
+        parser.error("pass --points or --hotspots")
+
+    gdf = batch_isochrones(origins["longitude"].to_numpy(), origins["latitude"].to_numpy(),
+                           args.minutes, method=args.method, workers=args.workers)
+    gdf.to_parquet(args.out)
+    print(f"{len(origins)} origins, {len(gdf)} isochrones written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
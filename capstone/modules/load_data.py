@@ -1,18 +1,119 @@
+import os
+import re
+
+import geopandas as gpd
 import pandas as pd
-import osmnx as ox
 
-def load_accident_data(path="data/Road_Accidents_Lisbon.csv"):
+from modules.schema import apply_schema
+
+BOUNDARY_CACHE_DIR = "cache"
+DISPLAY_TOLERANCE = 0.001
+
+# Boundaries already loaded by this process, keyed by (city, epsg, cache_dir)
+_BOUNDARY_CACHE = {}
+
+
+def load_accident_data(path="data/Road_Accidents_Lisbon.csv", compact=True):
+    """
+    Read the accident CSV. With `compact=True` the declared schema (modules.schema) is applied
+    and the bytes saved per column are kept in `df.attrs["schema_report"]`.
+    """
     df = pd.read_csv(path)
+    if compact:
+        df, report = apply_schema(df)
+        df.attrs["schema_report"] = {row.column: int(row.bytes_saved) for row in report.itertuples()}
     return df
 
-def load_boundary(city="Lisbon, Portugal", epsg=4326):
-    gdf = ox.geocode_to_gdf(city)
-    gdf = gdf.to_crs(epsg=epsg)
 
-    union = gdf.unary_union
-    if union.geom_type == "MultiPolygon":
-        boundary = max(union, key=lambda p: p.area)
-    else:
-        boundary = union
+def geocode_source(city):
+    """Default boundary source: geocode the city with OSMnx (needs network access)."""
+    import osmnx as ox
+    return ox.geocode_to_gdf(city)
+
+
+def file_source(path):
+    """Boundary source reading a local GeoJSON, GeoPackage or GeoParquet file."""
+    def source(city):
+        if path.endswith(".parquet"):
+            return gpd.read_parquet(path)
+        return gpd.read_file(path)
+    return source
+
+
+def is_offline():
+    """Offline mode is switched on with the ACCIDENTS_OFFLINE environment variable."""
+    return os.environ.get("ACCIDENTS_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+def _boundary_paths(city, cache_dir):
+    slug = re.sub(r"[^a-z0-9]+", "_", city.lower()).strip("_")
+    return (os.path.join(cache_dir, f"boundary_{slug}.parquet"),
+            os.path.join(cache_dir, f"boundary_{slug}_display.parquet"))
+
+
+def _write_parquet(gdf, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    gdf.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def fetch_boundary(city="Lisbon, Portugal", cache_dir=BOUNDARY_CACHE_DIR, offline=None,
+                   source=None, refresh=False):
+    """
+    Return the full and the display (simplified) boundary GeoDataFrames in EPSG:4326.
+
+    Both are read from the GeoParquet cache in `cache_dir` when present. Otherwise the
+    boundary is fetched from `source` (a callable taking the city name, or a path to a
+    local file; defaults to OSMnx geocoding) and written to the cache.
+    In offline mode the source is never called and a missing cache raises FileNotFoundError.
+    """
+    if offline is None:
+        offline = is_offline()
+    full_path, display_path = _boundary_paths(city, cache_dir)
+
+    if not refresh and os.path.exists(full_path) and os.path.exists(display_path):
+        return gpd.read_parquet(full_path), gpd.read_parquet(display_path)
+
+    if offline:
+        raise FileNotFoundError(
+            f"No cached boundary for '{city}' in '{cache_dir}' and offline mode is enabled"
+        )
+
+    if source is None:
+        source = geocode_source
+    elif isinstance(source, str):
+        source = file_source(source)
+
+    gdf = source(city).to_crs(epsg=4326)
+    display_gdf = gdf.copy()
+    display_gdf["geometry"] = gdf.geometry.simplify(tolerance=DISPLAY_TOLERANCE)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_parquet(gdf, full_path)
+    _write_parquet(display_gdf, display_path)
+    return gdf, display_gdf
+
+
+def load_boundary(city="Lisbon, Portugal", epsg=4326, cache_dir=BOUNDARY_CACHE_DIR,
+                  offline=None, source=None, display=False):
+    """
+    Return the city boundary GeoDataFrame and its largest polygon.
+
+    Results are kept in memory for the lifetime of the process and on disk across runs
+    (see `fetch_boundary`). With `display=True` the pre-simplified copy meant for maps is returned.
+    """
+    key = (city, epsg, cache_dir)
+    if key not in _BOUNDARY_CACHE:
+        gdf, display_gdf = fetch_boundary(city, cache_dir=cache_dir, offline=offline, source=source)
+        gdf = gdf.to_crs(epsg=epsg)
+        display_gdf = display_gdf.to_crs(epsg=epsg)
+
+        union = gdf.union_all()
+        if union.geom_type == "MultiPolygon":
+            boundary = max(union.geoms, key=lambda p: p.area)
+        else:
+            boundary = union
+        _BOUNDARY_CACHE[key] = (gdf, display_gdf, boundary)
 
-    return gdf, boundary
+    gdf, display_gdf, boundary = _BOUNDARY_CACHE[key]
+    return (display_gdf if display else gdf), boundary
@@ -1,21 +1,343 @@
-import streamlit as st   # <--- add this at the top
+import hashlib
+
+import numpy as np
+
 import geopandas as gpd
-from shapely.geometry import Point
 import folium
-from folium.plugins import MarkerCluster
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from folium.template import Template
+from folium.plugins import MarkerCluster, FastMarkerCluster, HeatMap, Draw
 import pandas as pd
+import shapely.geometry
+
+# Geometry construction lives in modules.geometry; re-exported here for existing imports
+from modules.geometry import df_to_gdf
+from modules.clusters import get_cluster_pyramid
+from modules.memo import LRUCache, frame_key
+# Accident weights live in modules.stats (no Streamlit import); re-exported here for existing imports
+from modules.stats import SEVERITY_WEIGHTS, accident_weights, date_strings
+
+MAP_CACHE_BYTES = 256 * 1024 * 1024
+
+# Layers are cached on their own so that a filter change only rebuilds the point layer
+_BOUNDARY_LAYER_CACHE = LRUCache(maxsize=4)
+_POINT_LAYER_CACHE = LRUCache(maxsize=16, max_bytes=MAP_CACHE_BYTES // 2,
+                              sizeof=lambda rows: 100 * len(rows))
+_MAP_HTML_CACHE = LRUCache(maxsize=32, max_bytes=MAP_CACHE_BYTES, sizeof=len)
+_HEAT_CACHE = LRUCache(maxsize=32, max_bytes=MAP_CACHE_BYTES // 4,
+                       sizeof=lambda pyramid: 30 * sum(len(rows) for rows in pyramid["levels"].values()))
+
+# Heatmap pyramid: one grid per zoom level, with cells of HEAT_CELL_PX screen pixels
+HEAT_ZOOMS = range(10, 19)
+HEAT_CELL_PX = 8
+MAX_HEAT_CELLS = 50_000  # finer levels are not shipped; the map keeps the finest level below the cap
+
+# Columns shipped to the browser for every point: [lat, lon, id, date, weekday, hour, minor, serious, fatal]
+POPUP_COLUMNS = ["id", "date_str", "weekday", "hour",
+                 "minor_injuries_30d", "serious_injuries_30d", "fatalities_30d"]
+
+# Builds each marker in the browser; the popup HTML is only generated when it is opened
+POINT_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 7, color: "#8B0000", weight: 2,
+        fill: true, fillOpacity: 0.8, fillColor: "#FF3333"
+    });
+    marker.bindPopup(function () {
+        return '<div style="font-size:14px; line-height:1.4;">' +
+            '<b style="font-size:16px;">Accident ID: ' + row[2] + '</b><br><br>' +
+            '<b>Date:</b> ' + row[3] + '<br>' +
+            '<b>Weekday:</b> ' + row[4] + '<br>' +
+            '<b>Hour:</b> ' + row[5] + '<br>' +
+            '<b>Minor Injuries:</b> ' + row[6] + '<br>' +
+            '<b>Serious Injuries:</b> ' + row[7] + '<br>' +
+            '<b>Fatalities:</b> ' + row[8] + '<br>' +
+            '</div>';
+    }, {maxWidth: 300});
+    return marker;
+}
+"""
+
+
+def point_rows(df, precision=6):
+    """Compact per-point rows for the browser, built column-wise instead of row by row."""
+    columns = {
+        "latitude": df["latitude"].astype("float64").round(precision),
+        "longitude": df["longitude"].astype("float64").round(precision),
+    }
+    for column in POPUP_COLUMNS:
+        columns[column] = date_strings(df) if column == "date_str" else df[column]
+    return pd.DataFrame(columns).astype(object).where(lambda d: d.notna(), None).to_numpy().tolist()
+
 
-def df_to_gdf(df):
-    return gpd.GeoDataFrame(
-        df,
-        geometry=[Point(xy) for xy in zip(df["longitude"], df["latitude"])],
-        crs="EPSG:4326"
+def add_points_bulk(rows, parent):
+    """Add all points (rows from `point_rows`) as one clustered JSON payload rendered in the browser."""
+    cluster = FastMarkerCluster([], callback=POINT_CALLBACK)
+    # Rows are already plain floats, so skip folium's per-row location validation
+    cluster.data = rows
+    cluster.add_to(parent)
+    return cluster
+
+
+def add_points_markers(_gdf, parent):
+    """Add one folium CircleMarker per point (only sensible for small selections)."""
+    marker_cluster = MarkerCluster().add_to(parent)
+    for row, date_str in zip(_gdf.itertuples(index=False), date_strings(_gdf)):
+        popup_html = f"""
+        <div style="font-size:14px; line-height:1.4;">
+            <b style="font-size:16px;">Accident ID: {row.id}</b><br><br>
+            <b>Date:</b> {date_str}<br>
+            <b>Weekday:</b> {row.weekday}<br>
+            <b>Hour:</b> {row.hour}<br>
+            <b>Minor Injuries:</b> {row.minor_injuries_30d}<br>
+            <b>Serious Injuries:</b> {row.serious_injuries_30d}<br>
+            <b>Fatalities:</b> {row.fatalities_30d}<br>
+        </div>
+        """
+        folium.CircleMarker(
+            location=[row.latitude, row.longitude],
+            radius=7,
+            color="#8B0000",
+            weight=2,
+            fill=True,
+            fill_opacity=0.8,
+            fill_color="#FF3333",
+            popup=folium.Popup(popup_html, max_width=300),
+        ).add_to(marker_cluster)
+    return marker_cluster
+
+
+def boundary_key(_boundary_gdf):
+    """Version of a boundary GeoDataFrame: a hash of its geometries."""
+    return hashlib.sha1(b"".join(_boundary_gdf.geometry.to_wkb())).hexdigest()
+
+
+def boundary_layer_json(_boundary_gdf):
+    """Simplified boundary GeoJSON, built once per boundary version."""
+    return _BOUNDARY_LAYER_CACHE.get_or_create(
+        boundary_key(_boundary_gdf),
+        lambda: gpd.GeoSeries(_boundary_gdf.geometry).simplify(tolerance=0.001).to_json(),
     )
 
 
-# @st.cache_data
-def create_map(_gdf, _boundary_gdf):
+def _mercator_pixels(df, zoom):
+    # Web Mercator pixel coordinates of the points at `zoom` (what Leaflet draws on)
+    lat = np.radians(df["latitude"].to_numpy(np.float64))
+    lon = df["longitude"].to_numpy(np.float64)
+    size = 256 * 2.0 ** zoom
+    x = (lon + 180) / 360 * size
+    y = (0.5 - np.log(np.tan(np.pi / 4 + lat / 2)) / (2 * np.pi)) * size
+    return x, y
+
+
+def heat_pyramid(df, weights=None, zooms=HEAT_ZOOMS, cell_px=HEAT_CELL_PX, max_cells=MAX_HEAT_CELLS):
+    """
+    Bin the accidents into one weighted grid per zoom level.
+
+    The points are binned once at the finest zoom; every coarser level merges 2x2 cells of the
+    level below, so the cost is one pass over the points plus a pass over the (few) cells.
+    Returns {"levels": {zoom: [[lat, lon, weight], ...]}, "max": {zoom: largest weight}}, where
+    each cell sits at the mean position of its accidents and cells of weight 0 are left out.
+    Levels with more than `max_cells` cells are skipped (the coarsest level is always kept).
+    """
+    zooms = sorted(zooms, reverse=True)
+    x, y = _mercator_pixels(df, zooms[0])
+    cell_x = np.floor(x / cell_px).astype(np.int64)
+    cell_y = np.floor(y / cell_px).astype(np.int64)
+    count = np.ones(len(df))
+    lat_sum = df["latitude"].to_numpy(np.float64)
+    lon_sum = df["longitude"].to_numpy(np.float64)
+    weight = accident_weights(df, weights)
+
+    pyramid = {"levels": {}, "max": {}}
+    previous = zooms[0]
+    for zoom in zooms:
+        shift = previous - zoom
+        previous = zoom
+        cell_x, cell_y = cell_x >> shift, cell_y >> shift
+        cells, inverse = np.unique((cell_x << 32) | cell_y, return_inverse=True)
+        # Collapse to one entry per cell: the next level is built from these
+        cell_x, cell_y = cells >> 32, cells & 0xFFFFFFFF
+        count, lat_sum, lon_sum, weight = (np.bincount(inverse, values, minlength=len(cells))
+                                           for values in (count, lat_sum, lon_sum, weight))
+
+        shown = weight > 0
+        if shown.sum() > max_cells and zoom != zooms[-1]:
+            continue
+        level = np.column_stack([
+            np.round(lat_sum[shown] / count[shown], 5),
+            np.round(lon_sum[shown] / count[shown], 5),
+            np.round(weight[shown], 2),
+        ])
+        pyramid["levels"][zoom] = level.tolist()
+        pyramid["max"][zoom] = float(weight.max()) if shown.any() else 1.0
+    return pyramid
 
+
+def get_heat_pyramid(df, heat="accidents", cache_key=None):
+    """Heat pyramid for a selection and a `SEVERITY_WEIGHTS` name, cached per (selection, weighting)."""
+    key = (cache_key if cache_key is not None else frame_key(df), heat)
+    return _HEAT_CACHE.get_or_create(key, lambda: heat_pyramid(df, SEVERITY_WEIGHTS[heat]))
+
+
+class HeatPyramidLayer(JSCSSMixin, Layer):
+    """
+    Leaflet heat layer fed from a precomputed `heat_pyramid`: on every zoom change the
+    grid of the nearest zoom level replaces the points, so the browser only ever draws
+    a few thousand weighted cells.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var levels = {{ this.levels|tojson }};
+            var maxima = {{ this.maxima|tojson }};
+            var zooms = Object.keys(levels).map(Number);
+            var lowest = Math.min.apply(null, zooms), highest = Math.max.apply(null, zooms);
+            var layer = L.heatLayer([], {{ this.options|tojson }});
+            var map = null;
+            function update() {
+                var zoom = Math.min(Math.max(Math.round(map.getZoom()), lowest), highest);
+                layer.setOptions({max: maxima[zoom]});
+                layer.setLatLngs(levels[zoom]);
+            }
+            layer.on("add", function (e) { map = e.target._map; map.on("zoomend", update); update(); });
+            layer.on("remove", function () { if (map) { map.off("zoomend", update); } });
+            return layer;
+        })();
+        {% endmacro %}
+    """)
+
+    default_js = HeatMap.default_js
+
+    def __init__(self, pyramid, name="Heatmap", radius=2 * HEAT_CELL_PX, blur=HEAT_CELL_PX * 2, show=True):
+        super().__init__(name=name, overlay=True, show=show)
+        self._name = "HeatPyramidLayer"
+        self.levels = pyramid["levels"]
+        self.maxima = pyramid["max"]
+        # maxZoom 0 turns off leaflet-heat's own zoom scaling: the weights are already per level
+        self.options = {"radius": radius, "blur": blur, "maxZoom": 0, "minOpacity": 0.3}
+
+
+class ClusterPyramidLayer(Layer):
+    """
+    Accident clusters from a precomputed `clusters.cluster_pyramid`: on every move the clusters
+    of the current zoom inside the (padded) viewport are drawn, so the browser never clusters
+    and only draws what is on screen. Single accidents open the usual popup; clicking a cluster
+    zooms in on it, or lists its accidents at the highest level.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var levels = {{ this.levels|tojson }};
+            var points = {{ this.points|tojson }};
+            var zooms = Object.keys(levels).map(Number);
+            var lowest = Math.min.apply(null, zooms), highest = Math.max.apply(null, zooms);
+            var renderer = L.canvas();
+            var group = L.featureGroup();
+            var map = null;
+            function popup(row) {
+                return '<div style="font-size:14px; line-height:1.4;">' +
+                    '<b style="font-size:16px;">Accident ID: ' + row[2] + '</b><br><br>' +
+                    '<b>Date:</b> ' + row[3] + '<br>' +
+                    '<b>Weekday:</b> ' + row[4] + '<br>' +
+                    '<b>Hour:</b> ' + row[5] + '<br>' +
+                    '<b>Minor Injuries:</b> ' + row[6] + '<br>' +
+                    '<b>Serious Injuries:</b> ' + row[7] + '<br>' +
+                    '<b>Fatalities:</b> ' + row[8] + '<br>' +
+                    '</div>';
+            }
+            function memberList(c, members) {
+                var items = members.map(function (i) {
+                    var row = points[i];
+                    return '<li><b>' + row[2] + '</b> ' + row[3] + ' ' + row[5] + 'h: ' +
+                        row[6] + ' minor, ' + row[7] + ' serious, ' + row[8] + ' fatal</li>';
+                });
+                return '<div style="font-size:13px; line-height:1.4;">' +
+                    '<b style="font-size:15px;">' + c[2] + ' accidents</b>' +
+                    '<ul style="max-height:220px; overflow-y:auto; margin:6px 0 0; padding-left:18px;">' +
+                    items.join("") + '</ul></div>';
+            }
+            function clusterIcon(c) {
+                var size = Math.round(26 + 8 * Math.log10(c[2]));
+                var color = c[5] > 0 ? "#8B0000" : (c[4] > 0 ? "#D7301F" : "#FF6F61");
+                var label = c[2] >= 1000 ? (c[2] / 1000).toFixed(1) + "k" : c[2];
+                return L.divIcon({
+                    className: "", iconSize: [size, size],
+                    html: '<div style="width:' + size + 'px;height:' + size + 'px;line-height:' + size +
+                        'px;border-radius:50%;background:' + color + ';opacity:0.85;color:#fff;' +
+                        'text-align:center;font:bold 12px sans-serif;">' + label + '</div>'
+                });
+            }
+            function update() {
+                var zoom = Math.min(Math.max(Math.round(map.getZoom()), lowest), highest);
+                var bounds = map.getBounds().pad(0.5);
+                group.clearLayers();
+                levels[zoom].singles.forEach(function (i) {
+                    var row = points[i];
+                    if (!bounds.contains([row[0], row[1]])) { return; }
+                    L.circleMarker([row[0], row[1]], {
+                        renderer: renderer, radius: 7, color: "#8B0000", weight: 2,
+                        fill: true, fillOpacity: 0.8, fillColor: "#FF3333"
+                    }).bindPopup(function () { return popup(row); }, {maxWidth: 300}).addTo(group);
+                });
+                levels[zoom].clusters.forEach(function (c, j) {
+                    if (!bounds.contains([c[0], c[1]])) { return; }
+                    var marker = L.marker([c[0], c[1]], {icon: clusterIcon(c)});
+                    marker.bindTooltip(c[2] + " accidents<br>Minor injuries: " + c[3] +
+                                       "<br>Serious injuries: " + c[4] + "<br>Fatalities: " + c[5]);
+                    if (zoom < highest) {
+                        marker.on("click", function () {
+                            map.setView([c[0], c[1]], Math.min(zoom + 2, highest));
+                        });
+                    } else {
+                        // Accidents too close to split at any shipped zoom are listed instead
+                        var members = levels[zoom].members[j];
+                        marker.bindPopup(function () { return memberList(c, members); }, {maxWidth: 360});
+                    }
+                    marker.addTo(group);
+                });
+            }
+            group.on("add", function (e) { map = e.target._map; map.on("moveend", update); update(); });
+            group.on("remove", function () { if (map) { map.off("moveend", update); } });
+            return group;
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, pyramid, points, name="Accidents", show=True):
+        super().__init__(name=name, overlay=True, show=show)
+        self._name = "ClusterPyramidLayer"
+        self.levels = pyramid["levels"]
+        self.points = points
+
+
+def create_map(_gdf, _boundary_gdf, mode="clusters", cache_key=None, heat=None):
+    """
+    Build the accident map and return it as an HTML string.
+
+    mode="clusters" ships the server-side cluster pyramid (modules.clusters): per zoom only
+    the cluster centroids with their counts and injury sums, plus popup rows for the single
+    accidents and for the clusters of the highest level. mode="bulk" ships every point as one compact array clustered in the browser,
+    so the HTML grows by a few dozen bytes per point. mode="markers" keeps the original
+    one-CircleMarker-per-accident rendering. `heat` (a `SEVERITY_WEIGHTS` name)
+    adds a heatmap layer built from the precomputed pyramid (see `heat_pyramid`).
+
+    The HTML is cached per (point selection, boundary version, mode, heat). `cache_key` identifies
+    the point selection, e.g. `filter_index.filter_state_key`; by default the row selection
+    of `_gdf` is used. Boundary and point layers are cached separately, so a filter change
+    only rebuilds the point layer.
+    """
+    points_key = cache_key if cache_key is not None else frame_key(_gdf)
+    key = (points_key, boundary_key(_boundary_gdf), mode, heat)
+    return _MAP_HTML_CACHE.get_or_create(
+        key, lambda: _render_map(_gdf, _boundary_gdf, mode, points_key, heat)
+    )
+
+
+def _render_map(_gdf, _boundary_gdf, mode, points_key, heat=None):
     if len(_gdf) > 0:
         center = [_gdf["latitude"].mean(), _gdf["longitude"].mean()]
     else:
@@ -25,37 +347,29 @@ def create_map(_gdf, _boundary_gdf):
 
     # Add Lisbon boundary polygons
     boundary_fg = folium.FeatureGroup(name="Lisbon Boundary")
-    for _, r in _boundary_gdf.iterrows():
-        sim_geo = gpd.GeoSeries(r["geometry"]).simplify(tolerance=0.001)
-        folium.GeoJson(sim_geo.to_json(), style_function=lambda x: {"fillColor": "orange"}).add_to(boundary_fg)
-    boundary_fg.add_to(m)   
+    folium.GeoJson(boundary_layer_json(_boundary_gdf),
+                   style_function=lambda x: {"fillColor": "orange"}).add_to(boundary_fg)
+    boundary_fg.add_to(m)
 
+    if heat is not None and len(_gdf) > 0:
+        HeatPyramidLayer(get_heat_pyramid(_gdf, heat, points_key),
+                         name=f"Heatmap ({heat})").add_to(m)
+
+    if mode == "clusters":
+        if len(_gdf) > 0:
+            pyramid = get_cluster_pyramid(_gdf, points_key)
+            ClusterPyramidLayer(pyramid, point_rows(_gdf.take(pyramid["rows"])),
+                                show=heat is None).add_to(m)
+        folium.LayerControl(collapsed=False).add_to(m)
+        return m._repr_html_()
+
+    points_fg = folium.FeatureGroup(name="Accidents", show=heat is None)
     if len(_gdf) > 0:
-        points_fg = folium.FeatureGroup(name="Accidents")
-        marker_cluster = MarkerCluster().add_to(points_fg)
-        for _, row in _gdf.iterrows():
-            date_str = pd.to_datetime(row["date"]).strftime("%d %b %Y")
-            popup_html = f"""
-            <div style="font-size:14px; line-height:1.4;">
-                <b style="font-size:16px;">Accident ID: {row['id']}</b><br><br>
-                <b>Date:</b> {date_str}<br>
-                <b>Weekday:</b> {row['weekday']}<br>
-                <b>Hour:</b> {row['hour']}<br>
-                <b>Minor Injuries:</b> {row['minor_injuries_30d']}<br>
-                <b>Serious Injuries:</b> {row['serious_injuries_30d']}<br>
-                <b>Fatalities:</b> {row['fatalities_30d']}<br>
-            </div>
-            """
-            folium.CircleMarker(
-                location=[row["latitude"], row["longitude"]],
-                radius=7,
-                color="#8B0000",
-                weight=2,
-                fill=True,
-                fill_opacity=0.8,
-                fill_color="#FF3333",
-                popup=folium.Popup(popup_html, max_width=300),
-            ).add_to(marker_cluster)
+        if mode == "markers":
+            add_points_markers(_gdf, points_fg)
+        else:
+            rows = _POINT_LAYER_CACHE.get_or_create(points_key, lambda: point_rows(_gdf))
+            add_points_bulk(rows, points_fg)
     points_fg.add_to(m)
     # ----------------------
     # Add LayerControl
@@ -63,3 +377,258 @@ def create_map(_gdf, _boundary_gdf):
     folium.LayerControl(collapsed=False).add_to(m)
     # Instead of caching the map, cache the HTML string
     return m._repr_html_()
+
+
+class GeoJsonTileLayer(Layer):
+    """
+    Leaflet layer that fetches GeoJSON tiles for the visible z/x/y only
+    and drops them again when they leave the viewport.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var group = L.featureGroup();
+            var loaded = {};
+            var grid = L.GridLayer.extend({
+                createTile: function (coords, done) {
+                    var tile = document.createElement("div");
+                    var key = coords.z + "/" + coords.x + "/" + coords.y;
+                    var url = {{ this.url|tojson }}
+                        .replace("{z}", coords.z).replace("{x}", coords.x).replace("{y}", coords.y);
+                    fetch(url).then(function (r) { return r.ok ? r.json() : null; }).then(function (data) {
+                        if (data) {
+                            loaded[key] = L.geoJSON(data, {
+                                style: function () { return {{ this.style|tojson }}; },
+                                pointToLayer: function (f, latlng) {
+                                    return L.circleMarker(latlng, {{ this.style|tojson }});
+                                },
+                                onEachFeature: function (f, layer) {
+                                    if (f.geometry.type !== "Point") { return; }
+                                    layer.bindPopup(function () {
+                                        var p = f.properties;
+                                        return '<div style="font-size:14px; line-height:1.4;">' +
+                                            '<b style="font-size:16px;">Accident ID: ' + p.id + '</b><br><br>' +
+                                            '<b>Date:</b> ' + p.date_str + '<br>' +
+                                            '<b>Weekday:</b> ' + p.weekday + '<br>' +
+                                            '<b>Hour:</b> ' + p.hour + '<br>' +
+                                            '<b>Minor Injuries:</b> ' + p.minor_injuries_30d + '<br>' +
+                                            '<b>Serious Injuries:</b> ' + p.serious_injuries_30d + '<br>' +
+                                            '<b>Fatalities:</b> ' + p.fatalities_30d + '<br></div>';
+                                    }, {maxWidth: 300});
+                                }
+                            }).addTo(group);
+                        }
+                        done(null, tile);
+                    }).catch(function (e) { done(e, tile); });
+                    return tile;
+                }
+            });
+            var tiles = new grid({minZoom: {{ this.min_zoom }}});
+            tiles.on("tileunload", function (e) {
+                var key = e.coords.z + "/" + e.coords.x + "/" + e.coords.y;
+                if (loaded[key]) { group.removeLayer(loaded[key]); delete loaded[key]; }
+            });
+            group.on("add", function () { tiles.addTo({{ this._parent.get_name() }}); });
+            group.on("remove", function () { {{ this._parent.get_name() }}.removeLayer(tiles); });
+            return group;
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, name, style, min_zoom=0):
+        super().__init__(name=name, overlay=True)
+        self._name = "GeoJsonTileLayer"
+        self.url = url
+        self.style = style
+        self.min_zoom = min_zoom
+
+
+def create_tile_map(points_url, boundary_url, center, zoom_start=12):
+    """
+    Map whose accident points and boundary are fetched per visible tile from the tile
+    server (see modules.tiles), so the page weight does not depend on the dataset size.
+    """
+    m = folium.Map(location=center, zoom_start=zoom_start, tiles="CartoDB Positron")
+    GeoJsonTileLayer(boundary_url, "Lisbon Boundary",
+                     {"color": "#3388ff", "weight": 2, "fillColor": "orange", "fillOpacity": 0.2}).add_to(m)
+    GeoJsonTileLayer(points_url, "Accidents",
+                     {"radius": 5, "color": "#8B0000", "weight": 1, "fill": True,
+                      "fillOpacity": 0.8, "fillColor": "#FF3333"}, min_zoom=10).add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m._repr_html_()
+
+
+# Colours cycled over the hotspot labels
+HOTSPOT_COLORS = ["#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4",
+                  "#42d4f4", "#f032e6", "#bfef45", "#469990", "#9a6324"]
+
+
+class PointArrayLayer(Layer):
+    """
+    Canvas-rendered circle markers from a compact [lat, lon, colour index] array,
+    so thousands of points cost a few bytes each in the HTML.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function () {
+            var renderer = L.canvas();
+            var colors = {{ this.colors|tojson }};
+            var group = L.featureGroup();
+            {{ this.rows|tojson }}.forEach(function (row) {
+                var color = row[2] < 0 ? {{ this.noise_color|tojson }} : colors[row[2] % colors.length];
+                L.circleMarker([row[0], row[1]], {
+                    renderer: renderer, radius: row[2] < 0 ? 2 : 4, weight: 0,
+                    fillColor: color, fillOpacity: row[2] < 0 ? 0.4 : 0.9
+                }).addTo(group);
+            });
+            return group;
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, rows, name, colors, noise_color="#999999"):
+        super().__init__(name=name, overlay=True)
+        self._name = "PointArrayLayer"
+        self.rows = rows
+        self.colors = colors
+        self.noise_color = noise_color
+
+
+def create_hotspot_map(df, labels, summary, _boundary_gdf, cache_key=None, max_centroids=200):
+    """
+    Map of DBSCAN hotspots (see modules.hotspots): every accident coloured by its cluster
+    (noise in grey) and a circle with a popup at the centroid of the largest hotspots.
+    The HTML is cached per `cache_key` (which must identify the selection and the parameters).
+    """
+    key = ("hotspots", cache_key if cache_key is not None else frame_key(df), boundary_key(_boundary_gdf))
+    return _MAP_HTML_CACHE.get_or_create(
+        key, lambda: _render_hotspot_map(df, labels, summary, _boundary_gdf, max_centroids)
+    )
+
+
+def _render_hotspot_map(df, labels, summary, _boundary_gdf, max_centroids):
+    if len(df) > 0:
+        center = [df["latitude"].mean(), df["longitude"].mean()]
+    else:
+        center = [_boundary_gdf["lat"].mean(), _boundary_gdf["lon"].mean()]
+    m = folium.Map(location=center, zoom_start=12, tiles="CartoDB Positron")
+
+    boundary_fg = folium.FeatureGroup(name="Lisbon Boundary")
+    folium.GeoJson(boundary_layer_json(_boundary_gdf),
+                   style_function=lambda x: {"fillColor": "orange", "fillOpacity": 0.05}).add_to(boundary_fg)
+    boundary_fg.add_to(m)
+
+    rows = pd.DataFrame({
+        "latitude": df["latitude"].astype("float64").round(6),
+        "longitude": df["longitude"].astype("float64").round(6),
+        "hotspot": labels,
+    }).to_numpy(dtype=object).tolist()
+    PointArrayLayer(rows, "Accidents by hotspot", HOTSPOT_COLORS).add_to(m)
+
+    # One circle per hotspot, not per accident
+    centroids_fg = folium.FeatureGroup(name="Hotspot centroids")
+    for hotspot, row in summary.head(max_centroids).iterrows():
+        folium.CircleMarker(
+            location=[row.latitude, row.longitude],
+            radius=6 + min(row.accidents, 50) / 2,
+            color=HOTSPOT_COLORS[hotspot % len(HOTSPOT_COLORS)],
+            weight=2,
+            fill=False,
+            popup=folium.Popup(
+                f"<b>Hotspot {hotspot}</b><br>"
+                f"<b>Accidents:</b> {row.accidents}<br>"
+                f"<b>Minor Injuries:</b> {row.minor_injuries}<br>"
+                f"<b>Serious Injuries:</b> {row.serious_injuries}<br>"
+                f"<b>Fatalities:</b> {row.fatalities}",
+                max_width=250,
+            ),
+        ).add_to(centroids_fg)
+    centroids_fg.add_to(m)
+
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m._repr_html_()
+
+
+# Yellow-to-red classes for the segment risk quantiles
+RISK_COLORS = ["#ffffb2", "#fecc5c", "#fd8d3c", "#f03b20", "#bd0026"]
+
+
+def create_segment_map(risk, _boundary_gdf, cache_key=None):
+    """
+    Map of street segments coloured by accident risk (see modules.segments.segment_risk):
+    segments are classed by risk quantile, the riskiest drawn darkest and thickest.
+    The HTML is cached per `cache_key` (which must identify the selection and the weighting).
+    """
+    key = ("segments", cache_key if cache_key is not None else frame_key(risk), boundary_key(_boundary_gdf))
+    return _MAP_HTML_CACHE.get_or_create(key, lambda: _render_segment_map(risk, _boundary_gdf))
+
+
+def _render_segment_map(risk, _boundary_gdf):
+    center = [_boundary_gdf["lat"].mean(), _boundary_gdf["lon"].mean()]
+    m = folium.Map(location=center, zoom_start=12, tiles="CartoDB Positron")
+
+    boundary_fg = folium.FeatureGroup(name="Lisbon Boundary")
+    folium.GeoJson(boundary_layer_json(_boundary_gdf),
+                   style_function=lambda x: {"fillColor": "orange", "fillOpacity": 0.05}).add_to(boundary_fg)
+    boundary_fg.add_to(m)
+
+    if len(risk) > 0:
+        # Class and style are computed column-wise and shipped as feature properties
+        edges = np.quantile(risk["risk"], np.linspace(0, 1, len(RISK_COLORS) + 1)[1:-1])
+        risk_class = np.searchsorted(edges, risk["risk"].to_numpy(), side="right")
+        layer = gpd.GeoDataFrame({
+            "name": risk["name"].fillna("(unnamed)").astype(str),
+            "accidents": risk["accidents"],
+            "victims": (risk["minor_injuries_30d"] + risk["serious_injuries_30d"]
+                        + risk["fatalities_30d"]).astype(int),
+            "risk": risk["risk"].round(1),
+            "color": np.array(RISK_COLORS)[risk_class],
+            "weight": 2 + risk_class,
+        }, geometry=risk.geometry.simplify(0.00002).to_numpy(), crs=risk.crs)
+        folium.GeoJson(
+            layer.to_json(),
+            name="Segment risk",
+            style_function=lambda f: {"color": f["properties"]["color"],
+                                      "weight": f["properties"]["weight"], "opacity": 0.9},
+            tooltip=folium.GeoJsonTooltip(["name", "accidents", "victims", "risk"],
+                                          aliases=["Street", "Accidents", "Victims", "Risk score"]),
+        ).add_to(m)
+
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m._repr_html_()
+
+
+def create_selection_map(df, _boundary_gdf, cache_key=None):
+    """
+    Map for area selection (rendered with `st_folium`): the boundary, an accident heatmap of
+    `df` and drawing tools for a rectangle or a polygon. Read the result with `map_selection`.
+    """
+    m = folium.Map(location=[_boundary_gdf["lat"].mean(), _boundary_gdf["lon"].mean()],
+                   zoom_start=12, tiles="CartoDB Positron")
+    folium.GeoJson(boundary_layer_json(_boundary_gdf), name="Lisbon Boundary",
+                   style_function=lambda x: {"fillColor": "orange", "fillOpacity": 0.05}).add_to(m)
+    if len(df) > 0:
+        HeatPyramidLayer(get_heat_pyramid(df, "accidents", cache_key if cache_key is not None else frame_key(df)),
+                         name="Accidents").add_to(m)
+    Draw(draw_options={"polyline": False, "circle": False, "marker": False, "circlemarker": False,
+                       "polygon": True, "rectangle": True},
+         edit_options={"edit": False}).add_to(m)
+    return m
+
+
+def map_selection(state):
+    """
+    (bbox, polygon) of an `st_folium` result: the last drawn shape if there is one, else the
+    current viewport as bbox (min_lon, min_lat, max_lon, max_lat); (None, None) before the first render.
+    """
+    state = state or {}
+    drawing = state.get("last_active_drawing")
+    if drawing and drawing.get("geometry", {}).get("type") == "Polygon":
+        return None, shapely.geometry.shape(drawing["geometry"])
+    bounds = state.get("bounds") or {}
+    south_west, north_east = bounds.get("_southWest") or {}, bounds.get("_northEast") or {}
+    if south_west.get("lng") is None or north_east.get("lng") is None:
+        return None, None
+    return (south_west["lng"], south_west["lat"], north_east["lng"], north_east["lat"]), None
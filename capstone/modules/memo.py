@@ -0,0 +1,122 @@
+import hashlib
+import json
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU cache shared by all Streamlit sessions of the process.
+    Keeps hit/miss counters so cache efficiency can be inspected.
+
+    With `max_bytes`, entries are also evicted once their total size (measured with
+    `sizeof`) exceeds the ceiling; the most recent entry is always kept.
+    """
+
+    def __init__(self, maxsize=32, max_bytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        with self._lock:
+            self.nbytes += size - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._data.move_to_end(key)
+            while len(self._data) > 1 and (
+                len(self._data) > self.maxsize
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+            ):
+                old_key, _ = self._data.popitem(last=False)
+                self.nbytes -= self._sizes.pop(old_key)
+        return value
+
+    def get_or_create(self, key, factory):
+        """Return the cached value for `key`, building it with `factory()` on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.put(key, factory())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+
+_MISSING = object()
+
+
+def all_caches():
+    """Every LRUCache held at module level by the capstone modules, as {"module.NAME": cache}."""
+    caches = {}
+    for module_name, module in list(sys.modules.items()):
+        if module_name.startswith("modules."):
+            for attr, value in list(vars(module).items()):
+                if isinstance(value, LRUCache):
+                    caches[f"{module_name.removeprefix('modules.')}.{attr}"] = value
+    return caches
+
+
+# Row hash of each live versioned frame: {id(df): (weakref to df, its index, key)}
+_FRAME_KEYS = {}
+
+
+def frame_key(df):
+    """
+    Stable cache key for a (possibly filtered) accident frame.
+
+    Frames coming from the accident store carry their dataset version in `attrs`, so the key
+    only needs the row labels and columns; the row hash is computed once per frame object
+    (and index). Other frames are keyed by a hash of their content.
+    """
+    columns = tuple(df.columns)
+    version = df.attrs.get("dataset_version")
+    if version is None:
+        content = pd.util.hash_pandas_object(df, index=True).to_numpy()
+        return ("content", columns, hashlib.sha1(content.tobytes()).hexdigest())
+
+    cached = _FRAME_KEYS.get(id(df))
+    if (cached is not None and cached[0]() is df and cached[1] is df.index
+            and cached[2][:3] == (version, columns, len(df))):
+        return cached[2]
+
+    rows = hashlib.sha1(df.index.to_numpy().tobytes()).hexdigest()
+    key = (version, columns, len(df), rows)
+    frame_id = id(df)
+    _FRAME_KEYS[frame_id] = (weakref.ref(df, lambda _: _FRAME_KEYS.pop(frame_id, None)), df.index, key)
+    return key
+
+
+def stable_hash(obj):
+    """Hash of a JSON-like object (e.g. a filter spec) that is identical across processes."""
+    payload = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
@@ -0,0 +1,164 @@
+"""
+Statistics quoted in the dashboard narrative, derived once per dataset version.
+
+Every number of the page text (overview totals, monthly extremes, weekday and hourly peaks,
+busiest dates) is sliced from the aggregation cube (modules.cube) and stored as a small JSON
+artifact in `cache_dir`, so a rerun reads a dict instead of scanning the frame.
+"""
+import os
+import json
+
+import pandas as pd
+
+from modules.accident_store import CACHE_DIR, _atomic_write_json
+from modules.cube import breakdown_table, get_cube
+from modules.memo import LRUCache
+
+# Bump when the content of the artifact changes, so stale files are not read
+NARRATIVE_FORMAT = 2
+PEAK_WINDOW_HOURS = 4
+
+# Narrative statistics per (dataset version, rows)
+_NARRATIVE_CACHE = LRUCache(maxsize=8)
+
+
+def _label(value):
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d")
+    return value.item() if hasattr(value, "item") else value
+
+
+def _ranked(values, n=None, ascending=False):
+    """[[label, value], ...] of a breakdown column, largest (or smallest) first; ties keep their order."""
+    ranked = values.sort_values(ascending=ascending, kind="stable")
+    if n is not None:
+        ranked = ranked.head(n)
+    return [[_label(label), int(value)] for label, value in ranked.items()]
+
+
+def _where(values, value):
+    return [_label(label) for label in values.index[values == value]]
+
+
+def _hour_peaks(counts, window=PEAK_WINDOW_HOURS):
+    """Busiest block of `window` consecutive hours, and the other local maxima by size."""
+    counts = counts.reindex(range(24), fill_value=0)
+    sums = counts.rolling(window).sum().shift(-(window - 1)).dropna()
+    start = int(sums.idxmax())
+    hours = counts.to_numpy()
+    local = [hour for hour in range(24)
+             if hours[hour] > hours[hour - 1] and hours[hour] > hours[(hour + 1) % 24]
+             and not start <= hour < start + window]
+    return {
+        "busiest_window": [start, start + window - 1, int(sums.max())],
+        "other_peaks": _ranked(counts[local]),
+        "quietest": _ranked(counts, 1, ascending=True)[0],
+    }
+
+
+def compute_narrative(df):
+    """
+    Narrative statistics of an enriched accident frame (stats.load_data) as a JSON-able dict.
+    Rankings are [[label, value], ...] lists.
+    """
+    cube = get_cube(df)
+    totals = cube["cells"][["count", "minor_injuries_30d", "serious_injuries_30d", "fatalities_30d"]].sum()
+    month, weekday = breakdown_table(cube, "month"), breakdown_table(cube, "weekday")
+    hour, day, date = breakdown_table(cube, "hour"), breakdown_table(cube, "day"), breakdown_table(cube, "date")
+
+    # Accidents per calendar day of each month, over every year the month appears in
+    months = pd.Series(cube["cells"]["date"].dropna().dt.to_period("M").unique())
+    calendar_days = months.dt.days_in_month.groupby(months.dt.strftime("%b").to_numpy()).sum()
+    per_day = (month["count"] / calendar_days.reindex(month.index.astype(str)).to_numpy()).dropna()
+
+    fatal_month = month["fatalities_30d"]
+    busiest, most_victims = date["count"].idxmax(), date["total_victims"].idxmax()
+    return {
+        "overview": {
+            "accidents": int(totals["count"]),
+            "fatalities": int(totals["fatalities_30d"]),
+            "serious_injuries": int(totals["serious_injuries_30d"]),
+            "minor_injuries": int(totals["minor_injuries_30d"]),
+            "years": sorted(int(year) for year in cube["cells"]["date"].dt.year.dropna().unique()),
+        },
+        "month": {
+            "highest": _ranked(month["count"], 3),
+            "lowest": _ranked(month["count"], 3, ascending=True),
+            "per_day": {_label(label): round(float(value), 2) for label, value in per_day.items()},
+            "serious_highest": _ranked(month["serious_injuries_30d"], 1)[0],
+            "serious_lowest": _ranked(month["serious_injuries_30d"], 1, ascending=True)[0],
+            "fatal_highest": _ranked(fatal_month, 1)[0],
+            "fatal_zero": _where(fatal_month, 0),
+            "fatal_other_values": sorted({int(v) for v in fatal_month if 0 < v < fatal_month.max()}),
+        },
+        "weekday": {
+            "highest": _ranked(weekday["count"], 2),
+            "lowest": _ranked(weekday["count"], 2, ascending=True),
+            "serious_highest": _ranked(weekday["serious_injuries_30d"], 1)[0],
+            "fatal_highest": _where(weekday["fatalities_30d"], weekday["fatalities_30d"].max()),
+            "fatal_zero": _where(weekday["fatalities_30d"], 0),
+        },
+        "hour": _hour_peaks(hour["count"]),
+        "day": {
+            "highest": _ranked(day["count"], 3),
+            "lowest": _ranked(day["count"], 1, ascending=True)[0],
+        },
+        "date": {
+            "busiest": [_label(busiest), int(date.at[busiest, "count"]),
+                        int(date.at[busiest, "minor_injuries_30d"])],
+            "most_victims": [_label(most_victims), int(date.at[most_victims, "total_victims"])],
+        },
+    }
+
+
+def narrative_stats(df, cache_dir=CACHE_DIR):
+    """
+    `compute_narrative` of `df`, computed once per dataset version and row count.
+
+    Frames with a `dataset_version` attr have the statistics stored as JSON in `cache_dir`
+    (the same artifact serves every process); other frames are computed directly.
+    """
+    version = df.attrs.get("dataset_version")
+    if version is None:
+        return compute_narrative(df)
+
+    key = f"{version}_{len(df)}_v{NARRATIVE_FORMAT}"
+
+    def load():
+        path = os.path.join(cache_dir, f"narrative_{key}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        stats = compute_narrative(df)
+        os.makedirs(cache_dir, exist_ok=True)
+        _atomic_write_json(path, stats)
+        return stats
+
+    return _NARRATIVE_CACHE.get_or_create(key, load)
+
+
+# ---- Formatting helpers for the page text ----
+
+def month_name(label):
+    """Full month name of a MONTH_ORDER label ("Feb" -> "February")."""
+    return pd.Timestamp(f"1 {label} 2000").strftime("%B")
+
+
+def ordinal(day):
+    suffix = "th" if 11 <= day % 100 <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
+    return f"{day}{suffix}"
+
+
+def date_name(iso_date, year=False):
+    """ "2023-03-21" -> "March 21st" (with `year`: "March 21st, 2023") """
+    date = pd.Timestamp(iso_date)
+    name = f"{date.strftime('%B')} {ordinal(date.day)}"
+    return f"{name}, {date.year}" if year else name
+
+
+def join_words(words, conjunction="and"):
+    """["a", "b", "c"] -> "a, b, and c" """
+    words = [str(word) for word in words]
+    if len(words) <= 2:
+        return f" {conjunction} ".join(words)
+    return ", ".join(words[:-1]) + f", {conjunction} " + words[-1]
@@ -1,27 +1,21 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 
+from modules.stats import load_data
+from modules.cube import get_cube, breakdown_table
+
 def accident_plot_controls(df):
     """Display selectors and return the user choices."""
 
-    # ---- Fix ordering for month and weekday ----
-    MONTH_ORDER = ["Jan","Feb","Mar","Apr","May","Jun",
-                   "Jul","Aug","Sep","Oct","Nov","Dec"]
-
-    WEEKDAY_ORDER = ["Monday","Tuesday","Wednesday","Thursday","Friday","Saturday","Sunday"]
-
-    if "month" in df.columns:
-        df["month"] = pd.Categorical(df["month"], categories=MONTH_ORDER, ordered=True)
-
-    if "weekday" in df.columns:
-        df["weekday"] = pd.Categorical(df["weekday"], categories=WEEKDAY_ORDER, ordered=True)
+    # ---- Ordered categoricals and total_victims come from stats.load_data ----
+    # The frame may be shared through the accident store, so it is never modified in place
+    if "total_victims" not in df.columns:
+        df = load_data(df)
 
     # ---- Breakdown options ----
     breakdown_options = ["month","weekday", "hour", "day","date"]
 
     # ---- Metric options ----
-    df["total_victims"] = df["minor_injuries_30d"] + df["serious_injuries_30d"] + df["fatalities_30d"]
     metric_options = {
         "Number of accidents": None,
         "Minor injuries": "minor_injuries_30d",
@@ -59,36 +53,39 @@ def accident_plot_controls(df):
 
 # 2️⃣ Plotting function
 # ---------------------
-def accident_plot(df, breakdown, metric_labels, metrics, plot_type, key=None):
-    """Generate the plot based on the selected parameters."""
+def aggregate_metrics(df, breakdown, metric_labels, metrics):
+    """Long-format table (breakdown, metric, value) of the selected metrics, sliced from the cube."""
+    # Every breakdown/metric pair is a slice of the pre-aggregated cube
+    table = breakdown_table(get_cube(df), breakdown)
+    columns = ["count" if metric is None else metric for metric in metrics]
+    return (
+        table[columns]
+        .set_axis(metric_labels, axis=1)
+        .reset_index()
+        .melt(id_vars=breakdown, var_name="metric", value_name="value")
+        .sort_values(breakdown, kind="stable")
+    )
+
+
+def accident_figure(df, breakdown, metric_labels, metrics, plot_type):
+    """
+    Build the plotly figure for the selected parameters, without any Streamlit call
+    (so it can run in a worker thread or a batch job). Raises ValueError for invalid selections.
+    """
 
     # ---------------------
     # Validation
     # ---------------------
     if plot_type == "Pie" and len(metrics) != 1:
-        st.warning("⚠️ Pie charts require exactly **1 metric**.")
-        return
+        raise ValueError("⚠️ Pie charts require exactly **1 metric**.")
 
     if len(metrics) == 0:
-        st.warning("⚠️ Please select at least one metric.")
-        return
+        raise ValueError("⚠️ Please select at least one metric.")
 
     # ---------------------
     # Aggregation
     # ---------------------
-    aggregated = pd.DataFrame()
-
-    for label, metric in zip(metric_labels, metrics):
-        if metric is None:
-            grouped = df.groupby(breakdown, observed=True).size().reset_index(name="value")
-            metric = "Number of accidents"
-        else:
-            grouped = df.groupby(breakdown)[metric].sum().reset_index(name="value")
-
-        grouped["metric"] = label
-        aggregated = pd.concat([aggregated, grouped], ignore_index=True)
-
-    aggregated = aggregated.sort_values(breakdown)
+    aggregated = aggregate_metrics(df, breakdown, metric_labels, metrics)
 
     # ---------------------
     # Dynamic title
@@ -106,41 +103,57 @@ def accident_plot(df, breakdown, metric_labels, metrics, plot_type, key=None):
     # ---------------------
     # Plotting
     # ---------------------
-    try:
-        if plot_type == "Bar":
-            fig = px.bar(
-                aggregated,
-                x=breakdown,
-                y="value",
-                color="metric",
-                barmode="group",
-                text="value",
-                labels={breakdown: pretty_breakdown, "value": "Value"},
-                title=title
-            )
-            fig.update_traces(textposition="outside")
-
-        elif plot_type == "Line":
-            fig = px.line(
-                aggregated,
-                x=breakdown,
-                y="value",
-                color="metric",
-                markers=True,
-                labels={breakdown: pretty_breakdown, "value": "Value"},
-                title=title
-            )
-
-        elif plot_type == "Pie":
-            filtered = aggregated[aggregated["metric"] == metric_labels[0]]
-            fig = px.pie(
-                filtered,
-                names=breakdown,
-                values="value",
-                title=title
-            )
-        
-        st.plotly_chart(fig, width='stretch',key=key)
+    if plot_type == "Bar":
+        fig = px.bar(
+            aggregated,
+            x=breakdown,
+            y="value",
+            color="metric",
+            barmode="group",
+            text="value",
+            labels={breakdown: pretty_breakdown, "value": "Value"},
+            title=title
+        )
+        fig.update_traces(textposition="outside")
+
+    elif plot_type == "Line":
+        fig = px.line(
+            aggregated,
+            x=breakdown,
+            y="value",
+            color="metric",
+            markers=True,
+            labels={breakdown: pretty_breakdown, "value": "Value"},
+            title=title
+        )
+
+    elif plot_type == "Pie":
+        filtered = aggregated[aggregated["metric"] == metric_labels[0]]
+        fig = px.pie(
+            filtered,
+            names=breakdown,
+            values="value",
+            title=title
+        )
+
+    else:
+        raise ValueError(f"Unknown plot type: {plot_type}")
+    return fig
+
+
+def show_figure(fig, key=None):
+    """Display a figure built by `accident_figure`."""
+    st.plotly_chart(fig, width='stretch', key=key)
 
+
+def accident_plot(df, breakdown, metric_labels, metrics, plot_type, key=None):
+    """Generate the plot based on the selected parameters."""
+    try:
+        fig = accident_figure(df, breakdown, metric_labels, metrics, plot_type)
+    except ValueError as e:
+        st.warning(str(e))
+        return
     except Exception as e:
-        st.error(f"❌ An error occurred during plotting: {e}")
\ No newline at end of file
+        st.error(f"❌ An error occurred during plotting: {e}")
+        return
+    show_figure(fig, key)
@@ -0,0 +1,151 @@
+"""
+Spatio-temporal index for bounding-box / polygon + time-window + severity queries.
+
+Rows are partitioned by date and, within a date, sorted by their Z-order key on the tile grid
+of modules.tiles. Both are packed into one sorted uint64 key (day << 40 | morton key), so the
+rows of one tile on one day are a contiguous slice. A query first selects the matching days
+(date range, months, weekdays, days of month are evaluated on the few hundred partitions, not
+on the rows), covers the bbox with a handful of tiles, and finds every (day, tile) slice with
+one vectorized binary search. Only those candidates are checked against the exact bbox or
+polygon, the hour window and the injury ranges.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+
+from modules.memo import LRUCache, frame_key
+from modules.tiles import INDEX_ZOOM, lonlat_to_tile, morton_key
+
+# Predicates of a filter spec evaluated per date partition; the other ranges are checked per row
+PARTITION_COLUMNS = ["date", "month", "weekday", "day"]
+ROW_COLUMNS = ["hour", "minor_injuries_30d", "serious_injuries_30d", "fatalities_30d"]
+DAY_SHIFT = np.uint64(2 * INDEX_ZOOM)
+MAX_COVER_TILES = 8  # tiles per axis used to cover a query bbox
+
+_QUERY_INDEX_CACHE = LRUCache(maxsize=4)
+
+
+def build_query_index(df, index_zoom=INDEX_ZOOM):
+    """
+    Sort the rows by (date, Z-order key) and keep the columns needed to refine candidates.
+
+    Returns a dict with the sorted composite `keys`, the row positions in that `order`, the
+    distinct `dates` (one partition each; missing dates are partition 0) and sorted copies of
+    longitude, latitude and ROW_COLUMNS.
+    """
+    lon = df["longitude"].to_numpy(dtype=np.float64)
+    lat = df["latitude"].to_numpy(dtype=np.float64)
+    x, y = lonlat_to_tile(lon, lat, index_zoom)
+    limit = 2 ** index_zoom - 1
+    tile_keys = morton_key(np.clip(np.nan_to_num(x), 0, limit).astype(np.uint64),
+                           np.clip(np.nan_to_num(y), 0, limit).astype(np.uint64))
+
+    dates = pd.to_datetime(df["date"]).to_numpy()
+    valid = ~pd.isna(dates)
+    partition_dates = np.unique(dates[valid])
+    partition = np.zeros(len(df), dtype=np.uint64)
+    partition[valid] = np.searchsorted(partition_dates, dates[valid]).astype(np.uint64) + np.uint64(1)
+
+    keys = (partition << DAY_SHIFT) | tile_keys
+    order = np.argsort(keys, kind="stable")
+    return {
+        "keys": keys[order],
+        "order": order,
+        "index_zoom": index_zoom,
+        "dates": pd.DatetimeIndex(partition_dates),
+        "longitude": lon[order],
+        "latitude": lat[order],
+        "columns": {column: df[column].to_numpy()[order] for column in ROW_COLUMNS if column in df.columns},
+    }
+
+
+def get_query_index(df):
+    """Query index of `df`, built once per dataset version (or row selection)."""
+    return _QUERY_INDEX_CACHE.get_or_create(frame_key(df), lambda: build_query_index(df))
+
+
+def _partitions(index, spec):
+    """Partition numbers matching the date-level predicates of `spec` (all, with missing dates, if none)."""
+    dates = index["dates"]
+    predicates = {column: spec[column] for column in PARTITION_COLUMNS if column in spec}
+    if not predicates:
+        return np.arange(len(dates) + 1, dtype=np.uint64)
+
+    keep = np.ones(len(dates), dtype=bool)
+    for column, predicate in predicates.items():
+        if column == "date":
+            keep &= (dates >= pd.Timestamp(predicate[0])) & (dates <= pd.Timestamp(predicate[1]))
+        elif column == "day":
+            keep &= (dates.day >= predicate[0]) & (dates.day <= predicate[1])
+        elif column == "month":
+            keep &= dates.strftime("%b").isin([str(value) for value in predicate])
+        else:
+            keep &= dates.day_name().isin([str(value) for value in predicate])
+    return np.flatnonzero(keep).astype(np.uint64) + np.uint64(1)
+
+
+def _tile_ranges(bbox, index_zoom):
+    """Sorted, merged [start, stop) Z-order key ranges of the tiles covering `bbox`."""
+    if bbox is None:
+        return np.array([0], dtype=np.uint64), np.array([1 << (2 * index_zoom)], dtype=np.uint64)
+
+    min_lon, min_lat, max_lon, max_lat = bbox
+    # Finest zoom at which the bbox spans at most MAX_COVER_TILES tiles per axis
+    for zoom in range(index_zoom, -1, -1):
+        (x0, x1), (y1, y0) = lonlat_to_tile([min_lon, max_lon], [min_lat, max_lat], zoom)
+        limit = 2 ** zoom - 1
+        x0, x1 = int(np.clip(x0, 0, limit)), int(np.clip(x1, 0, limit))
+        y0, y1 = int(np.clip(y0, 0, limit)), int(np.clip(y1, 0, limit))
+        if x1 - x0 < MAX_COVER_TILES and y1 - y0 < MAX_COVER_TILES:
+            break
+
+    tx, ty = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+    shift = np.uint64(2 * (index_zoom - zoom))
+    starts = np.sort(morton_key(tx.ravel().astype(np.uint64), ty.ravel().astype(np.uint64)) << shift)
+    stops = starts + (np.uint64(1) << shift)
+
+    # Tiles adjacent in Z-order become one range
+    new_run = np.concatenate([[True], starts[1:] != stops[:-1]])
+    run_end = np.concatenate([np.flatnonzero(new_run)[1:] - 1, [len(starts) - 1]])
+    return starts[new_run], stops[run_end]
+
+
+def query_rows(index, spec=None, bbox=None, polygon=None):
+    """
+    Row positions (ascending) of the accidents inside `bbox` (min_lon, min_lat, max_lon, max_lat)
+    or `polygon` (shapely, lon/lat) that match `spec`, a filter spec in the modules.filter_index
+    format. Date, month, weekday and day predicates select date partitions, so rows with a
+    missing date only match specs without them.
+    """
+    spec = spec or {}
+    if polygon is not None:
+        bbox = shapely.bounds(polygon) if bbox is None else bbox
+
+    partitions = _partitions(index, spec)
+    starts, stops = _tile_ranges(bbox, index["index_zoom"])
+    day_keys = partitions[:, None] << DAY_SHIFT
+    low = np.searchsorted(index["keys"], (day_keys + starts[None, :]).ravel())
+    high = np.searchsorted(index["keys"], (day_keys + stops[None, :]).ravel())
+
+    # Sorted positions of all (day, tile) slices
+    lengths = high - low
+    candidates = np.repeat(low - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    keep = np.ones(len(candidates), dtype=bool)
+    lon, lat = index["longitude"][candidates], index["latitude"][candidates]
+    if bbox is not None:
+        keep &= (lon >= bbox[0]) & (lon <= bbox[2]) & (lat >= bbox[1]) & (lat <= bbox[3])
+    for column, (low_value, high_value) in ((c, spec[c]) for c in ROW_COLUMNS if c in spec):
+        values = index["columns"][column][candidates]
+        keep &= (values >= low_value) & (values <= high_value)
+    if polygon is not None:
+        shapely.prepare(polygon)
+        inside = shapely.contains_xy(polygon, lon[keep], lat[keep])
+        keep[np.flatnonzero(keep)[~inside]] = False
+
+    return np.sort(index["order"][candidates[keep]])
+
+
+def query_frame(df, spec=None, bbox=None, polygon=None):
+    """Rows of `df` returned by `query_rows`, with one `take`."""
+    return df.take(query_rows(get_query_index(df), spec, bbox, polygon))
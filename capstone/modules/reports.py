@@ -0,0 +1,215 @@
+"""
+Headless report export for many filter scenarios.
+
+A scenario is a name and a filter spec (as built by the dashboard filters, see
+modules.filter_index). For every scenario the selected accidents are aggregated per breakdown
+(modules.cube) and written as CSV tables, plotly figures and the accident map as HTML.
+Scenarios run in a process pool; the dataset is loaded once and published as a host-wide Arrow
+file (modules.shared_store) that every worker memory-maps.
+
+Usage (from the capstone folder), e.g. one report per month and severity level:
+
+    python -m modules.reports --grid month severity --out reports --workers 4
+    python -m modules.reports --scenarios scenarios.json
+
+A scenarios file is a JSON list of {"name": ..., "filters": {column: [values] or [low, high]}};
+a null range bound stands for the column's minimum or maximum.
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+from modules.accident_store import load_enriched_data
+from modules.cube import BREAKDOWNS, breakdown_table, get_subset_cube
+from modules.filter_index import RANGE_COLUMNS, column_bounds, get_filter_index, select_rows, value_options
+from modules.ingest import has_store, load_store
+from modules.load_data import load_boundary
+from modules.map_utils import create_map, df_to_gdf
+from modules.plots import accident_figure
+from modules.shared_store import open_shared, publish_shared
+
+REPORT_DIR = "reports"
+REPORT_METRICS = {"Number of accidents": None, "Total number of victims": "total_victims"}
+
+# Severity levels of the --grid option, by the most severe injury of the accident
+SEVERITY_LEVELS = {
+    "fatal": {"fatalities_30d": (1, None)},
+    "serious": {"serious_injuries_30d": (1, None), "fatalities_30d": (0, 0)},
+    "minor": {"minor_injuries_30d": (1, None), "serious_injuries_30d": (0, 0), "fatalities_30d": (0, 0)},
+}
+
+# Dataset and boundary of a worker process, loaded once by `_init_worker`
+_WORKER = {}
+
+
+def resolve_filters(index, filters):
+    """
+    Filter spec for `filter_index.select_rows` from JSON-style filters: ranges become tuples,
+    and missing (None) range bounds are replaced by the column bounds.
+    """
+    spec = {}
+    for column, predicate in filters.items():
+        if column in RANGE_COLUMNS:
+            low, high = predicate
+            min_value, max_value = column_bounds(index, column)
+            spec[column] = (min_value if low is None else low, max_value if high is None else high)
+        else:
+            spec[column] = list(predicate)
+    return spec
+
+
+def scenario_grid(df, dimensions):
+    """
+    Scenarios for every combination of the values of `dimensions`: "month", "weekday", "hour",
+    "day" (one value each) and "severity" (SEVERITY_LEVELS).
+    """
+    index = get_filter_index(df)
+    levels = []
+    for dimension in dimensions:
+        if dimension == "severity":
+            levels.append([(name, filters) for name, filters in SEVERITY_LEVELS.items()])
+        elif dimension in index["values"]:
+            levels.append([(str(value), {dimension: [value]}) for value in value_options(index, dimension)])
+        elif dimension in ("hour", "day"):
+            low, high = column_bounds(index, dimension)
+            levels.append([(str(value), {dimension: (value, value)}) for value in range(int(low), int(high) + 1)])
+        else:
+            raise ValueError(f"Unknown grid dimension: {dimension}")
+
+    scenarios = []
+    for combination in itertools.product(*levels):
+        filters = {}
+        for _, level_filters in combination:
+            filters.update(level_filters)
+        name = "_".join(f"{dimension}-{label}" for dimension, (label, _) in zip(dimensions, combination))
+        scenarios.append({"name": name, "filters": filters})
+    return scenarios
+
+
+def _slug(name):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", name).strip("-") or "scenario"
+
+
+def scenario_report(df, boundary_gdf, scenario, out_dir, breakdowns=BREAKDOWNS, maps=True):
+    """
+    Write the report of one scenario to `out_dir/<name>/`: aggregates_<breakdown>.csv and
+    <breakdown>.html per breakdown, and map.html. Returns a summary row.
+    """
+    start = time.perf_counter()
+    index = get_filter_index(df)
+    positions = select_rows(index, resolve_filters(index, scenario["filters"]))
+    selected = df.take(positions)
+    path = os.path.join(out_dir, _slug(scenario["name"]))
+    os.makedirs(path, exist_ok=True)
+
+    if len(selected):
+        # Summed from the cube of the whole dataset; the figures below reuse it
+        cube = get_subset_cube(df, selected, positions)
+        for breakdown in breakdowns:
+            breakdown_table(cube, breakdown).to_csv(os.path.join(path, f"aggregates_{breakdown}.csv"))
+            fig = accident_figure(selected, breakdown, list(REPORT_METRICS), list(REPORT_METRICS.values()), "Bar")
+            fig.update_layout(title=f"{fig.layout.title.text} — {scenario['name']}")
+            fig.write_html(os.path.join(path, f"{breakdown}.html"), include_plotlyjs="cdn")
+    if maps:
+        with open(os.path.join(path, "map.html"), "w") as f:
+            f.write(create_map(df_to_gdf(selected), boundary_gdf))
+
+    return {
+        "scenario": scenario["name"],
+        "path": path,
+        "accidents": len(selected),
+        "minor_injuries": int(selected["minor_injuries_30d"].sum()),
+        "serious_injuries": int(selected["serious_injuries_30d"].sum()),
+        "fatalities": int(selected["fatalities_30d"].sum()),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def _init_worker(shared_file):
+    _WORKER["df"] = open_shared(shared_file)
+    # The parent has fetched the boundary, so the workers read the cached copy
+    _WORKER["boundary"], _ = load_boundary(offline=True, display=True)
+
+
+def _worker_report(scenario, out_dir, breakdowns, maps):
+    return scenario_report(_WORKER["df"], _WORKER["boundary"], scenario, out_dir, breakdowns, maps)
+
+
+def load_report_data(path=None):
+    """
+    The enriched CSV at `path`, or by default the dataset used by the dashboard: the
+    ingestion store if one was built, else the original CSV.
+    """
+    if path is not None:
+        return load_enriched_data(path)
+    return load_store() if has_store() else load_enriched_data()
+
+
+def run_reports(scenarios, out_dir=REPORT_DIR, df=None, breakdowns=BREAKDOWNS, maps=True,
+                workers=None, chunk_size=4):
+    """
+    Write the report of every scenario and a summary.csv in `out_dir`; returns the summary.
+
+    With `workers` > 1 the scenarios are split over a process pool whose workers map one
+    shared copy of the dataset; otherwise they run in this process.
+    """
+    df = load_report_data() if df is None else df
+    boundary_gdf, _ = load_boundary(display=True)
+    compute = partial(_worker_report, out_dir=out_dir, breakdowns=tuple(breakdowns), maps=maps)
+
+    if workers is None:
+        workers = min(os.cpu_count() or 1, max(len(scenarios) // chunk_size, 1))
+    if workers > 1 and len(scenarios) > 1:
+        # One file per run: concurrent runs never remove a file whose workers have not opened it yet
+        shared_file = publish_shared(df, f"reports_{uuid.uuid4().hex[:12]}")
+        try:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(shared_file,)) as pool:
+                rows = list(pool.map(compute, scenarios, chunksize=chunk_size))
+        finally:
+            os.remove(shared_file)
+    else:
+        _WORKER["df"], _WORKER["boundary"] = df, boundary_gdf
+        rows = [compute(scenario) for scenario in scenarios]
+
+    summary = pd.DataFrame(rows)
+    os.makedirs(out_dir, exist_ok=True)
+    summary.to_csv(os.path.join(out_dir, "summary.csv"), index=False)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export accident reports for many filter scenarios.")
+    parser.add_argument("--scenarios", help="JSON file with a list of {name, filters}")
+    parser.add_argument("--grid", nargs="+", help="one scenario per combination of: month weekday hour day severity")
+    parser.add_argument("--data", default=None,
+                        help="accident CSV (default: the ingestion store if built, else the Lisbon CSV)")
+    parser.add_argument("--breakdowns", nargs="+", default=BREAKDOWNS, choices=BREAKDOWNS)
+    parser.add_argument("--no-maps", action="store_true", help="skip the map HTML")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default=REPORT_DIR)
+    args = parser.parse_args()
+
+    df = load_report_data(args.data)
+    if args.scenarios:
+        with open(args.scenarios) as f:
+            scenarios = json.load(f)
+    elif args.grid:
+        scenarios = scenario_grid(df, args.grid)
+    else:
+        parser.error("pass --scenarios or --grid")
+
+    start = time.perf_counter()
+    summary = run_reports(scenarios, args.out, df, args.breakdowns, not args.no_maps, args.workers)
+    print(f"{len(summary)} reports written to {args.out} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
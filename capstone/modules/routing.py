@@ -0,0 +1,334 @@
+"""
+Street-network routing without per-query NetworkX overhead.
+
+The OSMnx graph is downloaded once and stored in `cache_dir` as compact CSR arrays (.npz) plus a
+GeoParquet of the edge geometries. Nearest-node snapping uses a uniform grid over the projected
+node coordinates, and shortest paths run on the CSR arrays: with SciPy installed its C Dijkstra
+is used, otherwise a heap-based Dijkstra over the same arrays. One Dijkstra pass per origin
+answers the queries to every destination at once.
+"""
+import argparse
+import heapq
+import os
+import re
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely import MultiLineString
+from shapely.ops import linemerge
+
+from modules.hotspots import build_grid, project_lonlat, _runs
+from modules.load_data import is_offline
+
+NETWORK_CACHE_DIR = "cache"
+NODE_CELL_SIZE = 100  # metres, grid cell size for nearest-node snapping
+SOURCE_BATCH = 64  # origins per Dijkstra batch, bounds the (origins x nodes) distance matrix
+EDGE_COLUMNS = ["u", "v", "key", "length", "name", "highway", "geometry"]
+
+# Networks already loaded by this process, keyed by (city, network_type, cache_dir)
+_NETWORK_CACHE = {}
+
+
+def _network_paths(city, network_type, cache_dir):
+    slug = re.sub(r"[^a-z0-9]+", "_", city.lower()).strip("_")
+    base = os.path.join(cache_dir, f"network_{slug}_{network_type}")
+    return f"{base}.npz", f"{base}_edges.parquet"
+
+
+def graph_source(city, network_type):
+    """Default network source: download the graph with OSMnx (needs network access)."""
+    import osmnx as ox
+    return ox.graph_from_place(city, network_type=network_type)
+
+
+def graph_to_arrays(G):
+    """
+    Convert an OSMnx MultiDiGraph to (network arrays, edges GeoDataFrame).
+
+    Parallel edges are reduced to the shortest one, so every (u, v) appears once in the CSR
+    arrays; `edge` maps each CSR entry to its row in the edges frame.
+    """
+    import osmnx as ox
+    nodes, edges = ox.graph_to_gdfs(G)
+    edges = edges.reset_index()
+    for column in ("name", "highway"):
+        # OSMnx keeps lists where simplified edges merged several ways
+        if column in edges.columns:
+            edges[column] = edges[column].map(lambda v: ", ".join(map(str, v)) if isinstance(v, list) else v)
+        else:
+            edges[column] = None
+    edges = edges[EDGE_COLUMNS].to_crs(epsg=4326)
+
+    node_id = nodes.index.to_numpy(np.int64)
+    order = np.argsort(node_id)
+    u = order[np.searchsorted(node_id, edges["u"].to_numpy(np.int64), sorter=order)]
+    v = order[np.searchsorted(node_id, edges["v"].to_numpy(np.int64), sorter=order)]
+
+    # Keep the shortest of parallel edges, then sort by source node for the CSR layout
+    length = edges["length"].to_numpy(np.float64)
+    best = np.lexsort((length, v, u))
+    first = np.r_[True, (np.diff(u[best]) != 0) | (np.diff(v[best]) != 0)]
+    kept = best[first]
+
+    network = {
+        "node_id": node_id,
+        "lon": nodes["x"].to_numpy(np.float64),
+        "lat": nodes["y"].to_numpy(np.float64),
+        "indptr": np.r_[0, np.cumsum(np.bincount(u[kept], minlength=len(node_id)))].astype(np.int64),
+        "indices": v[kept].astype(np.int32),
+        "length": length[kept],
+        "edge": kept.astype(np.int64),
+    }
+    return network, edges
+
+
+def fetch_network(city="Lisbon, Portugal", network_type="walk", cache_dir=NETWORK_CACHE_DIR,
+                  offline=None, source=None, refresh=False):
+    """
+    Return the (network arrays, edges GeoDataFrame) of a city street network.
+
+    Both are read from `cache_dir` when present. Otherwise the graph is built by `source`
+    (a callable taking the city and network type; defaults to OSMnx) and written to the cache.
+    In offline mode the source is never called and a missing cache raises FileNotFoundError.
+    """
+    if offline is None:
+        offline = is_offline()
+    arrays_path, edges_path = _network_paths(city, network_type, cache_dir)
+
+    if not refresh and os.path.exists(arrays_path) and os.path.exists(edges_path):
+        with np.load(arrays_path) as arrays:
+            network = dict(arrays)
+        return network, gpd.read_parquet(edges_path)
+
+    if offline:
+        raise FileNotFoundError(
+            f"No cached '{network_type}' network for '{city}' in '{cache_dir}' and offline mode is enabled"
+        )
+
+    network, edges = graph_to_arrays((source or graph_source)(city, network_type))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{edges_path}.{os.getpid()}.tmp"
+    edges.to_parquet(tmp_path)
+    os.replace(tmp_path, edges_path)
+    tmp_path = f"{arrays_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **network)
+    os.replace(tmp_path, arrays_path)
+    return network, edges
+
+
+def load_network(city="Lisbon, Portugal", network_type="walk", cache_dir=NETWORK_CACHE_DIR,
+                 offline=None, source=None):
+    """
+    Return the network arrays and edges of a city, kept in memory for the lifetime of the process.
+    The arrays also carry the projected node coordinates and the grid used for snapping.
+    """
+    key = (city, network_type, cache_dir)
+    if key not in _NETWORK_CACHE:
+        network, edges = fetch_network(city, network_type, cache_dir, offline=offline, source=source)
+        network["x"], network["y"] = project_lonlat(network["lon"], network["lat"])
+        network["grid"] = build_grid(network["x"], network["y"], NODE_CELL_SIZE)
+        _NETWORK_CACHE[key] = (network, edges)
+    return _NETWORK_CACHE[key]
+
+
+# ---- Nearest node ----
+
+def nearest_nodes(network, lon, lat):
+    """
+    Positions of the nodes nearest to each (lon, lat), and their distances in metres.
+
+    The grid is searched in growing square rings around each query's cell; a query is settled
+    once its best distance is within the ring radius, since every unvisited node is farther.
+    Queries with missing (non-finite) coordinates get node -1 at distance inf.
+    """
+    qx, qy = project_lonlat(np.atleast_1d(lon), np.atleast_1d(lat))
+    finite = np.isfinite(qx) & np.isfinite(qy)
+    qx, qy = np.where(finite, qx, 0.0), np.where(finite, qy, 0.0)
+    grid = network["grid"]
+    xs, ys = network["x"][grid["order"]], network["y"][grid["order"]]
+    cell_size, stride = grid["cell_size"], grid["stride"]
+    max_cx, max_cy = grid["max_cell"]
+    qcx = np.floor((qx - grid["origin"][0]) / cell_size).astype(np.int64) + 1
+    qcy = np.floor((qy - grid["origin"][1]) / cell_size).astype(np.int64) + 1
+
+    best = np.full(len(qx), np.inf)
+    best_node = np.full(len(qx), -1, dtype=np.int64)
+    pending = np.flatnonzero(finite)
+    ring = 0
+    while len(pending):
+        span = np.arange(-ring, ring + 1)
+        dx, dy = np.meshgrid(span, span)
+        on_ring = np.maximum(abs(dx), abs(dy)) == ring
+        dx, dy = dx[on_ring], dy[on_ring]
+
+        query = np.repeat(pending, len(dx))
+        cx, cy = qcx[query] + np.tile(dx, len(pending)), qcy[query] + np.tile(dy, len(pending))
+        inside = (cx >= 1) & (cx <= max_cx) & (cy >= 1) & (cy <= max_cy)
+        query, keys = query[inside], cx[inside] * stride + cy[inside]
+        cell = np.minimum(np.searchsorted(grid["cell_keys"], keys), len(grid["cell_keys"]) - 1)
+        found = grid["cell_keys"][cell] == keys
+        query, cell = query[found], cell[found]
+
+        count = grid["cell_count"][cell]
+        candidate = _runs(grid["cell_start"][cell], count)
+        query = np.repeat(query, count)
+        distance = np.hypot(xs[candidate] - qx[query], ys[candidate] - qy[query])
+        # Best candidate per query in this ring
+        order = np.lexsort((distance, query))
+        first = order[np.r_[True, np.diff(query[order]) != 0]] if len(order) else order
+        improved = distance[first] < best[query[first]]
+        best[query[first][improved]] = distance[first][improved]
+        best_node[query[first][improved]] = grid["order"][candidate[first][improved]]
+
+        # Settled: nothing outside this ring can be closer; or the ring already covers the whole grid
+        covers_all = ((qcx[pending] - ring <= 1) & (qcx[pending] + ring >= max_cx)
+                      & (qcy[pending] - ring <= 1) & (qcy[pending] + ring >= max_cy))
+        pending = pending[(best[pending] > ring * cell_size) & ~covers_all]
+        ring += 1
+    return best_node, best
+
+
+# ---- Shortest paths ----
+
+def _csgraph():
+    # SciPy is optional: its compiled Dijkstra is used when installed
+    try:
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import dijkstra
+    except ImportError:
+        return None
+    return csr_matrix, dijkstra
+
+
+def _heap_dijkstra(indptr, indices, cost, source, limit):
+    # Plain-Python Dijkstra over CSR lists (fallback without SciPy)
+    dist = {source: 0.0}
+    pred = {source: -1}
+    done = set()
+    heap = [(0.0, source)]
+    while heap:
+        d, node = heapq.heappop(heap)
+        if node in done:
+            continue
+        done.add(node)
+        for i in range(indptr[node], indptr[node + 1]):
+            target, nd = indices[i], d + cost[i]
+            if nd <= limit and nd < dist.get(target, np.inf):
+                dist[target] = nd
+                pred[target] = node
+                heapq.heappush(heap, (nd, target))
+    return dist, pred
+
+
+def shortest_path_tree(network, sources, cost=None, limit=np.inf):
+    """
+    Single-source shortest paths from every node position in `sources`.
+
+    `cost` is the per-edge weight aligned with the CSR arrays (defaults to the length in metres).
+    Returns (distances, predecessors), each of shape (len(sources), number of nodes);
+    unreachable nodes (or farther than `limit`) have distance inf and predecessor -1.
+    """
+    sources = np.atleast_1d(sources)
+    cost = network["length"] if cost is None else cost
+    n = len(network["node_id"])
+
+    csgraph = _csgraph()
+    if csgraph is not None:
+        csr_matrix, dijkstra = csgraph
+        matrix = csr_matrix((cost, network["indices"], network["indptr"]), shape=(n, n))
+        dist, pred = dijkstra(matrix, indices=sources, return_predecessors=True, limit=limit)
+        pred[pred < 0] = -1
+        return dist, pred.astype(np.int64)
+
+    indptr, indices, cost_list = network["indptr"].tolist(), network["indices"].tolist(), cost.tolist()
+    dist = np.full((len(sources), n), np.inf)
+    pred = np.full((len(sources), n), -1, dtype=np.int64)
+    for row, source in enumerate(sources.tolist()):
+        d, p = _heap_dijkstra(indptr, indices, cost_list, source, limit)
+        dist[row, list(d)] = list(d.values())
+        pred[row, list(p)] = list(p.values())
+    return dist, pred
+
+
+def route_matrix(network, origins, destinations, cost=None):
+    """
+    Many-to-many shortest path costs between node positions: a (len(origins), len(destinations))
+    array. One Dijkstra pass per distinct origin, in batches of SOURCE_BATCH origins.
+    """
+    origins, destinations = np.atleast_1d(origins), np.atleast_1d(destinations)
+    unique_origins, inverse = np.unique(origins, return_inverse=True)
+    matrix = np.empty((len(unique_origins), len(destinations)))
+    for start in range(0, len(unique_origins), SOURCE_BATCH):
+        batch = unique_origins[start:start + SOURCE_BATCH]
+        dist, _ = shortest_path_tree(network, batch, cost)
+        matrix[start:start + len(batch)] = dist[:, destinations]
+    return matrix[inverse]
+
+
+def path_from_tree(pred_row, source, target):
+    """Node positions from `source` to `target` along a predecessor row (empty when unreachable)."""
+    path = [target]
+    while path[-1] != source:
+        if pred_row[path[-1]] < 0:
+            return []
+        path.append(pred_row[path[-1]])
+    return path[::-1]
+
+
+def path_edges(network, path):
+    """Rows in the edges frame of the consecutive node pairs of a path."""
+    rows = []
+    for a, b in zip(path[:-1], path[1:]):
+        start, end = network["indptr"][a], network["indptr"][a + 1]
+        rows.append(network["edge"][start + np.flatnonzero(network["indices"][start:end] == b)[0]])
+    return rows
+
+
+def shortest_routes(network, edges, origins, destinations, cost=None):
+    """
+    Shortest route for each (origin, destination) pair of node positions, as a GeoDataFrame
+    with the route length (metres), its cost and the merged edge geometry.
+    """
+    origins, destinations = np.atleast_1d(origins), np.atleast_1d(destinations)
+    records = []
+    for start in range(0, len(origins), SOURCE_BATCH):
+        batch = slice(start, start + SOURCE_BATCH)
+        sources, inverse = np.unique(origins[batch], return_inverse=True)
+        dist, pred = shortest_path_tree(network, sources, cost)
+        for row, origin, destination in zip(inverse, origins[batch], destinations[batch]):
+            path = path_from_tree(pred[row], origin, destination)
+            rows = path_edges(network, path)
+            records.append({
+                "origin": network["node_id"][origin],
+                "destination": network["node_id"][destination],
+                "length": float(edges["length"].to_numpy()[rows].sum()) if path else np.inf,
+                "cost": float(dist[row, destination]),
+                "geometry": linemerge(MultiLineString(list(edges.geometry.iloc[rows]))) if rows else None,
+            })
+    return gpd.GeoDataFrame(pd.DataFrame(records), geometry="geometry", crs="EPSG:4326")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and cache a street network, optionally route on it.")
+    parser.add_argument("--city", default="Lisbon, Portugal")
+    parser.add_argument("--network-type", default="walk")
+    parser.add_argument("--cache-dir", default=NETWORK_CACHE_DIR)
+    parser.add_argument("--refresh", action="store_true", help="download again even if cached")
+    parser.add_argument("--route", nargs=4, type=float, metavar=("LAT1", "LON1", "LAT2", "LON2"),
+                        help="print the shortest route length between two points")
+    args = parser.parse_args()
+
+    if args.refresh:
+        fetch_network(args.city, args.network_type, args.cache_dir, refresh=True)
+    network, edges = load_network(args.city, args.network_type, args.cache_dir)
+    print(f"{args.city} ({args.network_type}): {len(network['node_id'])} nodes, {len(edges)} edges")
+
+    if args.route:
+        lat1, lon1, lat2, lon2 = args.route
+        nodes, _ = nearest_nodes(network, [lon1, lon2], [lat1, lat2])
+        print(f"Route length: {route_matrix(network, nodes[:1], nodes[1:])[0, 0]:.1f} meters")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Bump when the schema or the enrichment in stats.load_data changes, to invalidate cached data
+SCHEMA_VERSION = 2
+
+MONTH_ORDER = ["Jan","Feb","Mar","Apr","May","Jun",
+               "Jul","Aug","Sep","Oct","Nov","Dec"]
+WEEKDAY_ORDER = ["Monday","Tuesday","Wednesday","Thursday","Friday","Saturday","Sunday"]
+
+# Declared dtypes of the accident dataset. Narrow types are only applied when the values fit
+ACCIDENT_SCHEMA = {
+    "id": "uint32",
+    "year": "uint16",
+    "month": pd.CategoricalDtype(MONTH_ORDER, ordered=True),
+    "day": "uint8",
+    "hour": "uint8",
+    "weekday": pd.CategoricalDtype(WEEKDAY_ORDER, ordered=True),
+    "fatalities_30d": "uint16",
+    "serious_injuries_30d": "uint16",
+    "minor_injuries_30d": "uint16",
+    "total_victims": "uint16",
+    "latitude": "float32",
+    "longitude": "float32",
+    "municipality": "category",
+}
+
+# float32 keeps ~7 significant digits; coordinates are only narrowed if the error stays below ~1 m
+COORDINATE_TOLERANCE = 1e-5
+
+
+def _cast(series, dtype):
+    """Return `series` cast to `dtype`, or unchanged when the values do not fit the narrower type."""
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == "category":
+        return series.astype(dtype)
+
+    values = series.to_numpy()
+    if not np.issubdtype(values.dtype, np.number) or np.isnan(values.astype(np.float64)).any():
+        return series
+
+    target = np.dtype(dtype)
+    if np.issubdtype(target, np.integer):
+        info = np.iinfo(target)
+        if len(values) and (values.min() < info.min or values.max() > info.max
+                            or (values != np.round(values)).any()):
+            return series
+    elif np.abs(values.astype(target).astype(np.float64) - values).max(initial=0) > COORDINATE_TOLERANCE:
+        return series
+    return series.astype(target)
+
+
+def apply_schema(df, schema=ACCIDENT_SCHEMA):
+    """
+    Cast the columns of `df` to the declared schema.
+
+    Returns the compact frame and a report DataFrame with the memory of each column before
+    and after, and the bytes saved.
+    """
+    compact = df.copy(deep=False)
+    rows = []
+    for column, dtype in schema.items():
+        if column not in compact.columns:
+            continue
+        before = compact[column].memory_usage(index=False, deep=True)
+        compact[column] = _cast(compact[column], dtype)
+        after = compact[column].memory_usage(index=False, deep=True)
+        rows.append({"column": column, "dtype": str(compact[column].dtype),
+                     "bytes_before": before, "bytes_after": after, "bytes_saved": before - after})
+    report = pd.DataFrame(rows, columns=["column", "dtype", "bytes_before", "bytes_after", "bytes_saved"])
+    return compact, report
+
+
+def empty_frame(columns, schema=ACCIDENT_SCHEMA):
+    """Frame without rows whose `columns` have the declared dtypes ("date" as datetime, undeclared as object)."""
+    return pd.DataFrame({
+        column: pd.Series(dtype=schema.get(column, "datetime64[ns]" if column == "date" else object))
+        for column in columns
+    })
+
+
+def concat_frames(frames):
+    """Concatenate frames, merging the categories of categorical columns instead of falling back to object."""
+    frames = [f for f in frames if f is not None]
+    combined = pd.concat(frames, ignore_index=True)
+    for column in frames[0].columns:
+        dtypes = [f[column].dtype for f in frames]
+        if (all(isinstance(d, pd.CategoricalDtype) for d in dtypes)
+                and not isinstance(combined[column].dtype, pd.CategoricalDtype)):
+            combined[column] = union_categoricals([f[column] for f in frames], ignore_order=True)
+    return combined
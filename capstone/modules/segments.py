@@ -0,0 +1,127 @@
+"""
+Road-level accident risk: every accident is snapped to its nearest street segment.
+
+Segments are the edges of the cached street network (modules.routing) with both directions of a
+street merged. Snapping is one vectorized STRtree nearest query in EPSG:3763 metres, and the
+matches are kept per accident id in `cache_dir`, so new accidents are matched without
+re-snapping the history.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from modules.hotspots import PROJECTED_EPSG, project_coordinates
+from modules.memo import LRUCache
+from modules.stats import SEVERITY_WEIGHTS, accident_weights
+
+SEGMENT_CACHE_DIR = "cache"
+MAX_SNAP_METRES = 50  # accidents farther than this from any street stay unmatched
+
+# Segment table and STRtree per street network
+_SEGMENT_CACHE = LRUCache(maxsize=4)
+
+
+def network_version(edges):
+    """Version of a street network: a hash of its edge endpoints and lengths."""
+    sha = hashlib.sha1()
+    for column in ("u", "v", "length"):
+        sha.update(np.ascontiguousarray(edges[column].to_numpy()).tobytes())
+    return sha.hexdigest()[:16]
+
+
+def build_segments(edges):
+    """
+    Undirected street segments of an edges GeoDataFrame (modules.routing) and a spatial index.
+
+    The two directions of a street (u->v and v->u with the same length) become one segment.
+    Returns {"segments": GeoDataFrame in EPSG:4326, "tree": STRtree over the projected lines}.
+    """
+    u, v = edges["u"].to_numpy(np.int64), edges["v"].to_numpy(np.int64)
+    pair = pd.DataFrame({"a": np.minimum(u, v), "b": np.maximum(u, v),
+                         "length": edges["length"].round(1).to_numpy()})
+    first = ~pair.duplicated()
+    segments = edges.loc[first.to_numpy(), ["u", "v", "length", "name", "highway", "geometry"]]
+    segments = segments.reset_index(drop=True)
+    projected = segments.geometry.to_crs(epsg=PROJECTED_EPSG).to_numpy()
+    return {"segments": segments, "tree": shapely.STRtree(projected)}
+
+
+def get_segments(edges):
+    """Segments and STRtree of a network, built once per network version."""
+    return _SEGMENT_CACHE.get_or_create(network_version(edges), lambda: build_segments(edges))
+
+
+def snap_points(index, df, max_distance=MAX_SNAP_METRES):
+    """
+    Nearest segment (row of `index["segments"]`, -1 when none within `max_distance`) and the
+    distance in metres for every row of `df`, with a single STRtree query.
+    """
+    x, y = project_coordinates(df)
+    segment = np.full(len(df), -1, dtype=np.int64)
+    distance = np.full(len(df), np.nan)
+    if len(df) == 0:
+        return segment, distance
+    (point, tree_index), found = index["tree"].query_nearest(
+        shapely.points(x, y), max_distance=max_distance, return_distance=True, all_matches=False
+    )
+    segment[point] = tree_index
+    distance[point] = found
+    return segment, distance
+
+
+def _matches_path(edges, cache_dir):
+    return os.path.join(cache_dir, f"segment_matches_{network_version(edges)}.parquet")
+
+
+def snap_accidents(df, edges, cache_dir=SEGMENT_CACHE_DIR):
+    """
+    Segment matches (columns id, segment, distance) of the accidents in `df`.
+
+    Matches are stored per accident id next to the cache; only ids not matched before are
+    snapped, and the store is rewritten with the new matches appended.
+    """
+    path = _matches_path(edges, cache_dir)
+    stored = pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame(
+        {"id": pd.Series(dtype=df["id"].dtype), "segment": pd.Series(dtype=np.int64),
+         "distance": pd.Series(dtype=np.float64)}
+    )
+
+    new = df[~df["id"].isin(stored["id"])].drop_duplicates(subset="id")
+    if len(new):
+        segment, distance = snap_points(get_segments(edges), new)
+        stored = pd.concat([stored, pd.DataFrame({"id": new["id"].to_numpy(), "segment": segment,
+                                                  "distance": distance})], ignore_index=True)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        stored.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    return stored[stored["id"].isin(df["id"])]
+
+
+def segment_risk(df, edges, weights="severity", cache_dir=SEGMENT_CACHE_DIR):
+    """
+    Accidents, victims and a risk score per street segment, as a GeoDataFrame of the segments
+    with at least one accident in `df`, riskiest first. The score is the sum of the accident
+    weights of `weights` (a `stats.SEVERITY_WEIGHTS` name).
+    """
+    matches = snap_accidents(df, edges, cache_dir)
+    segment = df["id"].map(matches.set_index("id")["segment"]).fillna(-1).to_numpy(np.int64)
+    matched = segment >= 0
+
+    columns = ["minor_injuries_30d", "serious_injuries_30d", "fatalities_30d"]
+    stats = pd.DataFrame({column: df[column].to_numpy(np.float64)[matched] for column in columns})
+    stats["accidents"] = 1
+    stats["risk"] = accident_weights(df, SEVERITY_WEIGHTS[weights])[matched]
+    stats["segment"] = segment[matched]
+    totals = stats.groupby("segment").sum()
+
+    segments = get_segments(edges)["segments"]
+    risk = segments.iloc[totals.index].copy()
+    for column in totals.columns:
+        risk[column] = totals[column].to_numpy()
+    risk["accidents"] = risk["accidents"].astype(int)
+    return risk.sort_values("risk", ascending=False)
@@ -1,32 +1,40 @@
-import pandas as pd
 import streamlit as st
 
-def apply_severity_filters(df, container=st.sidebar, expanded=False):
+from modules.filter_index import get_filter_index, column_bounds, filter_frame
+
+def severity_filter_spec(df, container=st.sidebar, expanded=False):
     """
-    Apply severity filters (minor, serious, fatal) to a dataframe.
+    Render the severity filters (minor, serious, fatal) and return the selected predicates.
     Can render in sidebar, container, or column.
     """
-
-
-    df_filtered = df.copy()
+    index = get_filter_index(df)
+    spec = {}
     with st.expander("**Accident severity filters**",expanded=expanded):
         # ---- Minor injuries ----
-        df_filtered = add_injury_filter(df_filtered, column="minor_injuries_30d",
-                                        label="minor injuries", container=container)
+        add_injury_filter(spec, index, column="minor_injuries_30d",
+                          label="minor injuries", container=container)
         # ---- Serious injuries ----
-        df_filtered = add_injury_filter(df_filtered, column="serious_injuries_30d",
-                                        label="serious injuries", container=container)
+        add_injury_filter(spec, index, column="serious_injuries_30d",
+                          label="serious injuries", container=container)
         # ---- Fatalities ----
-        df_filtered = add_injury_filter(df_filtered, column="fatalities_30d",
-                                        label="fatalities", container=container)
+        add_injury_filter(spec, index, column="fatalities_30d",
+                          label="fatalities", container=container)
+
+    return spec
 
-    return df_filtered
+
+def apply_severity_filters(df, container=st.sidebar, expanded=False):
+    """
+    Apply severity filters (minor, serious, fatal) to a dataframe.
+    Can render in sidebar, container, or column.
+    """
+    return filter_frame(df, severity_filter_spec(df, container=container, expanded=expanded))
 
 
-def add_injury_filter(df: pd.DataFrame, column: str, label: str, container=None) -> pd.DataFrame:
+def add_injury_filter(spec: dict, index: dict, column: str, label: str, container=None) -> dict:
     """
     Adds a filter for injury counts using toggle, slider, and optional checkbox.
-    Works in any Streamlit container.
+    The selected range is stored in `spec`. Works in any Streamlit container.
     """
     if container is None:
         container = st.sidebar  # fallback
@@ -35,20 +43,19 @@ def add_injury_filter(df: pd.DataFrame, column: str, label: str, container=None)
         # Checkbox option: only 0 injuries
         only_zero = container.checkbox(f"Only accidents with 0 {label.lower()}")
         if only_zero:
-            return df[df[column] == 0]
+            spec[column] = (0, 0)
+            return spec
 
         # Otherwise: slider
-        min_val = int(df[column].min())
-        max_val = int(df[column].max())
-        value_range = container.slider(
+        min_val, max_val = (int(v) for v in column_bounds(index, column))
+        spec[column] = container.slider(
             f"Victims with {label}",
             min_value=min_val,
             max_value=max_val,
             value=(min_val, max_val)
         )
-        return df[df[column].between(*value_range)]
 
-    return df
+    return spec
 
 
 #Initial version
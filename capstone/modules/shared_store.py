@@ -0,0 +1,76 @@
+"""
+Host-wide, read-only copy of the enriched accident frame.
+
+The frame is written once as an uncompressed Arrow IPC file (in /dev/shm when available) and
+every process memory-maps it. Numeric columns then point straight into the shared pages,
+so N sessions or worker processes cost one copy of the data instead of N.
+"""
+import json
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+SHARED_DIR = os.environ.get(
+    "ACCIDENTS_SHARED_DIR",
+    "/dev/shm/accidents" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "accidents"),
+)
+
+ATTRS_KEY = b"accidents_attrs"
+
+
+def shared_path(name, shared_dir=SHARED_DIR):
+    return os.path.join(shared_dir, f"{name}.arrow")
+
+
+def publish_shared(df, name, shared_dir=SHARED_DIR, replaces=None):
+    """
+    Write `df` (and its attrs) as an Arrow IPC file, unless it already exists.
+
+    The file is renamed into place atomically, so concurrent publishers are safe. Published
+    files whose name starts with `replaces` (older versions of the same dataset) are removed;
+    processes that still map them keep working. Files still being written (`*.tmp`) are left
+    to their writer.
+    """
+    path = shared_path(name, shared_dir)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(shared_dir, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[ATTRS_KEY] = json.dumps(df.attrs, default=str).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+    if replaces is not None:
+        for file_name in os.listdir(shared_dir):
+            if (file_name.startswith(replaces) and file_name.endswith(".arrow")
+                    and file_name != os.path.basename(path)):
+                try:
+                    os.remove(os.path.join(shared_dir, file_name))
+                except FileNotFoundError:
+                    pass  # removed by another publisher in the meantime
+    return path
+
+
+def open_shared(path):
+    """
+    Memory-map a published frame read-only.
+
+    Numeric and datetime columns are zero-copy views of the mapped file (their arrays are not
+    writeable); only the small categorical codes are copied.
+    """
+    source = pa.memory_map(path, "r")
+    table = ipc.open_file(source).read_all()
+    df = table.to_pandas(split_blocks=True)
+    attrs = (table.schema.metadata or {}).get(ATTRS_KEY)
+    if attrs is not None:
+        df.attrs.update(json.loads(attrs))
+    return df
@@ -1,21 +1,25 @@
+import numpy as np
 import pandas as pd
 
-def load_data(df):
+from modules.schema import MONTH_ORDER, WEEKDAY_ORDER
+
+# Year of the original Lisbon extract, which has no year column
+DEFAULT_YEAR = 2023
+
+def load_data(df, year=None):
     clean_data = df.copy()
     
-    #Generate the date attribute
-    date_str = clean_data["day"].astype(str).str.zfill(2) + " " + clean_data["month"].astype(str) + " 2023"
-    clean_data["date"] = pd.to_datetime(date_str, errors="coerce")
-    clean_data["date_str"] = clean_data["date"].dt.strftime("%d %b %Y")
+    #Generate the date attribute (year column if present, otherwise `year`)
+    if "year" in clean_data.columns:
+        year_str = clean_data["year"].astype(str)
+    else:
+        year_str = str(DEFAULT_YEAR if year is None else year)
+    date_str = clean_data["day"].astype(str).str.zfill(2) + " " + clean_data["month"].astype(str) + " " + year_str
+    clean_data["date"] = pd.to_datetime(date_str, format="%d %b %Y", errors="coerce")
+    # The display string ("01 Jan 2023") is not stored; see date_strings()
 
     # Make temporal attributes ordered
     # ---- Fix ordering for month and weekday ----
-    MONTH_ORDER = ["Jan","Feb","Mar","Apr","May","Jun",
-                   "Jul","Aug","Sep","Oct","Nov","Dec"]
-
-    WEEKDAY_ORDER = ["Monday","Tuesday","Wednesday","Thursday","Friday","Saturday","Sunday"]
-
-
     if "month" in clean_data.columns:
         clean_data["month"] = pd.Categorical(clean_data["month"], categories=MONTH_ORDER, ordered=True)
 
@@ -28,6 +32,28 @@ def load_data(df):
     return clean_data
 
 
+def date_strings(df):
+    """Display dates ("01 Jan 2023"), computed on demand for the rows being shown."""
+    if "date_str" in df.columns:
+        return df["date_str"]
+    return pd.to_datetime(df["date"]).dt.strftime("%d %b %Y")
+
+
+# Weight of each accident in the heatmap and segment risk, per injury column (empty: every accident counts 1)
+SEVERITY_WEIGHTS = {
+    "accidents": {},
+    "victims": {"minor_injuries_30d": 1, "serious_injuries_30d": 1, "fatalities_30d": 1},
+    "severity": {"minor_injuries_30d": 1, "serious_injuries_30d": 5, "fatalities_30d": 20},
+}
+
+
+def accident_weights(df, weights):
+    """Weight per accident: the weighted sum of the injury columns, or 1 with no weights."""
+    if not weights:
+        return np.ones(len(df))
+    return sum(df[column].to_numpy(np.float64) * weight for column, weight in weights.items())
+
+
 def compute_overview(df):
     return {
         "Number accidents": len(df),
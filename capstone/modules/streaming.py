@@ -0,0 +1,115 @@
+"""
+Streaming access to accident CSVs that do not fit in memory.
+
+The file is read in chunks; each chunk is enriched, folded into running totals and dropped,
+so peak memory is set by `chunksize` rather than by the file size. Usage:
+
+    python -m modules.streaming data/national_accidents.csv --year 2023
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from modules.cube import DIMENSIONS, METRICS, breakdown_table
+from modules.filter_index import build_filter_index, filter_frame
+from modules.schema import ACCIDENT_SCHEMA, apply_schema, concat_frames, empty_frame
+from modules.stats import load_data
+
+CHUNK_SIZE = 200_000
+
+
+def iter_chunks(path, chunksize=CHUNK_SIZE, year=None, usecols=None):
+    """Yield (raw chunk, enriched chunk) pairs (none for an empty file)."""
+    try:
+        reader = pd.read_csv(path, chunksize=chunksize, usecols=usecols)
+    except pd.errors.EmptyDataError:
+        return
+    for chunk in reader:
+        yield chunk, load_data(chunk, year=year)
+
+
+def scan_accidents(path, chunksize=CHUNK_SIZE, year=None):
+    """
+    Compute in a single pass over the file:
+        overview: same keys as `stats.compute_overview`
+        inspection: same keys as `stats.dataset_inspection`
+        cube: aggregates for every breakdown (see modules.cube)
+
+    Duplicate rows are detected through 64-bit row hashes (8 bytes per row kept),
+    the cube holds one row per (date, hour) cell.
+    """
+    overview = {"Number accidents": 0, "Number fatalities": 0,
+                "Number serious injuries": 0, "Number minor injuries": 0}
+    n_columns, missing = 0, 0
+    row_hashes = []
+    cells = None
+
+    for raw, enriched in iter_chunks(path, chunksize, year):
+        overview["Number accidents"] += len(raw)
+        overview["Number fatalities"] += int(raw["fatalities_30d"].sum())
+        overview["Number serious injuries"] += int(raw["serious_injuries_30d"].sum())
+        overview["Number minor injuries"] += int(raw["minor_injuries_30d"].sum())
+
+        n_columns = raw.shape[1]
+        missing += int(raw.isnull().sum().sum())
+        row_hashes.append(pd.util.hash_pandas_object(raw, index=False).to_numpy())
+
+        chunk_cells = enriched.groupby(DIMENSIONS, observed=True, dropna=False)[METRICS[1:]].sum()
+        chunk_cells.insert(0, "count", enriched.groupby(DIMENSIONS, observed=True, dropna=False).size())
+        if cells is not None:
+            chunk_cells = pd.concat([cells, chunk_cells]).groupby(
+                level=DIMENSIONS, observed=True, dropna=False
+            ).sum()
+        cells = chunk_cells
+
+    hashes = np.concatenate(row_hashes) if row_hashes else np.array([], dtype=np.uint64)
+    inspection = {
+        "Columns": n_columns,
+        "Rows": overview["Number accidents"],
+        "Missing values": missing,
+        "Duplicate rows": int(len(hashes) - len(np.unique(hashes))),
+    }
+    if cells is None:
+        cells = pd.DataFrame(columns=DIMENSIONS + METRICS)
+    else:
+        cells = cells.reset_index()
+    cube = {"cells": cells, "row_cell": None, "tables": {}}
+    return {"overview": overview, "inspection": inspection, "cube": cube}
+
+
+def materialize(path, spec=None, columns=None, chunksize=CHUNK_SIZE, year=None):
+    """
+    Load only the rows matching a filter spec (see modules.filter_index) and only `columns`
+    of the enriched data; everything else is discarded chunk by chunk. Without matching rows
+    the frame is empty, with the declared schema dtypes.
+    """
+    parts = []
+    for _, enriched in iter_chunks(path, chunksize, year):
+        if spec:
+            enriched = filter_frame(enriched, spec, index=build_filter_index(enriched))
+        if columns is not None:
+            enriched = enriched[columns]
+        parts.append(apply_schema(enriched)[0])
+    if not any(len(part) for part in parts):
+        if columns is None:
+            columns = parts[0].columns if parts else list(ACCIDENT_SCHEMA) + ["date"]
+        return empty_frame(columns)
+    return concat_frames(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise an accident CSV in one streaming pass.")
+    parser.add_argument("path", help="accident CSV file")
+    parser.add_argument("--year", type=int, default=None, help="year of records without a year column")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    result = scan_accidents(args.path, args.chunksize, args.year)
+    for name, value in {**result["overview"], **result["inspection"]}.items():
+        print(f"{name}: {value}")
+    print(breakdown_table(result["cube"], "month").to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,83 @@
 import pandas as pd
 import streamlit as st
 
-def apply_temporal_filters(df, container=None, expanded=True):
+from modules.filter_index import get_filter_index, value_options, column_bounds, filter_frame
+
+def temporal_filter_spec(df, container=None, expanded=True):
     """
-    Apply temporal filters to a dataframe. Can render in sidebar or in any Streamlit container.
-    
+    Render the temporal filter widgets and return the selected predicates.
+
     Args:
-        df: DataFrame to filter
+        df: DataFrame the filters apply to (only its precomputed filter index is read)
         container: Streamlit container (st.sidebar, st.container, or a column)
-        default: default toggle value for enabling temporal filters
-    
+        expanded: whether the filters expander starts open
+
     Returns:
-        Filtered DataFrame
+        Filter spec for `filter_index.filter_frame` ({column: values or (low, high)})
     """
-    df_filtered = df.copy()
+    if container is None:
+        container = st.sidebar  # fallback
+
+    index = get_filter_index(df)
+    spec = {}
     with st.expander("**Temporal filters**",expanded=expanded):
 
         # ---- Filter by values ----
         if container.toggle("Filter by value", False):
-            weekday_options = df["weekday"].dropna().unique()
+            weekday_options = value_options(index, "weekday")
             selected_weekdays = container.multiselect(
                 "Filter by Weekday", weekday_options, default=weekday_options
             )
-            df_filtered = df_filtered[df_filtered["weekday"].isin(selected_weekdays)]
+            spec["weekday"] = selected_weekdays
 
-            month_options = df["month"].dropna().unique()
+            month_options = value_options(index, "month")
             selected_months = container.multiselect(
                 "Filter by Month", month_options, default=month_options
             )
-            df_filtered = df_filtered[df_filtered["month"].isin(selected_months)]
+            spec["month"] = selected_months
 
         # ---- Filter by ranges ----
         if container.toggle("Filter by range", False):
-            hour_range = container.slider(
+            hour_min, hour_max = (int(v) for v in column_bounds(index, "hour"))
+            spec["hour"] = container.slider(
                 "Filter by Hour",
-                min_value=int(df["hour"].min()),
-                max_value=int(df["hour"].max()),
-                value=(int(df["hour"].min()), int(df["hour"].max()))
+                min_value=hour_min,
+                max_value=hour_max,
+                value=(hour_min, hour_max)
             )
-            df_filtered = df_filtered[df_filtered["hour"].between(*hour_range)]
 
-            day_range = container.slider(
+            day_min, day_max = (int(v) for v in column_bounds(index, "day"))
+            spec["day"] = container.slider(
                 "Filter by Day",
-                min_value=int(df["day"].min()),
-                max_value=int(df["day"].max()),
-                value=(int(df["day"].min()), int(df["day"].max()))
+                min_value=day_min,
+                max_value=day_max,
+                value=(day_min, day_max)
             )
-            df_filtered = df_filtered[df_filtered["day"].between(*day_range)]
 
         # ---- Filter by date interval ----
         if container.toggle("Filter between dates", False):
+            date_min, date_max = (pd.Timestamp(v) for v in column_bounds(index, "date"))
             date_interval = container.date_input(
                 "Pick two dates for filtering",
-                (df_filtered["date"].min(), df_filtered["date"].max())
+                (date_min, date_max)
             )
-            start, end = pd.to_datetime(date_interval[0]), pd.to_datetime(date_interval[1])
-            df_filtered = df_filtered[(df_filtered["date"] >= start) & (df_filtered["date"] <= end)]
+            # While the user is still picking, the widget only holds the start date
+            if len(date_interval) == 2:
+                spec["date"] = (pd.to_datetime(date_interval[0]), pd.to_datetime(date_interval[1]))
+
+    return spec
 
-    return df_filtered
+
+def apply_temporal_filters(df, container=None, expanded=True):
+    """
+    Apply temporal filters to a dataframe. Can render in sidebar or in any Streamlit container.
+
+    Args:
+        df: DataFrame to filter
+        container: Streamlit container (st.sidebar, st.container, or a column)
+        expanded: whether the filters expander starts open
+
+    Returns:
+        Filtered DataFrame
+    """
+    return filter_frame(df, temporal_filter_spec(df, container=container, expanded=expanded))
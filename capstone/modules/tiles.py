@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+from modules.instrumentation import prometheus_text
+from modules.memo import LRUCache, frame_key
+from modules.stats import date_strings
+
+# Points are indexed on the tile grid of this zoom level; any coarser tile is a key range
+INDEX_ZOOM = 20
+MAX_FEATURES = 5000
+TILE_PORT = int(os.environ.get("ACCIDENT_TILE_PORT", 8765))
+# Address the browser uses to reach the tile server (differs from localhost behind a proxy)
+TILE_BASE_URL = os.environ.get("ACCIDENT_TILE_URL", f"http://localhost:{TILE_PORT}")
+
+PROPERTY_COLUMNS = ["id", "date_str", "weekday", "hour",
+                    "minor_injuries_30d", "serious_injuries_30d", "fatalities_30d"]
+
+_INDEX_CACHE = LRUCache(maxsize=8)
+_TILE_CACHE = LRUCache(maxsize=4096, max_bytes=128 * 1024 * 1024, sizeof=len)
+
+logger = logging.getLogger("accidents.tiles")
+
+
+# ---- Tile math (Web Mercator / slippy map tiles) ----
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Fractional tile coordinates of longitude/latitude arrays at `zoom`."""
+    lat = np.clip(np.radians(np.asarray(lat, dtype=np.float64)), -1.4844, 1.4844)
+    n = 2.0 ** zoom
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * n
+    return x, y
+
+
+def tile_bounds(z, x, y):
+    """(min_lon, min_lat, max_lon, max_lat) of a tile."""
+    n = 2.0 ** z
+    lon_min, lon_max = x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+    lat_max = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    lat_min = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n))))
+    return lon_min, lat_min, lon_max, lat_max
+
+
+def _spread_bits(v):
+    v = v.astype(np.uint64)
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                        (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+                        (1, 0x5555555555555555)]:
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton_key(tile_x, tile_y):
+    """Interleave tile x/y bits (Z-order), so every tile is a contiguous range of child keys."""
+    return _spread_bits(np.asarray(tile_x)) | (_spread_bits(np.asarray(tile_y)) << np.uint64(1))
+
+
+def tile_key_range(z, x, y, index_zoom=INDEX_ZOOM):
+    """[start, stop) of the index keys covered by tile z/x/y."""
+    shift = np.uint64(2 * (index_zoom - z))
+    start = morton_key(np.array([x]), np.array([y]))[0] << shift
+    return start, start + (np.uint64(1) << shift)
+
+
+# ---- Spatial index ----
+
+def build_tile_index(df, index_zoom=INDEX_ZOOM):
+    """Sort the rows by their Z-order key at `index_zoom`; a tile lookup is then two binary searches."""
+    x, y = lonlat_to_tile(df["longitude"].to_numpy(), df["latitude"].to_numpy(), index_zoom)
+    limit = 2 ** index_zoom - 1
+    keys = morton_key(np.clip(x, 0, limit).astype(np.uint64), np.clip(y, 0, limit).astype(np.uint64))
+    order = np.argsort(keys, kind="stable")
+    return {"keys": keys[order], "order": order, "index_zoom": index_zoom}
+
+
+def get_tile_index(df):
+    return _INDEX_CACHE.get_or_create(frame_key(df), lambda: build_tile_index(df))
+
+
+def tile_positions(index, z, x, y):
+    """Row positions of the points inside tile z/x/y."""
+    start, stop = tile_key_range(z, x, y, index["index_zoom"])
+    low = np.searchsorted(index["keys"], start, side="left")
+    high = np.searchsorted(index["keys"], stop, side="left")
+    return index["order"][low:high]
+
+
+# ---- Tile content ----
+
+def accident_tile(df, z, x, y, max_features=MAX_FEATURES):
+    """GeoJSON FeatureCollection of the accidents in a tile (evenly thinned above `max_features`)."""
+    positions = tile_positions(get_tile_index(df), z, x, y)
+    total = len(positions)
+    if total > max_features:
+        positions = positions[np.linspace(0, total - 1, max_features).astype(np.int64)]
+
+    rows = df.take(np.sort(positions))
+    lon = rows["longitude"].astype("float64").round(6).to_numpy().tolist()
+    lat = rows["latitude"].astype("float64").round(6).to_numpy().tolist()
+    rows = rows.assign(date_str=date_strings(rows))
+    columns = [c for c in PROPERTY_COLUMNS if c in rows.columns]
+    properties = rows[columns].astype(object).where(rows[columns].notna(), None).to_dict("records")
+    features = [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [x_, y_]}, "properties": p}
+        for x_, y_, p in zip(lon, lat, properties)
+    ]
+    return {"type": "FeatureCollection", "features": features,
+            "total": total, "truncated": total > len(features)}
+
+
+def boundary_tile(boundary_gdf, z, x, y):
+    """GeoJSON of the (display) boundary clipped to a tile."""
+    geometries = shapely.clip_by_rect(boundary_gdf.geometry.to_numpy(), *tile_bounds(z, x, y))
+    features = [
+        {"type": "Feature", "geometry": mapping(g), "properties": {}}
+        for g in geometries if not g.is_empty
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+# ---- Tile server ----
+
+# Published layers, and the most recent layer names of each session (a layer is kept while
+# some session still lists it, so one busy session cannot evict the layers of the others)
+_LAYERS = {}
+_SESSION_LAYERS = {}
+_LAYERS_LOCK = threading.Lock()
+_SERVER = None
+MAX_SESSION_LAYERS = 4
+MAX_SESSIONS = 64
+
+_TILE_PATH = re.compile(r"^/(?P<layer>[\w-]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.geojson$")
+
+
+def publish_layer(name, data, kind="points", session=None):
+    """
+    Make a frame (kind="points") or boundary GeoDataFrame (kind="boundary") available as
+    tiles under /<name>/{z}/{x}/{y}.geojson. Each `session` (e.g. one browser tab) keeps its
+    MAX_SESSION_LAYERS most recent layers, and the MAX_SESSIONS most recent sessions are kept.
+    Rendered tiles are cached by name, so the name must identify the content (see `layer_name`).
+    Returns the URL template for the browser.
+    """
+    with _LAYERS_LOCK:
+        _LAYERS[name] = (kind, data)
+        names = _SESSION_LAYERS.pop(session, [])
+        names = [n for n in names if n != name][-(MAX_SESSION_LAYERS - 1):] + [name]
+        _SESSION_LAYERS[session] = names
+        while len(_SESSION_LAYERS) > MAX_SESSIONS:
+            _SESSION_LAYERS.pop(next(iter(_SESSION_LAYERS)))
+        listed = {n for names in _SESSION_LAYERS.values() for n in names}
+        for unused in [n for n in _LAYERS if n not in listed]:
+            del _LAYERS[unused]
+    return f"{TILE_BASE_URL}/{name}/{{z}}/{{x}}/{{y}}.geojson"
+
+
+def render_tile(name, z, x, y):
+    """Encoded GeoJSON tile of a published layer, or None if the layer is unknown."""
+    with _LAYERS_LOCK:
+        layer = _LAYERS.get(name)
+    if layer is None:
+        return None
+    kind, data = layer
+    key = (name, z, x, y)
+
+    def build():
+        if kind == "boundary":
+            tile = boundary_tile(data, z, x, y)
+        else:
+            tile = accident_tile(data, z, x, y)
+        return json.dumps(tile, separators=(",", ":")).encode()
+
+    return _TILE_CACHE.get_or_create(key, build)
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """Serves /<layer>/{z}/{x}/{y}.geojson for the published layers, and /metrics (modules.instrumentation)."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            self._send_metrics()
+            return
+        match = _TILE_PATH.match(self.path.split("?")[0])
+        body = None
+        if match:
+            z, x, y = int(match["z"]), int(match["x"]), int(match["y"])
+            if 0 <= z <= INDEX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z:
+                body = render_tile(match["layer"], z, x, y)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/geo+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "public, max-age=300")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_metrics(self):
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_tile_server(host="127.0.0.1", port=TILE_PORT):
+    """
+    Start the tile server in a background thread (once per process) and return it.
+
+    Returns None if the port is taken, e.g. by the tile server of another worker process:
+    layers live in the memory of the process that publishes them, so that server cannot
+    serve this process's tiles.
+    """
+    global _SERVER
+    with _LAYERS_LOCK:
+        if _SERVER is None:
+            try:
+                _SERVER = ThreadingHTTPServer((host, port), TileRequestHandler)
+            except OSError as e:
+                logger.warning("Tile server not started on %s:%s: %s", host, port, e)
+                return None
+            _SERVER.daemon_threads = True
+            threading.Thread(target=_SERVER.serve_forever, daemon=True).start()
+    return _SERVER
+
+
+def layer_name(key):
+    """URL-safe layer name for a cache key such as `filter_state_key(...)`."""
+    return re.sub(r"[^\w-]", "", "-".join(str(part)[:12] for part in key))
@@ -0,0 +1,106 @@
+"""
+Validation stage of the load pipeline.
+
+Coordinates are checked against the city boundary in bulk: a bounding-box comparison discards
+obvious outliers and only the remaining points are tested against the prepared polygon with
+`shapely.contains_xy`, without building any Point objects. Data-quality statistics (missing
+values, duplicate rows) are computed once per dataset version and stored in `cache_dir`.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import shapely
+
+from modules.accident_store import CACHE_DIR, _atomic_write_json
+from modules.memo import LRUCache, frame_key
+from modules.stats import dataset_inspection
+
+# Boundary masks and validation reports per (row selection, boundary), and quality stats per dataset version
+_BOUNDARY_MASK_CACHE = LRUCache(maxsize=8)
+_REPORT_CACHE = LRUCache(maxsize=8)
+_QUALITY_CACHE = LRUCache(maxsize=8)
+_INSIDE_FRAME_CACHE = LRUCache(maxsize=2)
+
+
+def inside_boundary(lon, lat, boundary):
+    """Boolean mask of the (lon, lat) points strictly inside `boundary` (missing coordinates are outside)."""
+    lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    min_x, min_y, max_x, max_y = boundary.bounds
+    inside = (lon >= min_x) & (lon <= max_x) & (lat >= min_y) & (lat <= max_y)
+
+    candidates = np.flatnonzero(inside)
+    shapely.prepare(boundary)
+    inside[candidates] = shapely.contains_xy(boundary, lon[candidates], lat[candidates])
+    return inside
+
+
+def _boundary_hash(boundary):
+    return hashlib.sha1(shapely.to_wkb(boundary)).hexdigest()[:16]
+
+
+def boundary_mask(df, boundary):
+    """`inside_boundary` for the rows of `df`, cached per (row selection, boundary)."""
+    return _BOUNDARY_MASK_CACHE.get_or_create(
+        (frame_key(df), _boundary_hash(boundary)),
+        lambda: inside_boundary(df["longitude"], df["latitude"], boundary),
+    )
+
+
+def validate_accidents(df, boundary, action="flag"):
+    """
+    Check the accident coordinates against the city boundary.
+
+    Returns (frame, report). With action="drop" the frame keeps only the rows inside the
+    boundary; with action="flag" it is returned unchanged. The report counts the rows outside
+    the boundary and the rows with missing coordinates; it is computed once per (row
+    selection, boundary).
+    """
+    mask = boundary_mask(df, boundary)
+    report = _REPORT_CACHE.get_or_create((frame_key(df), _boundary_hash(boundary)), lambda: {
+        "outside_boundary": int((~mask).sum()),
+        "missing_coordinates": int((df["longitude"].isna() | df["latitude"].isna()).sum()),
+    })
+    if action == "drop" and report["outside_boundary"]:
+        # Same frame object on every rerun, so caches keyed on it keep hitting
+        df = _INSIDE_FRAME_CACHE.get_or_create((frame_key(df), _boundary_hash(boundary)),
+                                               lambda: _inside_frame(df, mask, boundary))
+    return df, report
+
+
+def _inside_frame(df, mask, boundary):
+    # The selection is a dataset of its own: caches keyed on the version (filter states,
+    # map layers, pyramids) must not serve it the entries of the full frame
+    inside = df.iloc[np.flatnonzero(mask)]
+    inside.attrs = dict(df.attrs)
+    if "dataset_version" in df.attrs:
+        inside.attrs["dataset_version"] = f"{df.attrs['dataset_version']}-inside-{_boundary_hash(boundary)}"
+    return inside
+
+
+def dataset_quality(df, cache_dir=CACHE_DIR):
+    """
+    `stats.dataset_inspection` of `df`, computed once per dataset version and column set.
+
+    Frames with a `dataset_version` attr (modules.accident_store, modules.ingest) have their
+    statistics stored as JSON in `cache_dir`; other frames are inspected directly.
+    """
+    version = df.attrs.get("dataset_version")
+    if version is None:
+        return dataset_inspection(df)
+
+    columns = hashlib.sha1(json.dumps(list(map(str, df.columns))).encode()).hexdigest()[:8]
+    key = f"{version}_{columns}_{len(df)}"
+
+    def load():
+        path = os.path.join(cache_dir, f"quality_{key}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        quality = {name: int(value) for name, value in dataset_inspection(df).items()}
+        os.makedirs(cache_dir, exist_ok=True)
+        _atomic_write_json(path, quality)
+        return quality
+
+    return _QUALITY_CACHE.get_or_create(key, load)
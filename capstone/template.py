@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
 import folium
 from streamlit_folium import st_folium
 import osmnx as ox
@@ -174,7 +173,7 @@ if len(df_filtered)>=1:
     # Convert to GeoDataFrame
     gdf = gpd.GeoDataFrame(
         df_filtered,
-        geometry=[Point(xy) for xy in zip(df_filtered["longitude"], df_filtered["latitude"])],
+        geometry=gpd.points_from_xy(df_filtered["longitude"], df_filtered["latitude"]),
         crs="EPSG:4326"
     )
 
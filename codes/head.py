@@ -1,7 +1,6 @@
 import geopandas as gpd
 import pandas as pd
 import streamlit as st
-from shapely.geometry import Point
 
 # Define data source
 BASE_URL = "https://raw.githubusercontent.com/tamagusko/geospatial-data-science-course/main/data/"
@@ -11,8 +10,7 @@ FILE_NAME = "Road_Accidents_Lisbon.csv"
 df = pd.read_csv(BASE_URL + FILE_NAME)
 
 # Convert to GeoDataFrame
-df["geometry"] = [Point(xy) for xy in zip(df.longitude, df.latitude)]
-gdf = gpd.GeoDataFrame(df, geometry="geometry")
+gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df.longitude, df.latitude))
 
 # Display in Streamlit
 st.title("Accident Dashboard")
@@ -2,7 +2,6 @@ import streamlit as st
 import pandas as pd
 import geopandas as gpd
 import folium
-from shapely.geometry import Point
 from streamlit_folium import st_folium
 
 # Set page config
@@ -19,7 +18,7 @@ df = pd.read_csv("data/Road_Accidents_Lisbon.csv")
 # Convert to GeoDataFrame
 gdf = gpd.GeoDataFrame(
     df,
-    geometry=[Point(xy) for xy in zip(df.longitude, df.latitude)],
+    geometry=gpd.points_from_xy(df.longitude, df.latitude),
     crs="EPSG:4326"
 )
 